@@ -8,6 +8,9 @@ pip install torch
 pip install pytorch_lightning
 pip install tarski
 
+# For export.py --format onnx and plan.py --backend onnxruntime
+pip install onnx onnxscript onnxruntime
+
 # For policy server
 pip install grpcio
 pip install protobuf
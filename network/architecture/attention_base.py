@@ -1,26 +1,16 @@
 import torch
 import torch.nn as nn
-import pytorch_lightning as pl
+
+from .messages import MessageLayout, RelationMessages, checkpointed_iterations, fixed_noise
 
 # Imports related to type annotations
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 from torch.nn.functional import Tensor, hinge_embedding_loss
 
 
-class RelationMessagePassing(nn.Module):
+class RelationMessagePassing(RelationMessages):
     def __init__(self, relations: List[Tuple[int, int]], hidden_size: int):
-        super().__init__()
-        self.hidden_size = hidden_size
-        self.relation_modules = nn.ModuleList()
-        for relation, arity in relations:
-            assert relation == len(self.relation_modules)
-            input_size = arity * hidden_size
-            output_size = arity * hidden_size
-            if (input_size > 0) and (output_size > 0):
-                mlp = nn.Sequential(nn.Linear(input_size, input_size, True), nn.ReLU(), nn.Linear(input_size, output_size, True))
-            else:
-                mlp = None
-            self.relation_modules.append(mlp)
+        super().__init__(relations, hidden_size)
         self.query_weight = nn.Linear(hidden_size, hidden_size, False)
         self.key_weight = nn.Linear(hidden_size, hidden_size, False)
         self.value_weight = nn.Linear(hidden_size, hidden_size, False)
@@ -30,25 +20,51 @@ class RelationMessagePassing(nn.Module):
     def get_device(self):
         return self.dummy.device
 
-    def forward(self, node_states: Tensor, relations: Dict[int, Tensor]) -> Tuple[Tensor, Tensor]:
+    def _attention_indices(self, layout: MessageLayout, num_nodes: int) -> Tuple[Tensor, Tensor, Tensor, Tensor]:
+        # The messages of each recipient form a group of consecutive slots once sorted. Within a group,
+        # the attention pairs the query of the object with the index of every slot, as a row, with the
+        # key and value of every slot, as a column, and divides the scores by the square root of the
+        # size of the group; rows from the number of objects on have no query and are dropped.
+        # Returns the order of the messages and the rows, columns and scales of the pairs.
+        if 'order' not in layout.indices:
+            recipients = layout.recipients
+            order = torch.sort(recipients, stable=True)[1]
+            lengths = torch.bincount(recipients, minlength=num_nodes)
+            sorted_recipients = recipients.index_select(0, order)
+            slot_lengths = lengths.index_select(0, sorted_recipients)
+            slot_starts = (torch.cumsum(lengths, 0) - lengths).index_select(0, sorted_recipients)
+            columns = torch.repeat_interleave(torch.arange(recipients.shape[0], device=recipients.device), slot_lengths)
+            pair_starts = torch.cumsum(slot_lengths, 0) - slot_lengths
+            rows = slot_starts.index_select(0, columns) + torch.arange(columns.shape[0], device=recipients.device) - pair_starts.index_select(0, columns)
+            kept = rows < num_nodes
+            rows, columns = rows[kept], columns[kept]
+            layout.indices['order'] = order
+            layout.indices['rows'] = rows
+            layout.indices['columns'] = columns
+            layout.indices['scales'] = torch.sqrt(slot_lengths.index_select(0, columns).to(torch.float))
+        return layout.indices['order'], layout.indices['rows'], layout.indices['columns'], layout.indices['scales']
+
+    def forward(self, node_states: Tensor, relations: Dict[int, Tensor], layout: Optional[MessageLayout] = None) -> Tensor:
+        if layout is None:
+            layout = self.layout(node_states, relations)
         # Compute an aggregated message for each recipient
-        messages = [[] for _ in range(node_states.shape[0])]
-        for relation, module in enumerate(self.relation_modules):
-            if (module is not None) and (relation in relations):
-                values = relations[relation]
-                input = torch.index_select(node_states, 0, values).view(-1, module[0].in_features)
-                output = module(input).view(-1, self.hidden_size)
-                node_indices = values.view(-1, 1)
-                for index, node_index in enumerate(node_indices):
-                    messages[node_index].append(output[index])
+        outputs = self.messages(node_states, relations, layout)
+        order, rows, columns, scales = self._attention_indices(layout, node_states.shape[0])
+        # messages grouped by recipient, each group in the order in which the messages were computed
+        messages = outputs.index_select(0, order)
         queries = self.query_weight(node_states)
-        lengths = [len(message) for message in messages]
-        starts = [sum(lengths[:index]) for index in range(len(lengths))]
-        ends = [starts[index] + lengths[index] for index in range(len(lengths))]
-        messages = torch.cat([torch.stack(message) for message in messages])
         keys = self.key_weight(messages)
         values = self.value_weight(messages)
-        attentions = torch.cat([torch.matmul(torch.softmax(torch.div(torch.matmul(queries[starts[index]:ends[index]], keys[starts[index]:ends[index]].T), lengths[index] ** 0.5), dim=0), values[starts[index]:ends[index]]) for index in range(len(lengths))]).squeeze()
+        # segmented softmax over the (row, column) pairs of all groups: the scores of each column are
+        # normalized over the rows of its group, and the weighted values of the columns are summed per row
+        scores = torch.sum(queries.index_select(0, rows) * keys.index_select(0, columns), dim=1) / scales
+        max_scores = scores.new_zeros((messages.shape[0],)).scatter_reduce_(0, columns, scores.detach(), 'amax', include_self=False)
+        exps = torch.exp(scores - max_scores.index_select(0, columns))
+        exps_sum = exps.new_zeros((messages.shape[0],)).scatter_add_(0, columns, exps)
+        weights = exps / exps_sum.index_select(0, columns)
+        weighted_values = weights.view(-1, 1) * values.index_select(0, columns)
+        attentions = self.buffer(layout, 'attentions', node_states.shape[0], self.hidden_size, weighted_values).zero_()
+        attentions = attentions.index_add_(0, rows, weighted_values)
         # attentions_2 = torch.matmul(torch.div(queries, keys.T), values)
         #  if lengths[index] > 0 else torch.zeros(self.hidden_size, device=self.get_device())
 
@@ -58,7 +74,7 @@ class RelationMessagePassing(nn.Module):
         # attention_messages = torch.stack([torch.matmul(torch.softmax(torch.div(torch.matmul(queries[index], keys[index]), messages[index].shape[0] ** 0.5), dim=0), values[index]) for index in range(len(messages))]).squeeze()
 
         # Update states with aggregated messages
-        next_node_states = self.update(torch.cat([attentions, node_states], dim=1))
+        next_node_states = self.update(self.update_input([attentions], node_states, layout))
         return next_node_states
 
 
@@ -68,34 +84,40 @@ class Readout(nn.Module):
         self.pre = nn.Sequential(nn.Linear(input_size, input_size, bias), nn.ReLU(), nn.Linear(input_size, input_size, bias))
         self.post = nn.Sequential(nn.Linear(input_size, input_size, bias), nn.ReLU(), nn.Linear(input_size, output_size, bias))
 
-    def forward(self, batch_num_objects: List[int], node_states: Tensor) -> Tensor:
-        results: List[Tensor] = []
-        offset: int = 0
+    def forward(self, batch_num_objects: List[int], node_states: Tensor, states: Optional[Tensor] = None) -> Tensor:
+        # states is the index of the state of each object
+        if states is None:
+            states = torch.repeat_interleave(torch.tensor(batch_num_objects, device=node_states.device))
+        # in float32 also under autocast: the sums over the objects and the heads need more precision than bfloat16
+        with torch.autocast(device_type='cpu', enabled=False):
+            with torch.autocast(device_type='cuda', enabled=False):
+                nodes: Tensor = self.pre(node_states.float())
+                output = self.post(nodes.new_zeros((len(batch_num_objects), nodes.shape[1])).index_add_(0, states, nodes))
+        return output
+
+    def feature_vectors(self, batch_num_objects: List[int], node_states: Tensor, states: Optional[Tensor] = None) -> Tensor:
+        # The sum of the objects of each state followed by the outputs of every layer of post; states is
+        # the index of the state of each object, which callers with more than one readout compute once.
+        if states is None:
+            states = torch.repeat_interleave(torch.tensor(batch_num_objects, device=node_states.device))
         nodes: Tensor = self.pre(node_states)
-        for num_objects in batch_num_objects:
-            results.append(self.post(torch.sum(nodes[offset:(offset + num_objects)], dim=0)))
-            offset += num_objects
-        return torch.stack(results)
-
-    def feature_vectors(self, batch_num_objects: List[int], node_states: Tensor) -> Tensor:
-        results: List[Tensor] = []
-        offset: int = 0
-        nodes: Tensor = self.pre(node_states)
-        for num_objects in batch_num_objects:
-            intermediate = []
-            intermediate.append(torch.sum(nodes[offset:(offset + num_objects)], dim=0))
-            for layer in self.post:
-                intermediate.append(layer(intermediate[-1]))
-            results.append(torch.cat(intermediate))
-            offset += num_objects
-        return torch.stack(results)
+        intermediate = [ nodes.new_zeros((len(batch_num_objects), nodes.shape[1])).index_add_(0, states, nodes) ]
+        for layer in self.post:
+            intermediate.append(layer(intermediate[-1]))
+        return torch.cat(intermediate, dim=1)
 
 
 class RelationMessagePassingModel(nn.Module):
+    _noise: Optional[Tensor]
+
     def __init__(self, relations: list, hidden_size: int, iterations: int):
         super().__init__()
         self.hidden_size = hidden_size
         self.iterations = iterations
+        self.deterministic = False
+        # iterations per segment whose activations are recomputed in the backward pass, 0 keeps all of them
+        self.checkpoint_iterations = 0
+        self._noise = None
         self.relation_network = RelationMessagePassing(relations, hidden_size)
         self.readout = Readout(hidden_size, 1)
         self.dummy = nn.Parameter(torch.empty(0))
@@ -104,40 +126,63 @@ class RelationMessagePassingModel(nn.Module):
         return self.dummy.device
 
     def forward(self, states: Tuple[Dict[int, Tensor], List[int]]):
-        node_states = self._initialize_nodes(sum(states[1]))
+        node_states = self._initialize_nodes(sum(states[1]), states[1])
         node_states = self._pass_messages(node_states, states[0])
         return self.readout(states[1], node_states)
 
     def feature_vectors(self, states: Tuple[Dict[int, Tensor], List[int]]):
-        node_states = self._initialize_nodes(sum(states[1]))
+        node_states = self._initialize_nodes(sum(states[1]), states[1])
         node_states = self._pass_messages(node_states, states[0])
         return self.readout.feature_vectors(states[1], node_states)
 
-    def _pass_messages(self, node_states: Tensor, relations: Dict[int, Tensor]) -> Tuple[Tensor, Tensor]:
+    def _pass_messages(self, node_states: Tensor, relations: Dict[int, Tensor]) -> Tensor:
+        # the layout of the messages doesn't change between iterations, and its buffers are reused by all of them
+        layout = self.relation_network.layout(node_states, relations)
+        if self.checkpoint_iterations > 0 and torch.is_grad_enabled():
+            return self._checkpointed_pass_messages(node_states, relations, layout)
         for _ in range(self.iterations):
-             node_states = self.relation_network(node_states, relations)
+            node_states = self.relation_network(node_states, relations, layout)
         return node_states
 
-    def _initialize_nodes(self, num_objects: int) -> Tensor:
+    @torch.jit.unused
+    def _checkpointed_pass_messages(self, node_states: Tensor, relations: Dict[int, Tensor], layout: MessageLayout) -> Tensor:
+        # the initial node states, with their noise, are drawn before the first segment, which recomputes from them
+        return checkpointed_iterations(lambda node_states: self.relation_network(node_states, relations, layout), node_states, self.iterations, self.checkpoint_iterations)
+
+    def _initialize_nodes(self, num_objects: int, batch_num_objects: Optional[List[int]] = None) -> Tensor:
         init_zeroes = torch.zeros((num_objects, (self.hidden_size // 2) + (self.hidden_size % 2)), dtype=torch.float, device=self.get_device())
-        init_random = torch.randn((num_objects, self.hidden_size // 2), device=self.get_device())
+        if self.deterministic and batch_num_objects is not None:
+            init_random, noise = fixed_noise(self._noise, batch_num_objects, self.hidden_size // 2, self.get_device())
+            self._noise = noise
+        else:
+            init_random = torch.randn((num_objects, self.hidden_size // 2), device=self.get_device())
         init_nodes = torch.cat([init_zeroes, init_random], dim=1)
         return init_nodes
 
 
-class AttentionModelBase(pl.LightningModule):
+class AttentionNetwork(nn.Module):
+    """Layers and forward pass of AttentionModelBase, without the Lightning training code."""
+
     def __init__(self, predicates: List[Tuple[str, int]], hidden_size: int, iterations: int):
         super().__init__()
-        self.save_hyperparameters()
         encoding = dict([(predicate, index) for index, (predicate, _) in enumerate(predicates)])
         arities = [(encoding[predicate], arity) for predicate, arity in predicates]
         self.encoding = encoding
         self.model = RelationMessagePassingModel(arities, hidden_size, iterations)
 
     def forward(self, states: Tuple[Dict[str, Tensor], List[int]]):
-        encoded_states = (dict([(self.encoding[name], values) for name, values in states[0].items()]), states[1])
+        encoded_states = ({ self.encoding[name]: values for name, values in states[0].items() }, states[1])
         return torch.abs(self.model(encoded_states))
 
     def feature_vectors(self, states: Tuple[Dict[str, Tensor], List[int]]):
-        encoded_states = (dict([(self.encoding[name], values) for name, values in states[0].items()]), states[1])
-        return torch.abs(self.model.feature_vectors(encoded_states))
\ No newline at end of file
+        encoded_states = ({ self.encoding[name]: values for name, values in states[0].items() }, states[1])
+        return torch.abs(self.model.feature_vectors(encoded_states))
+
+    @torch.jit.export
+    def set_deterministic(self, deterministic: bool = True):
+        """Use fixed noise for the initial object embeddings, so that the output for a state doesn't depend on the call."""
+        self.model.deterministic = deterministic
+
+    @property
+    def device(self) -> torch.device:
+        return self.model.get_device()
\ No newline at end of file
@@ -0,0 +1,143 @@
+import torch
+import torch.nn as nn
+
+# Imports related to type annotations
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple, Union
+from torch.nn.functional import Tensor
+
+from .add_base import AddNetwork
+from .add_max_base import AddExactMaxNetwork, AddMaxNetwork
+from .attention_base import AttentionNetwork
+from .max_base import ExactMaxNetwork, MaxNetwork
+from .max_readout_base import ExactMaxReadoutNetwork, MaxReadoutNetwork
+from .messages import fixed_noise
+
+g_torchscript_suffix = '.pt'
+g_onnx_suffix = '.onnx'
+
+# Maps (aggregation, readout) -> network with the layers of the models in g_model_classes
+g_network_classes = {
+    ('max',       True):  MaxReadoutNetwork,
+    ('max',       False): MaxNetwork,
+    ('add',       False): AddNetwork,
+    ('addmax',    False): AddMaxNetwork,
+    ('exactmax',  True):  ExactMaxReadoutNetwork,
+    ('exactmax',  False): ExactMaxNetwork,
+    ('addexactmax', False): AddExactMaxNetwork,
+    ('attention', True):  AttentionNetwork,
+    ('attention', False): AttentionNetwork
+}
+
+class ScriptedNetwork(nn.Module):
+    """Network loaded from TorchScript, with the device and set_deterministic() of the other networks."""
+
+    def __init__(self, network: torch.jit.ScriptModule):
+        super().__init__()
+        self.network = network
+
+    def forward(self, states: Tuple[Dict[str, Tensor], List[int]]):
+        return self.network(states)
+
+    def set_deterministic(self, deterministic: bool = True):
+        self.network.set_deterministic(deterministic)
+
+    @property
+    def device(self) -> torch.device:
+        return next(self.network.parameters()).device
+
+class OnnxNetwork(nn.Module):
+    """
+    Network exported to ONNX by export.py and run by onnxruntime on the CPU, with the device and
+    set_deterministic() of the other networks. The noise of the initial object embeddings is an
+    input of the ONNX graph; it is drawn here in the same way as in the networks.
+    """
+    _noise: Optional[Tensor]
+
+    def __init__(self, model: Union[Path, bytes]):
+        super().__init__()
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(model if isinstance(model, bytes) else str(model), options, providers=['CPUExecutionProvider'])
+        # inputs are the number of objects of each state, the noise and the atoms of each predicate
+        inputs = self.session.get_inputs()
+        self.predicates = [ input.name for input in inputs[2:] ]
+        self.noise_size = inputs[1].shape[1]
+        self.deterministic = False
+        self._noise = None
+
+    def forward(self, states: Tuple[Dict[str, Tensor], List[int]]) -> Tuple[Tensor, Tensor]:
+        relations, batch_num_objects = states
+        if self.deterministic:
+            noise, self._noise = fixed_noise(self._noise, batch_num_objects, self.noise_size, torch.device('cpu'))
+        else:
+            noise = torch.randn((sum(batch_num_objects), self.noise_size))
+        # predicates without atoms in the states are empty inputs
+        empty = torch.zeros((0,), dtype=torch.long).numpy()
+        inputs = { 'sizes': torch.tensor(batch_num_objects, dtype=torch.long).numpy(), 'noise': noise.numpy() }
+        for predicate in self.predicates:
+            inputs[predicate] = relations[predicate].cpu().numpy() if predicate in relations else empty
+        value, solvable = self.session.run(None, inputs)
+        return torch.from_numpy(value), torch.from_numpy(solvable)
+
+    def set_deterministic(self, deterministic: bool = True):
+        self.deterministic = deterministic
+
+    @property
+    def device(self) -> torch.device:
+        return torch.device('cpu')
+
+class AutocastNetwork(nn.Module):
+    """
+    Network loaded from a checkpoint that runs under torch.autocast, in bfloat16 by default, with
+    the device and set_deterministic() of the other networks. The relation and update MLPs run in
+    the reduced precision, while the readouts and heads stay in float32, so the outputs are float32.
+    TorchScript and ONNX networks aren't supported, as scripted code ignores the float32 regions.
+    """
+
+    def __init__(self, network: nn.Module, dtype: torch.dtype = torch.bfloat16):
+        super().__init__()
+        if isinstance(network, (ScriptedNetwork, OnnxNetwork)):
+            raise ValueError(f'Autocast runs networks loaded from checkpoints, got {type(network).__name__}')
+        self.network = network
+        self.dtype = dtype
+
+    def forward(self, states: Tuple[Dict[str, Tensor], List[int]]):
+        with torch.autocast(device_type=self.device.type, dtype=self.dtype):
+            return self.network(states)
+
+    def set_deterministic(self, deterministic: bool = True):
+        self.network.set_deterministic(deterministic)
+
+    @property
+    def device(self) -> torch.device:
+        return self.network.device
+
+def load_network(checkpoint_path: Path, aggregation: str = 'max', readout: bool = False, device = None, backend: str = 'torch') -> nn.Module:
+    """
+    Load the weights of a checkpoint into a plain network in evaluation mode, built from the
+    hyperparameters saved in the checkpoint. Gives the same outputs as the model loaded with
+    load_from_checkpoint(), but doesn't need pytorch_lightning or the training code.
+    TorchScript networks written by export.py (.pt files) are loaded as they are, and don't
+    need the aggregation and readout either. The onnxruntime backend runs ONNX networks
+    written by export.py --format onnx (.onnx files) on the CPU.
+    """
+    is_onnx = Path(checkpoint_path).suffix == g_onnx_suffix
+    if backend == 'onnxruntime' or is_onnx:
+        if backend != 'onnxruntime' or not is_onnx:
+            raise ValueError(f"The onnxruntime backend runs {g_onnx_suffix} networks written by export.py --format onnx, got '{checkpoint_path}' with backend '{backend}'")
+        return OnnxNetwork(checkpoint_path).eval()
+    if Path(checkpoint_path).suffix == g_torchscript_suffix:
+        return ScriptedNetwork(torch.jit.load(str(checkpoint_path), map_location='cpu')).to(device).eval()
+    try:
+        Network = g_network_classes[(aggregation, readout)]
+    except KeyError:
+        raise NotImplementedError(f"No model found for {(aggregation, readout, 'base')} combination")
+    checkpoint = torch.load(str(checkpoint_path), map_location='cpu', weights_only=False)
+    hyperparameters = checkpoint['hyper_parameters']
+    network = Network(hyperparameters['predicates'], hyperparameters['hidden_size'], hyperparameters['iterations'])
+    # as with load_from_checkpoint(strict=False), missing weights keep their initialization
+    network.load_state_dict(checkpoint['state_dict'], strict=False)
+    return network.to(device).eval()
\ No newline at end of file
@@ -1,54 +1,36 @@
 import torch
 import torch.nn as nn
-import pytorch_lightning as pl
+
+from .messages import MessageLayout, RelationMessages, checkpointed_iterations, fixed_noise
 
 # Imports related to type annotations
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 from torch.nn.functional import Tensor
 
 
-class RelationMessagePassing(nn.Module):
+class RelationMessagePassing(RelationMessages):
     def __init__(self, relations: List[Tuple[int, int]], hidden_size: int):
-        super().__init__()
-        self.hidden_size = hidden_size
-        self.relation_modules = nn.ModuleList()
-        for relation, arity in relations:
-            assert relation == len(self.relation_modules)
-            input_size = arity * hidden_size
-            output_size = arity * hidden_size
-            if (input_size > 0) and (output_size > 0):
-                mlp = nn.Sequential(nn.Linear(input_size, input_size, True), nn.ReLU(), nn.Linear(input_size, output_size, True))
-            else:
-                mlp = None
-            self.relation_modules.append(mlp)
+        super().__init__(relations, hidden_size)
         self.update = nn.Sequential(nn.Linear(2 * hidden_size, 2 * hidden_size, True), nn.ReLU(), nn.Linear(2 * hidden_size, hidden_size, True))
         self.dummy = nn.Parameter(torch.empty(0))
+        # the exact maximum of the messages instead of the smooth maximum, without parameters of its own
+        self.exact_max = False
 
     def get_device(self):
         return self.dummy.device
 
-    def forward(self, node_states: Tensor, relations: Dict[int, Tensor]) -> Tensor:
+    def forward(self, node_states: Tensor, relations: Dict[int, Tensor], layout: Optional[MessageLayout] = None) -> Tensor:
+        if layout is None:
+            layout = self.layout(node_states, relations)
         # Compute an aggregated message for each recipient
-        max_outputs = []
-        outputs = []
-        for relation, module in enumerate(self.relation_modules):
-            if (module is not None) and (relation in relations):
-                values = relations[relation]
-                input = torch.index_select(node_states, 0, values).view(-1, module[0].in_features)
-                output = module(input).view(-1, self.hidden_size)
-                max_outputs.append(torch.max(output))
-                node_indices = values.view(-1, 1).expand(-1, self.hidden_size)
-                outputs.append((output, node_indices))
-
-        max_offset = torch.max(torch.stack(max_outputs))
-        exps_sum = torch.full_like(node_states, 1E-16, device=self.get_device())
-        for output, node_indices in outputs:
-            exps = torch.exp(8.0 * (output - max_offset))
-            exps_sum = torch.scatter_add(exps_sum, 0, node_indices, exps)
+        outputs = self.messages(node_states, relations, layout)
+        if self.exact_max:
+            max_msg = self.max_messages(node_states, outputs, layout)
+        else:
+            max_msg = self.smooth_max_messages(node_states, outputs, layout)
 
         # Update states with aggregated messages
-        max_msg = ((1.0 / 8.0) * torch.log(exps_sum)) + max_offset
-        next_node_states = self.update(torch.cat([max_msg, node_states], dim=1))
+        next_node_states = self.update(self.update_input([max_msg], node_states, layout))
         return next_node_states
 
 
@@ -62,34 +44,44 @@ class Readout(nn.Module):
     def get_device(self):
         return self.dummy.device
 
-    def forward(self, batch_num_objects: List[int], node_states: Tensor) -> Tensor:
+    def forward(self, batch_num_objects: List[int], node_states: Tensor, last_objects: Optional[Tensor] = None) -> Tensor:
         # Loopless implementation, faster than the reference implementation.
-        cumsum_indices = torch.tensor(batch_num_objects, device=self.get_device()).cumsum(0) - 1  # TODO: This can be computed once.
-        cumsum_states = self.pre(node_states).cumsum(0).index_select(0, cumsum_indices)
-        aggregated_states = torch.cat((cumsum_states[0].view(1, -1), cumsum_states[1:] - cumsum_states[0:-1]))
-        return self.post(aggregated_states)
+        # The index of the last object of each state is passed by callers that read out a batch more than once.
+        if last_objects is None:
+            last_objects = torch.tensor(batch_num_objects, device=self.get_device()).cumsum(0) - 1
+        # in float32 also under autocast: the sums over the objects and the heads need more precision than bfloat16
+        with torch.autocast(device_type='cpu', enabled=False):
+            with torch.autocast(device_type='cuda', enabled=False):
+                cumsum_states = self.pre(node_states.float()).cumsum(0).index_select(0, last_objects)
+                aggregated_states = torch.cat((cumsum_states[0].view(1, -1), cumsum_states[1:] - cumsum_states[0:-1]))
+                output = self.post(aggregated_states)
+        return output
         # Reference implementation.
         # return self.post(torch.stack([torch.sum(nodes, dim=0) for nodes in self.pre(node_states).split(batch_num_objects)]))
 
-    def feature_vectors(self, batch_num_objects: List[int], node_states: Tensor) -> Tensor:
-        results: List[Tensor] = []
-        offset: int = 0
+    def feature_vectors(self, batch_num_objects: List[int], node_states: Tensor, states: Optional[Tensor] = None) -> Tensor:
+        # The sum of the objects of each state followed by the outputs of every layer of post; states is
+        # the index of the state of each object, which callers with more than one readout compute once.
+        if states is None:
+            states = torch.repeat_interleave(torch.tensor(batch_num_objects, device=self.get_device()))
         nodes: Tensor = self.pre(node_states)
-        for num_objects in batch_num_objects:
-            intermediate = []
-            intermediate.append(torch.sum(nodes[offset:(offset + num_objects)], dim=0))
-            for layer in self.post:
-                intermediate.append(layer(intermediate[-1]))
-            results.append(torch.cat(intermediate))
-            offset += num_objects
-        return torch.stack(results)
+        intermediate = [ nodes.new_zeros((len(batch_num_objects), nodes.shape[1])).index_add_(0, states, nodes) ]
+        for layer in self.post:
+            intermediate.append(layer(intermediate[-1]))
+        return torch.cat(intermediate, dim=1)
 
 
 class RelationMessagePassingModel(nn.Module):
+    _noise: Optional[Tensor]
+
     def __init__(self, relations: list, hidden_size: int, iterations: int):
         super().__init__()
         self.hidden_size = hidden_size
         self.iterations = iterations
+        self.deterministic = False
+        # iterations per segment whose activations are recomputed in the backward pass, 0 keeps all of them
+        self.checkpoint_iterations = 0
+        self._noise = None
         self.relation_network = RelationMessagePassing(relations, hidden_size)
         self.dummy = nn.Parameter(torch.empty(0))
 
@@ -97,26 +89,40 @@ class RelationMessagePassingModel(nn.Module):
         return self.dummy.device
 
     def forward(self, states: Tuple[Dict[int, Tensor], List[int]]) -> Tensor:
-        node_states = self._initialize_nodes(sum(states[1]))
+        node_states = self._initialize_nodes(sum(states[1]), states[1])
         node_states = self._pass_messages(node_states, states[0], states[1])
         return node_states
 
     def _pass_messages(self, node_states: Tensor, relations: Dict[int, Tensor], batch_num_objects: List[int]) -> Tensor:
+        # the layout of the messages doesn't change between iterations, and its buffers are reused by all of them
+        layout = self.relation_network.layout(node_states, relations)
+        if self.checkpoint_iterations > 0 and torch.is_grad_enabled():
+            return self._checkpointed_pass_messages(node_states, relations, layout)
         for _ in range(self.iterations):
-            node_states = self.relation_network(node_states, relations)
+            node_states = self.relation_network(node_states, relations, layout)
         return node_states
 
-    def _initialize_nodes(self, num_objects: int) -> Tensor:
+    @torch.jit.unused
+    def _checkpointed_pass_messages(self, node_states: Tensor, relations: Dict[int, Tensor], layout: MessageLayout) -> Tensor:
+        # the initial node states, with their noise, are drawn before the first segment, which recomputes from them
+        return checkpointed_iterations(lambda node_states: self.relation_network(node_states, relations, layout), node_states, self.iterations, self.checkpoint_iterations)
+
+    def _initialize_nodes(self, num_objects: int, batch_num_objects: Optional[List[int]] = None) -> Tensor:
         init_zeroes = torch.zeros((num_objects, (self.hidden_size // 2) + (self.hidden_size % 2)), dtype=torch.float, device=self.get_device())
-        init_random = torch.randn((num_objects, self.hidden_size // 2), device=self.get_device())
+        if self.deterministic and batch_num_objects is not None:
+            init_random, noise = fixed_noise(self._noise, batch_num_objects, self.hidden_size // 2, self.get_device())
+            self._noise = noise
+        else:
+            init_random = torch.randn((num_objects, self.hidden_size // 2), device=self.get_device())
         init_nodes = torch.cat([init_zeroes, init_random], dim=1)
         return init_nodes
 
 
-class MaxModelBase(pl.LightningModule):
+class MaxNetwork(nn.Module):
+    """Layers and forward pass of MaxModelBase, without the Lightning training code."""
+
     def __init__(self, predicates: List[Tuple[str, int]], hidden_size: int, iterations: int):
         super().__init__()
-        self.save_hyperparameters()
         encoding = dict([(predicate, index) for index, (predicate, _) in enumerate(predicates)])
         arities = [(encoding[predicate], arity) for predicate, arity in predicates]
         self.encoding = encoding
@@ -124,18 +130,20 @@ class MaxModelBase(pl.LightningModule):
         self.readout = Readout(hidden_size, 1)
         self.solvable_readout = Readout(hidden_size, 1)
 
-    def forward(self, states: Tuple[Dict[str, Tensor], List[int]]) -> Tensor:
-        encoded_states = (dict([(self.encoding[name], values) for name, values in states[0].items()]), states[1])
+    def forward(self, states: Tuple[Dict[str, Tensor], List[int]]) -> Tuple[Tensor, Tensor]:
+        encoded_states = ({ self.encoding[name]: values for name, values in states[0].items() }, states[1])
         node_states = self.model(encoded_states)
-        value = torch.abs(self.readout(encoded_states[1], node_states))
-        solvable = self.solvable_readout(encoded_states[1], node_states)
+        last_objects = torch.tensor(encoded_states[1], device=node_states.device).cumsum(0) - 1
+        value = torch.abs(self.readout(encoded_states[1], node_states, last_objects))
+        solvable = self.solvable_readout(encoded_states[1], node_states, last_objects)
         return value, solvable
 
     def feature_vectors(self, states: Tuple[Dict[int, Tensor], List[int]]) -> Tensor:
-        encoded_states = (dict([(self.encoding[name], values) for name, values in states[0].items()]), states[1])
+        encoded_states = ({ self.encoding[name]: values for name, values in states[0].items() }, states[1])
         node_states = self.model(encoded_states)
-        value = self.readout.feature_vectors(encoded_states[1], node_states)
-        solvable = self.solvable_readout.feature_vectors(encoded_states[1], node_states)
+        states = torch.repeat_interleave(torch.tensor(encoded_states[1], device=node_states.device))
+        value = self.readout.feature_vectors(encoded_states[1], node_states, states)
+        solvable = self.solvable_readout.feature_vectors(encoded_states[1], node_states, states)
         return value, solvable
 
     def freeze_relation_model(self):
@@ -146,4 +154,21 @@ class MaxModelBase(pl.LightningModule):
     def unfreeze_relation_model(self):
         """Unfreeze the relation message passing model."""
         for param in self.model.parameters():
-            param.requires_grad = True
\ No newline at end of file
+            param.requires_grad = True
+
+    @torch.jit.export
+    def set_deterministic(self, deterministic: bool = True):
+        """Use fixed noise for the initial object embeddings, so that the output for a state doesn't depend on the call."""
+        self.model.deterministic = deterministic
+
+    @property
+    def device(self) -> torch.device:
+        return self.model.get_device()
+
+
+class ExactMaxNetwork(MaxNetwork):
+    """MaxNetwork that aggregates messages with their exact maximum (scatter_reduce) instead of the smooth maximum; it has the same parameters."""
+
+    def __init__(self, predicates: List[Tuple[str, int]], hidden_size: int, iterations: int):
+        super().__init__(predicates, hidden_size, iterations)
+        self.model.relation_network.exact_max = True
\ No newline at end of file
@@ -0,0 +1,288 @@
+import math
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+
+# Imports related to type annotations
+from typing import Callable, List, Dict, NamedTuple, Optional, Tuple
+from torch.nn.functional import Tensor
+
+
+class MessageLayout(NamedTuple):
+    """
+    Structure of the messages of a batch, which doesn't change between the iterations of message
+    passing: the object that receives each message, the same indices expanded to the hidden size
+    for the scatter operations, the atoms and stacked weights of the fused relation MLPs, further
+    indices that an aggregation derives from the recipients in the first iteration, and buffers
+    for the aggregation that are reused by all iterations when autograd is off.
+    """
+    recipients: Tensor
+    node_indices: Tensor
+    # (arity, objects of the atoms including padding, atoms of each relation, rows without padding, weight, bias, weight, bias) of each arity
+    groups: List[Tuple[int, Tensor, List[int], Tensor, Tensor, Tensor, Tensor, Tensor]]
+    indices: Dict[str, Tensor]
+    buffers: Dict[str, Tensor]
+
+
+class RelationMessages(nn.Module):
+    """
+    Relation MLPs of RelationMessagePassing, one for each relation with positive arity, and the
+    messages they send to the objects of the atoms. The fused implementation runs the relations
+    of the same arity as one batched MLP, with torch.bmm over their stacked weights and the atoms
+    of each relation padded to the relation with most atoms, instead of one MLP per relation.
+    It launches far fewer kernels, which pays off on GPUs and for small batches; on the CPU,
+    the padding makes it slower than the loop when the relations have very different numbers
+    of atoms, so the loop is the default. Subclasses without float weights to stack, like the
+    quantized copies, replace _fused_groups() by _looped_groups().
+    The sparse aggregation sums the messages with a product by the (objects x messages) incidence
+    matrix in CSR form, built once per batch, instead of scatter_add() over the expanded indices.
+    It only applies without autograd, since the backward of the product converts the transposed
+    matrix back to CSR in every iteration, which makes training slower than with scatter_add().
+    """
+
+    def __init__(self, relations: List[Tuple[int, int]], hidden_size: int):
+        super().__init__()
+        self.hidden_size = hidden_size
+        self.fused = False
+        self.sparse = False
+        # modules by relation index, which has the same parameter names as a list; nullary relations have no module
+        self.relation_modules = nn.ModuleDict()
+        for relation, arity in relations:
+            input_size = arity * hidden_size
+            output_size = arity * hidden_size
+            if (input_size > 0) and (output_size > 0):
+                self.relation_modules[str(relation)] = nn.Sequential(nn.Linear(input_size, input_size, True), nn.ReLU(), nn.Linear(input_size, output_size, True))
+
+    def layout(self, node_states: Tensor, relations: Dict[int, Tensor]) -> MessageLayout:
+        """Layout of the messages of relations, which the model builds once per batch and passes to every iteration."""
+        recipients: List[Tensor] = []
+        if self.fused:
+            groups = self._fused_groups(relations, recipients)
+        else:
+            groups = self._looped_groups(relations, recipients)
+        if len(recipients) == 0:
+            recipients_tensor = torch.zeros((0,), dtype=torch.long, device=node_states.device)
+        else:
+            recipients_tensor = torch.cat(recipients)
+        return MessageLayout(recipients_tensor, recipients_tensor.view(-1, 1).expand(-1, self.hidden_size), groups, {}, {})
+
+    def _fused_groups(self, relations: Dict[int, Tensor], recipients: List[Tensor]) -> List[Tuple[int, Tensor, List[int], Tensor, Tensor, Tensor, Tensor, Tensor]]:
+        # adds the atoms of the relations to recipients by arity, and returns the groups of the batched MLPs
+        groups: List[Tuple[int, Tensor, List[int], Tensor, Tensor, Tensor, Tensor, Tensor]] = []
+        # atoms and weights (values, weight, bias, weight, bias) of the relations by arity
+        arities: Dict[int, List[Tuple[Tensor, Tensor, Tensor, Tensor, Tensor]]] = {}
+        for key, module in self.relation_modules.items():
+            relation = int(key)
+            if relation in relations:
+                arity = module[0].in_features // self.hidden_size
+                if arity not in arities:
+                    group: List[Tuple[Tensor, Tensor, Tensor, Tensor, Tensor]] = []
+                    arities[arity] = group
+                arities[arity].append((relations[relation], module[0].weight, module[0].bias, module[2].weight, module[2].bias))
+        for arity, group in arities.items():
+            values = torch.cat([ entry[0] for entry in group ])
+            recipients.append(values)
+            counts = [ entry[0].shape[0] // arity for entry in group ]
+            if len(group) == 1:
+                groups.append((arity, values, counts, values.new_zeros((0,)), group[0][1], group[0][2], group[0][3], group[0][4]))
+                continue
+            # the batch has as many rows for each relation as the relation with most atoms; the objects of the
+            # padding rows are 0, and their outputs are dropped by keeping the rows without padding
+            rows = max(counts)
+            padded_values = values
+            kept = values.new_zeros((0,))
+            if min(counts) < rows:
+                padded: List[Tensor] = []
+                for entry, count in zip(group, counts):
+                    padded.append(entry[0])
+                    if count < rows: padded.append(entry[0].new_zeros(((rows - count) * arity,)))
+                padded_values = torch.cat(padded)
+                kept = torch.cat([ torch.arange(index * rows, index * rows + count, device=values.device) for index, count in enumerate(counts) ])
+            weight1 = torch.stack([ entry[1] for entry in group ]).transpose(1, 2)
+            bias1 = torch.stack([ entry[2] for entry in group ]).unsqueeze(1)
+            weight2 = torch.stack([ entry[3] for entry in group ]).transpose(1, 2)
+            bias2 = torch.stack([ entry[4] for entry in group ]).unsqueeze(1)
+            groups.append((arity, padded_values, counts, kept, weight1, bias1, weight2, bias2))
+        return groups
+
+    def _looped_groups(self, relations: Dict[int, Tensor], recipients: List[Tensor]) -> List[Tuple[int, Tensor, List[int], Tensor, Tensor, Tensor, Tensor, Tensor]]:
+        # adds the atoms of the relations to recipients in the order of the loop, which runs without groups
+        groups: List[Tuple[int, Tensor, List[int], Tensor, Tensor, Tensor, Tensor, Tensor]] = []
+        for key, module in self.relation_modules.items():
+            relation = int(key)
+            if relation in relations: recipients.append(relations[relation])
+        return groups
+
+    def messages(self, node_states: Tensor, relations: Dict[int, Tensor], layout: MessageLayout) -> Tensor:
+        """Messages of the atoms of all relations, which the objects in layout.recipients receive."""
+        # the layout decides, as the order of the messages has to match its recipients
+        if len(layout.groups) > 0:
+            outputs = self._fused_messages(node_states, layout)
+        else:
+            outputs = self._looped_messages(node_states, relations)
+        if len(outputs) == 0:
+            return node_states.new_zeros((0, self.hidden_size))
+        if not self._reuses_buffers():
+            return torch.cat(outputs)
+        return torch.cat(outputs, out=self.buffer(layout, 'messages', layout.recipients.shape[0], self.hidden_size, outputs[0]))
+
+    def _looped_messages(self, node_states: Tensor, relations: Dict[int, Tensor]) -> List[Tensor]:
+        outputs: List[Tensor] = []
+        for key, module in self.relation_modules.items():
+            relation = int(key)
+            if relation in relations:
+                input = torch.index_select(node_states, 0, relations[relation]).view(-1, module[0].in_features)
+                outputs.append(module(input).view(-1, self.hidden_size))
+        return outputs
+
+    def _fused_messages(self, node_states: Tensor, layout: MessageLayout) -> List[Tensor]:
+        outputs: List[Tensor] = []
+        for arity, values, counts, kept, weight1, bias1, weight2, bias2 in layout.groups:
+            if len(counts) == 1:
+                input = torch.index_select(node_states, 0, values).view(-1, arity * self.hidden_size)
+                output = F.linear(F.relu(F.linear(input, weight1, bias1)), weight2, bias2)
+            else:
+                input = torch.index_select(node_states, 0, values).view(len(counts), -1, arity * self.hidden_size)
+                output = torch.baddbmm(bias2, F.relu(torch.baddbmm(bias1, input, weight1)), weight2)
+                if kept.shape[0] > 0: output = output.view(-1, arity * self.hidden_size).index_select(0, kept)
+            outputs.append(output.view(-1, self.hidden_size))
+        return outputs
+
+    def _reuses_buffers(self) -> bool:
+        # autograd keeps the inputs of every iteration, and the ONNX exporter can't trace out= arguments
+        return not torch.is_grad_enabled() and not torch.jit.is_tracing()
+
+    def buffer(self, layout: MessageLayout, name: str, rows: int, columns: int, like: Tensor) -> Tensor:
+        """Uninitialized buffer, which is kept in layout and reused by all iterations when autograd is off."""
+        if not self._reuses_buffers():
+            return like.new_empty((rows, columns))
+        if name in layout.buffers:
+            buffer = layout.buffers[name]
+            if buffer.shape[0] == rows and buffer.shape[1] == columns and buffer.dtype == like.dtype and buffer.device == like.device:
+                return buffer
+        buffer = like.new_empty((rows, columns))
+        layout.buffers[name] = buffer
+        return buffer
+
+    def incidence(self, layout: MessageLayout, num_nodes: int, like: Tensor) -> Tensor:
+        """Sparse (objects x messages) matrix in CSR form with a 1 for each message and its recipient, built in the first iteration."""
+        if 'incidence' not in layout.indices:
+            # the messages of each object as a row, in the order in which they were computed
+            recipients = layout.recipients
+            columns = torch.sort(recipients, stable=True)[1]
+            rows = torch.zeros((num_nodes + 1,), dtype=torch.long, device=recipients.device)
+            rows[1:] = torch.cumsum(torch.bincount(recipients, minlength=num_nodes), 0)
+            values = torch.ones((recipients.shape[0],), dtype=like.dtype, device=like.device)
+            layout.indices['incidence'] = torch.sparse_csr_tensor(rows, columns, values, [ num_nodes, recipients.shape[0] ])
+        return layout.indices['incidence']
+
+    def sum_messages(self, node_states: Tensor, outputs: Tensor, layout: MessageLayout) -> Tensor:
+        """Sum of the messages of each object."""
+        # without autograd, as the buffers, and the ONNX exporter can't trace sparse tensors either;
+        # the product of a CSR matrix has no bfloat16 kernel on the CPU
+        if self.sparse and self._reuses_buffers() and outputs.dtype != torch.bfloat16:
+            incidence = self.incidence(layout, node_states.shape[0], outputs)
+            return torch.mm(incidence, outputs, out=self.buffer(layout, 'sum', node_states.shape[0], self.hidden_size, outputs))
+        sum_msg = self.buffer(layout, 'sum', node_states.shape[0], self.hidden_size, outputs).zero_()
+        return sum_msg.scatter_add_(0, layout.node_indices, outputs)
+
+    def smooth_max_messages(self, node_states: Tensor, outputs: Tensor, layout: MessageLayout) -> Tensor:
+        """Smooth maximum of the messages of each object, 1/8 of the logarithm of 1e-16 plus the sum of exp(8 * message)."""
+        # The messages are offset by the maximum of all messages, as log(1e-16 + sum(exp(8 * (message - offset)))) / 8
+        # + offset, but their exponentials would underflow for the objects whose messages are much smaller, more so in
+        # reduced precision. The same value is computed from the sums of exp(8 * (message - maximum of the object)),
+        # which are at least 1, as logaddexp(log(sum) + 8 * (maximum of the object - offset), log(1e-16)) / 8 + offset;
+        # objects without messages have -inf as maximum and 1 as sum, which gives log(1e-16) / 8 + offset.
+        # logaddexp(a, c) is max(a, c) + log1p(exp(-abs(a - c))), as the ONNX exporter doesn't support logaddexp().
+        log_epsilon = math.log(1E-16)
+        max_offset = torch.max(outputs)
+        max_offsets = self._detached_max_messages(node_states, outputs, layout)
+        exps_sum = self.buffer(layout, 'exps_sum', node_states.shape[0], self.hidden_size, outputs).zero_()
+        if not self._reuses_buffers():
+            exps_sum = exps_sum.scatter_add_(0, layout.node_indices, torch.exp(8.0 * (outputs - max_offsets.index_select(0, layout.recipients))))
+            log_sums = torch.log(exps_sum.masked_fill(max_offsets == float('-inf'), 1.0)) + 8.0 * (max_offsets - max_offset)
+            return (1.0 / 8.0) * (torch.clamp(log_sums, min=log_epsilon) + torch.log1p(torch.exp(-torch.abs(log_sums - log_epsilon)))) + max_offset
+        exps = torch.index_select(max_offsets, 0, layout.recipients, out=self.buffer(layout, 'exps', outputs.shape[0], self.hidden_size, outputs))
+        exps = torch.sub(outputs, exps, out=exps).mul_(8.0).exp_()
+        log_sums = exps_sum.scatter_add_(0, layout.node_indices, exps).masked_fill_(max_offsets == float('-inf'), 1.0).log_()
+        log_sums = log_sums.add_(max_offsets.sub_(max_offset).mul_(8.0))
+        corrections = torch.sub(log_sums, log_epsilon, out=max_offsets).abs_().neg_().exp_().log1p_()
+        return log_sums.clamp_(min=log_epsilon).add_(corrections).mul_(1.0 / 8.0).add_(max_offset)
+
+    def _detached_max_messages(self, node_states: Tensor, outputs: Tensor, layout: MessageLayout) -> Tensor:
+        # -inf for objects without messages; from -inf instead of with include_self=False, which the ONNX exporter doesn't support
+        max_msg = self.buffer(layout, 'max', node_states.shape[0], self.hidden_size, outputs).fill_(float('-inf'))
+        return max_msg.scatter_reduce_(0, layout.node_indices, outputs.detach(), 'amax')
+
+    def max_messages(self, node_states: Tensor, outputs: Tensor, layout: MessageLayout) -> Tensor:
+        """Maximum of the messages of each object, 0 for objects without messages."""
+        max_msg = self._detached_max_messages(node_states, outputs, layout)
+        max_msg = max_msg.masked_fill_(max_msg == float('-inf'), 0.0)
+        if not outputs.requires_grad:
+            return max_msg
+        # The gradient of each maximum goes to one message, the last one that attains it, through gather():
+        # every message has one recipient, so its backward adds to distinct positions and is deterministic,
+        # unlike the backward of scatter_reduce(), which splits the gradient among ties with scatter_add().
+        positions = torch.arange(outputs.shape[0], device=outputs.device).view(-1, 1).expand(-1, self.hidden_size)
+        winners = torch.where(outputs.detach() == max_msg.index_select(0, layout.recipients), positions, -1)
+        argmax = torch.full(node_states.shape, -1, dtype=torch.long, device=outputs.device).scatter_reduce_(0, layout.node_indices, winners, 'amax')
+        return outputs.gather(0, argmax.clamp(min=0)) * (argmax >= 0)
+
+    def update_input(self, aggregated: List[Tensor], node_states: Tensor, layout: MessageLayout) -> Tensor:
+        """Aggregated messages and node states side by side, the input of the update MLP."""
+        inputs = aggregated + [ node_states ]
+        if not self._reuses_buffers():
+            return torch.cat(inputs, dim=1)
+        return torch.cat(inputs, dim=1, out=self.buffer(layout, 'update', node_states.shape[0], len(inputs) * self.hidden_size, node_states))
+
+def fixed_noise(cache: Optional[Tensor], batch_num_objects: List[int], size: int, device: torch.device) -> Tuple[Tensor, Tensor]:
+    """
+    Fixed noise of size columns for the initial embeddings of the objects of a batch, and the rows
+    drawn so far, which the caller keeps as cache for the next call. The noise of an object only
+    depends on its index within its state, and the rows are drawn in blocks with fixed seeds, so
+    the networks, their TorchScript and ONNX exports give the same outputs for a state.
+    """
+    rows = max(batch_num_objects)
+    noise = cache
+    if noise is None or noise.shape[0] < rows or noise.device != device:
+        blocks: List[Tensor] = []
+        for block in range((rows + 255) // 256):
+            generator = torch.Generator()
+            generator.manual_seed(block)
+            blocks.append(torch.randn([ 256, size ], generator=generator))
+        noise = torch.cat(blocks).to(device)
+    sizes = torch.tensor(batch_num_objects, device=device)
+    indices = torch.arange(int(sizes.sum()), device=device) - torch.repeat_interleave(torch.cumsum(sizes, 0) - sizes, sizes)
+    return noise[indices], noise
+
+def _iterate(iteration: Callable[[Tensor], Tensor], node_states: Tensor, count: int) -> Tensor:
+    for _ in range(count):
+        node_states = iteration(node_states)
+    return node_states
+
+def checkpointed_iterations(iteration: Callable[[Tensor], Tensor], node_states: Tensor, iterations: int, segment: int) -> Tensor:
+    """
+    Apply iteration to node_states the given number of times, in segments of segment iterations
+    whose activations are recomputed in the backward pass by torch.utils.checkpoint: only the node
+    states at the start of each segment are kept. The non-reentrant variant runs the segments
+    with autograd on, so the aggregations allocate new tensors instead of reusing the buffers.
+    """
+    for start in range(0, iterations, segment):
+        node_states = checkpoint(_iterate, iteration, node_states, min(segment, iterations - start), use_reentrant=False)
+    return node_states
+
+def set_fused_messages(network: nn.Module, fused: bool = True):
+    """Choose between the fused and the looped relation MLPs in all message passing layers of network, also after scripting."""
+    for module in network.modules():
+        if hasattr(module, 'relation_modules') and hasattr(module, 'fused'): module.fused = fused
+
+def set_sparse_aggregation(network: nn.Module, sparse: bool = True):
+    """Choose between the sparse incidence matrix and scatter_add() for the sums of messages in all message passing layers of network, also after scripting."""
+    for module in network.modules():
+        if hasattr(module, 'relation_modules') and hasattr(module, 'sparse'): module.sparse = sparse
+
+def set_checkpoint_iterations(network: nn.Module, segment: int):
+    """Recompute the activations of every segment of iterations of message passing in the backward pass of network, 0 keeps all of them."""
+    for module in network.modules():
+        if hasattr(module, 'iterations') and hasattr(module, 'checkpoint_iterations'): module.checkpoint_iterations = segment
\ No newline at end of file
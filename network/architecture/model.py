@@ -2,9 +2,12 @@ import torch
 import torch.nn as nn
 import pytorch_lightning as pl
 
-from architecture import AddModelBase, MaxModelBase, MaxReadoutModelBase, AddMaxModelBase
-from architecture import supervised_optimal_loss, selfsupervised_optimal_loss, selfsupervised_suboptimal_loss, selfsupervised_suboptimal2_loss, unsupervised_optimal_loss, unsupervised_suboptimal_loss, l1_regularization
-from architecture.attention_base import AttentionModelBase
+from architecture.add_base import AddNetwork
+from architecture.add_max_base import AddExactMaxNetwork, AddMaxNetwork
+from architecture.attention_base import AttentionNetwork
+from architecture.max_base import ExactMaxNetwork, MaxNetwork
+from architecture.max_readout_base import ExactMaxReadoutNetwork, MaxReadoutNetwork
+from architecture.loss import supervised_optimal_loss, selfsupervised_optimal_loss, selfsupervised_suboptimal_loss, selfsupervised_suboptimal2_loss, unsupervised_optimal_loss, unsupervised_suboptimal_loss, l1_regularization
 from generators.plan import policy_search
 
 _max_trace_length = 4
@@ -13,6 +16,24 @@ def set_max_trace_length(max_length: int):
     global _max_trace_length
     _max_trace_length = max_length
 
+def _create_model_base_class(network: nn.Module):
+    """Create a Lightning module with the layers and forward pass of 'network' that saves its hyperparameters in checkpoints."""
+    class ModelBase(network, pl.LightningModule):
+        def __init__(self, predicates: list, hidden_size: int, iterations: int):
+            super().__init__(predicates, hidden_size, iterations)
+            self.save_hyperparameters()
+
+    return ModelBase
+
+AddModelBase = _create_model_base_class(AddNetwork)
+AddMaxModelBase = _create_model_base_class(AddMaxNetwork)
+AttentionModelBase = _create_model_base_class(AttentionNetwork)
+MaxModelBase = _create_model_base_class(MaxNetwork)
+MaxReadoutModelBase = _create_model_base_class(MaxReadoutNetwork)
+ExactMaxModelBase = _create_model_base_class(ExactMaxNetwork)
+ExactMaxReadoutModelBase = _create_model_base_class(ExactMaxReadoutNetwork)
+AddExactMaxModelBase = _create_model_base_class(AddExactMaxNetwork)
+
 def _create_optimizer(model: nn.Module, learning_rate: float, weight_decay: float):
     return torch.optim.Adam(model.parameters(), lr=learning_rate, weight_decay=weight_decay)
 
@@ -144,39 +165,143 @@ SupervisedOptimalAddModel = _create_supervised_model_class(AddModelBase, supervi
 SupervisedOptimalMaxModel = _create_supervised_model_class(MaxModelBase, supervised_optimal_loss)
 SupervisedOptimalAddMaxModel = _create_supervised_model_class(AddMaxModelBase, supervised_optimal_loss)
 SupervisedOptimalMaxReadoutModel = _create_supervised_model_class(MaxReadoutModelBase, supervised_optimal_loss)
+SupervisedOptimalExactMaxModel = _create_supervised_model_class(ExactMaxModelBase, supervised_optimal_loss)
+SupervisedOptimalExactMaxReadoutModel = _create_supervised_model_class(ExactMaxReadoutModelBase, supervised_optimal_loss)
+SupervisedOptimalAddExactMaxModel = _create_supervised_model_class(AddExactMaxModelBase, supervised_optimal_loss)
 SupervisedOptimalAttentionModel = _create_supervised_model_class(AttentionModelBase, supervised_optimal_loss)
 
 SelfsupervisedOptimalAddModel = _create_unsupervised_model_class(AddModelBase, selfsupervised_optimal_loss)
 SelfsupervisedOptimalMaxModel = _create_unsupervised_model_class(MaxModelBase, selfsupervised_optimal_loss)
 SelfsupervisedOptimalAddMaxModel = _create_unsupervised_model_class(AddMaxModelBase, selfsupervised_optimal_loss)
 SelfsupervisedOptimalMaxReadoutModel = _create_unsupervised_model_class(MaxReadoutModelBase, selfsupervised_optimal_loss)
+SelfsupervisedOptimalExactMaxModel = _create_unsupervised_model_class(ExactMaxModelBase, selfsupervised_optimal_loss)
+SelfsupervisedOptimalExactMaxReadoutModel = _create_unsupervised_model_class(ExactMaxReadoutModelBase, selfsupervised_optimal_loss)
+SelfsupervisedOptimalAddExactMaxModel = _create_unsupervised_model_class(AddExactMaxModelBase, selfsupervised_optimal_loss)
 SelfsupervisedOptimalAttentionModel = _create_unsupervised_model_class(AttentionModelBase, selfsupervised_optimal_loss)
 
 SelfsupervisedSuboptimalAddModel = _create_unsupervised_model_class(AddModelBase, selfsupervised_suboptimal_loss)
 SelfsupervisedSuboptimalMaxModel = _create_unsupervised_model_class(MaxModelBase, selfsupervised_suboptimal_loss)
 SelfsupervisedSuboptimalAddMaxModel = _create_unsupervised_model_class(AddMaxModelBase, selfsupervised_suboptimal_loss)
 SelfsupervisedSuboptimalMaxReadoutModel = _create_unsupervised_model_class(MaxReadoutModelBase, selfsupervised_suboptimal_loss)
+SelfsupervisedSuboptimalExactMaxModel = _create_unsupervised_model_class(ExactMaxModelBase, selfsupervised_suboptimal_loss)
+SelfsupervisedSuboptimalExactMaxReadoutModel = _create_unsupervised_model_class(ExactMaxReadoutModelBase, selfsupervised_suboptimal_loss)
+SelfsupervisedSuboptimalAddExactMaxModel = _create_unsupervised_model_class(AddExactMaxModelBase, selfsupervised_suboptimal_loss)
 SelfsupervisedSuboptimalAttentionModel = _create_unsupervised_model_class(AttentionModelBase, selfsupervised_suboptimal_loss)
 
 SelfsupervisedSuboptimalAddModel2 = _create_unsupervised_model_class(AddModelBase, selfsupervised_suboptimal2_loss)
 SelfsupervisedSuboptimalMaxModel2 = _create_unsupervised_model_class(MaxModelBase, selfsupervised_suboptimal2_loss)
 SelfsupervisedSuboptimalAddMaxModel2 = _create_unsupervised_model_class(AddMaxModelBase, selfsupervised_suboptimal2_loss)
 SelfsupervisedSuboptimalMaxReadoutModel2 = _create_unsupervised_model_class(MaxReadoutModelBase, selfsupervised_suboptimal2_loss)
+SelfsupervisedSuboptimalExactMaxModel2 = _create_unsupervised_model_class(ExactMaxModelBase, selfsupervised_suboptimal2_loss)
+SelfsupervisedSuboptimalExactMaxReadoutModel2 = _create_unsupervised_model_class(ExactMaxReadoutModelBase, selfsupervised_suboptimal2_loss)
+SelfsupervisedSuboptimalAddExactMaxModel2 = _create_unsupervised_model_class(AddExactMaxModelBase, selfsupervised_suboptimal2_loss)
 
 UnsupervisedOptimalAddModel = _create_unsupervised_model_class(AddModelBase, unsupervised_optimal_loss)
 UnsupervisedOptimalMaxModel = _create_unsupervised_model_class(MaxModelBase, unsupervised_optimal_loss)
 UnsupervisedOptimalAddMaxModel = _create_unsupervised_model_class(AddMaxModelBase, unsupervised_optimal_loss)
 UnsupervisedOptimalMaxReadoutModel = _create_unsupervised_model_class(MaxReadoutModelBase, unsupervised_optimal_loss)
+UnsupervisedOptimalExactMaxModel = _create_unsupervised_model_class(ExactMaxModelBase, unsupervised_optimal_loss)
+UnsupervisedOptimalExactMaxReadoutModel = _create_unsupervised_model_class(ExactMaxReadoutModelBase, unsupervised_optimal_loss)
+UnsupervisedOptimalAddExactMaxModel = _create_unsupervised_model_class(AddExactMaxModelBase, unsupervised_optimal_loss)
 UnsupervisedOptimalAttentionModel = _create_unsupervised_model_class(AttentionModelBase, unsupervised_optimal_loss)
 
 UnsupervisedSuboptimalAddModel = _create_unsupervised_model_class(AddModelBase, unsupervised_suboptimal_loss)
 UnsupervisedSuboptimalMaxModel = _create_unsupervised_model_class(MaxModelBase, unsupervised_suboptimal_loss)
 UnsupervisedSuboptimalAddMaxModel = _create_unsupervised_model_class(AddMaxModelBase, unsupervised_suboptimal_loss)
 UnsupervisedSuboptimalMaxReadoutModel = _create_unsupervised_model_class(MaxReadoutModelBase, unsupervised_suboptimal_loss)
+UnsupervisedSuboptimalExactMaxModel = _create_unsupervised_model_class(ExactMaxModelBase, unsupervised_suboptimal_loss)
+UnsupervisedSuboptimalExactMaxReadoutModel = _create_unsupervised_model_class(ExactMaxReadoutModelBase, unsupervised_suboptimal_loss)
+UnsupervisedSuboptimalAddExactMaxModel = _create_unsupervised_model_class(AddExactMaxModelBase, unsupervised_suboptimal_loss)
 UnsupervisedSuboptimalAttentionModel = _create_unsupervised_model_class(AttentionModelBase, unsupervised_suboptimal_loss)
 
 OnlineOptimalAddModel = _create_online_model_class(AddModelBase, unsupervised_optimal_loss)
 OnlineOptimalMaxModel = _create_online_model_class(MaxModelBase, unsupervised_optimal_loss)
 OnlineOptimalAddMaxModel = _create_online_model_class(AddMaxModelBase, unsupervised_optimal_loss)
 OnlineOptimalMaxReadoutModel = _create_online_model_class(MaxReadoutModelBase, unsupervised_optimal_loss)
+OnlineOptimalExactMaxModel = _create_online_model_class(ExactMaxModelBase, unsupervised_optimal_loss)
+OnlineOptimalExactMaxReadoutModel = _create_online_model_class(ExactMaxReadoutModelBase, unsupervised_optimal_loss)
+OnlineOptimalAddExactMaxModel = _create_online_model_class(AddExactMaxModelBase, unsupervised_optimal_loss)
 OnlineOptimalAttentionModel = _create_online_model_class(AttentionModelBase, unsupervised_optimal_loss)
+
+
+# Maps (aggregation, readout, loss) -> model
+g_model_classes = {
+    ('max',       True,  'supervised_optimal'):         SupervisedOptimalMaxReadoutModel,
+    ('max',       True,  'unsupervised_optimal'):       UnsupervisedOptimalMaxReadoutModel,
+    ('max',       True,  'selfsupervised_optimal'):     SelfsupervisedOptimalMaxReadoutModel,
+    ('max',       True,  'online_optimal'):             OnlineOptimalMaxReadoutModel,
+    ('max',       True,  'selfsupervised_suboptimal'):  SelfsupervisedSuboptimalMaxReadoutModel,
+    ('max',       True,  'selfsupervised_suboptimal2'): SelfsupervisedSuboptimalMaxReadoutModel2,
+    ('max',       True,  'unsupervised_suboptimal'):    UnsupervisedSuboptimalMaxReadoutModel,
+    ('max',       True,  'base'):                       MaxReadoutModelBase,
+
+    ('max',       False, 'supervised_optimal'):         SupervisedOptimalMaxModel,
+    ('max',       False, 'unsupervised_optimal'):       UnsupervisedOptimalMaxModel,
+    ('max',       False, 'selfsupervised_optimal'):     SelfsupervisedOptimalMaxModel,
+    ('max',       False, 'online_optimal'):             OnlineOptimalMaxModel,
+    ('max',       False, 'selfsupervised_suboptimal'):  SelfsupervisedSuboptimalMaxModel,
+    ('max',       False, 'selfsupervised_suboptimal2'): SelfsupervisedSuboptimalMaxModel2,
+    ('max',       False, 'unsupervised_suboptimal'):    UnsupervisedSuboptimalMaxModel,
+    ('max',       False, 'base'):                       MaxModelBase,
+
+    ('add',       False, 'supervised_optimal'):         SupervisedOptimalAddModel,
+    ('add',       False, 'unsupervised_optimal'):       UnsupervisedOptimalAddModel,
+    ('add',       False, 'selfsupervised_optimal'):     SelfsupervisedOptimalAddModel,
+    ('add',       False, 'online_optimal'):             OnlineOptimalAddModel,
+    ('add',       False, 'selfsupervised_suboptimal'):  SelfsupervisedSuboptimalAddModel,
+    ('add',       False, 'selfsupervised_suboptimal2'): SelfsupervisedSuboptimalAddModel2,
+    ('add',       False, 'unsupervised_suboptimal'):    UnsupervisedSuboptimalAddModel,
+    ('add',       False, 'base'):                       AddModelBase,
+
+    ('addmax',    False, 'supervised_optimal'):         SupervisedOptimalAddMaxModel,
+    ('addmax',    False, 'unsupervised_optimal'):       UnsupervisedOptimalAddMaxModel,
+    ('addmax',    False, 'selfsupervised_optimal'):     SelfsupervisedOptimalAddMaxModel,
+    ('addmax',    False, 'online_optimal'):             OnlineOptimalAddMaxModel,
+    ('addmax',    False, 'selfsupervised_suboptimal'):  SelfsupervisedSuboptimalAddMaxModel,
+    ('addmax',    False, 'selfsupervised_suboptimal2'): SelfsupervisedSuboptimalAddMaxModel2,
+    ('addmax',    False, 'unsupervised_suboptimal'):    UnsupervisedSuboptimalAddMaxModel,
+    ('addmax',    False, 'base'):                       AddMaxModelBase,
+
+    ('exactmax',  True,  'supervised_optimal'):         SupervisedOptimalExactMaxReadoutModel,
+    ('exactmax',  True,  'unsupervised_optimal'):       UnsupervisedOptimalExactMaxReadoutModel,
+    ('exactmax',  True,  'selfsupervised_optimal'):     SelfsupervisedOptimalExactMaxReadoutModel,
+    ('exactmax',  True,  'online_optimal'):             OnlineOptimalExactMaxReadoutModel,
+    ('exactmax',  True,  'selfsupervised_suboptimal'):  SelfsupervisedSuboptimalExactMaxReadoutModel,
+    ('exactmax',  True,  'selfsupervised_suboptimal2'): SelfsupervisedSuboptimalExactMaxReadoutModel2,
+    ('exactmax',  True,  'unsupervised_suboptimal'):    UnsupervisedSuboptimalExactMaxReadoutModel,
+    ('exactmax',  True,  'base'):                       ExactMaxReadoutModelBase,
+
+    ('exactmax',  False, 'supervised_optimal'):         SupervisedOptimalExactMaxModel,
+    ('exactmax',  False, 'unsupervised_optimal'):       UnsupervisedOptimalExactMaxModel,
+    ('exactmax',  False, 'selfsupervised_optimal'):     SelfsupervisedOptimalExactMaxModel,
+    ('exactmax',  False, 'online_optimal'):             OnlineOptimalExactMaxModel,
+    ('exactmax',  False, 'selfsupervised_suboptimal'):  SelfsupervisedSuboptimalExactMaxModel,
+    ('exactmax',  False, 'selfsupervised_suboptimal2'): SelfsupervisedSuboptimalExactMaxModel2,
+    ('exactmax',  False, 'unsupervised_suboptimal'):    UnsupervisedSuboptimalExactMaxModel,
+    ('exactmax',  False, 'base'):                       ExactMaxModelBase,
+
+    ('addexactmax', False, 'supervised_optimal'):         SupervisedOptimalAddExactMaxModel,
+    ('addexactmax', False, 'unsupervised_optimal'):       UnsupervisedOptimalAddExactMaxModel,
+    ('addexactmax', False, 'selfsupervised_optimal'):     SelfsupervisedOptimalAddExactMaxModel,
+    ('addexactmax', False, 'online_optimal'):             OnlineOptimalAddExactMaxModel,
+    ('addexactmax', False, 'selfsupervised_suboptimal'):  SelfsupervisedSuboptimalAddExactMaxModel,
+    ('addexactmax', False, 'selfsupervised_suboptimal2'): SelfsupervisedSuboptimalAddExactMaxModel2,
+    ('addexactmax', False, 'unsupervised_suboptimal'):    UnsupervisedSuboptimalAddExactMaxModel,
+    ('addexactmax', False, 'base'):                       AddExactMaxModelBase,
+
+    ('attention', True,  'supervised_optimal'):         SupervisedOptimalAttentionModel,
+    ('attention', True,  'unsupervised_optimal'):       UnsupervisedOptimalAttentionModel,
+    ('attention', True,  'selfsupervised_optimal'):     SelfsupervisedOptimalAttentionModel,
+    ('attention', True,  'online_optimal'):             OnlineOptimalAttentionModel,
+    ('attention', True,  'selfsupervised_suboptimal'):  SelfsupervisedSuboptimalAttentionModel,
+    ('attention', True,  'unsupervised_suboptimal'):    UnsupervisedSuboptimalAttentionModel,
+    ('attention', True,  'base'):                       AttentionModelBase,
+
+    ('attention', False, 'supervised_optimal'):         SupervisedOptimalAttentionModel,
+    ('attention', False, 'unsupervised_optimal'):       UnsupervisedOptimalAttentionModel,
+    ('attention', False, 'selfsupervised_optimal'):     SelfsupervisedOptimalAttentionModel,
+    ('attention', False, 'online_optimal'):             OnlineOptimalAttentionModel,
+    ('attention', False, 'selfsupervised_suboptimal'):  SelfsupervisedSuboptimalAttentionModel,
+    ('attention', False, 'unsupervised_suboptimal'):    UnsupervisedSuboptimalAttentionModel,
+    ('attention', False, 'base'):                       AttentionModelBase
+}
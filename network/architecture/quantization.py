@@ -0,0 +1,90 @@
+import copy
+import torch
+import torch.nn as nn
+from torch.ao.quantization import DeQuantStub, QuantStub, convert, fuse_modules, get_default_qconfig, prepare, quantize_dynamic
+
+from .messages import RelationMessages
+
+# Imports related to type annotations
+from typing import Dict, Iterable, List, Optional, Tuple
+from torch.nn.functional import Tensor
+
+
+class _QuantizedInput(nn.Module):
+    """First Linear and ReLU of a statically quantized MLP, which quantizes the input; keeps in_features for the message passing."""
+
+    def __init__(self, linear: nn.Linear, relu: nn.Module):
+        super().__init__()
+        self.in_features = linear.in_features
+        self.quant = QuantStub()
+        self.layers = nn.Sequential(linear, relu)
+
+    def forward(self, input: Tensor) -> Tensor:
+        return self.layers(self.quant(input))
+
+def _fused_groups(self, relations: Dict[int, Tensor], recipients: List[Tensor]) -> List[Tuple[int, Tensor, List[int], Tensor, Tensor, Tensor, Tensor, Tensor]]:
+    # fused layout of the quantized relation MLPs, which have no float weights to stack
+    return self._looped_groups(relations, recipients)
+
+# looped variant of each message passing class, by class
+g_looped_classes: Dict[type, type] = {}
+
+def _looped_class(cls: type) -> type:
+    # subclass of a message passing class with the looped layout also when fused, since TorchScript compiles
+    # both branches of RelationMessages.layout(), and the weights of the fused branch whatever the value of fused
+    if cls not in g_looped_classes:
+        g_looped_classes[cls] = type(cls.__name__, (cls,), { '__module__': cls.__module__, '__qualname__': f'{cls.__qualname__}Looped', '_fused_groups': _fused_groups })
+    return g_looped_classes[cls]
+
+def _is_mlp(module: nn.Module) -> bool:
+    return isinstance(module, nn.Sequential) and len(module) == 3 and isinstance(module[0], nn.Linear) and isinstance(module[1], nn.ReLU) and isinstance(module[2], nn.Linear)
+
+def _insert_stubs(module: nn.Module, qconfig, replaced: List[Tuple[nn.Module, str, nn.Sequential]]):
+    # replaces the Linear-ReLU-Linear MLPs by MLPs that run in int8 between a quantization and a dequantization,
+    # and adds (parent, name, float MLP) of each to replaced; the other layers, like the attention weights, stay
+    # in float, and so do the post MLPs of the readouts, whose input is a sum over the objects of a state that
+    # grows with the size of the problems beyond the range seen on the calibration states
+    for name, child in module.named_children():
+        if _is_mlp(child) and name != 'post':
+            replaced.append((module, name, copy.deepcopy(child)))
+            first = _QuantizedInput(child[0], child[1])
+            fuse_modules(first.layers, [ [ '0', '1' ] ], inplace=True)
+            mlp = nn.Sequential(first, child[2], DeQuantStub())
+            mlp.qconfig = qconfig
+            setattr(module, name, mlp)
+        else:
+            _insert_stubs(child, qconfig, replaced)
+
+def quantize_network(network: nn.Module, mode: str = 'static', calibration: Optional[Iterable[Tuple[Dict[str, Tensor], List[int]]]] = None, engine: Optional[str] = None) -> nn.Module:
+    """
+    Experimental int8 copy of a network for inference on the CPU, with the Linear layers of the
+    relation, update and readout MLPs quantized. It isn't faster than the float network so far:
+    the GEMMs of the MLPs are too small to pay for quantizing and dequantizing around them, even
+    for batches of hundreds of states, so quantize.py only compares it with float. Dynamic quantization quantizes the inputs of each layer
+    on the fly. Static quantization runs the MLPs applied to objects and atoms in int8 with the
+    Linear and ReLU fused, using the scales observed on the calibration batches, which are
+    (states, sizes) as in training.
+    The copy is scriptable.
+    """
+    if engine is not None: torch.backends.quantized.engine = engine
+    quantized = copy.deepcopy(network).cpu().eval()
+    for module in quantized.modules():
+        if isinstance(module, RelationMessages): module.__class__ = _looped_class(type(module))
+    if mode == 'dynamic':
+        return quantize_dynamic(quantized, { nn.Linear }, dtype=torch.qint8)
+    if mode != 'static':
+        raise ValueError(f"No quantization mode '{mode}', expected 'static' or 'dynamic'")
+    if calibration is None:
+        raise ValueError('Static quantization needs calibration states')
+    replaced: List[Tuple[nn.Module, str, nn.Sequential]] = []
+    _insert_stubs(quantized, get_default_qconfig(torch.backends.quantized.engine), replaced)
+    prepare(quantized, inplace=True)
+    with torch.no_grad():
+        for states in calibration:
+            quantized(states)
+
+    # MLPs of relations without atoms in the calibration states have no scales and stay in float
+    for module, name, mlp in replaced:
+        if not torch.isfinite(getattr(module, name)[0].quant.activation_post_process.min_val).all():
+            setattr(module, name, mlp)
+    return convert(quantized, inplace=True)
\ No newline at end of file
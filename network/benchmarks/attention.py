@@ -0,0 +1,83 @@
+import sys
+import os.path
+from pathlib import Path
+from timeit import default_timer as timer
+import argparse
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from architecture import load_network
+from export import _get_checkpoints, _random_states
+
+
+def _parse_arguments():
+    default_models = Path(__file__).parent.parent.parent / 'data' / 'models' / 'blocks'
+    default_objects = [ 10, 30, 100, 300, 1000, 3000 ]
+    default_repeats = 3
+    default_threads = 1
+
+    parser = argparse.ArgumentParser(description='Compare the attention aggregation that loops over the objects in Python against the segmented softmax with scatter operations, by latency of message passing for growing numbers of objects')
+    parser.add_argument('--models', type=Path, nargs='+', default=[ default_models ], help=f'checkpoints or folders with checkpoints whose predicates and relation MLPs are used (default={default_models})')
+    parser.add_argument('--objects', type=int, nargs='+', default=default_objects, help=f'numbers of objects of the random state (default={default_objects})')
+    parser.add_argument('--repeats', type=int, default=default_repeats, help=f'number of timed runs of each state (default={default_repeats})')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random state and of the attention weights (default=0)')
+    parser.add_argument('--threads', type=int, default=default_threads, help=f'number of threads (default={default_threads})')
+    return parser.parse_args()
+
+def _looped_attention(layer, node_states, relations, layout):
+    # RelationMessagePassing.forward() of attention_base before the segmented softmax
+    outputs = layer.messages(node_states, relations, layout)
+    recipient_indices = layout.recipients
+    messages = outputs.index_select(0, torch.sort(recipient_indices, stable=True)[1])
+    queries = layer.query_weight(node_states)
+    lengths = torch.bincount(recipient_indices, minlength=node_states.shape[0]).tolist()
+    keys = layer.key_weight(messages)
+    values = layer.value_weight(messages)
+    attention_list = []
+    start = 0
+    for length in lengths:
+        end = start + length
+        attention_list.append(torch.matmul(torch.softmax(torch.div(torch.matmul(queries[start:end], keys[start:end].T), length ** 0.5), dim=0), values[start:end]))
+        start = end
+    attentions = torch.cat(attention_list).squeeze()
+    return layer.update(torch.cat([attentions, node_states], dim=1))
+
+def _pass_messages(layer, iterations: int, node_states, relations, looped: bool):
+    # as RelationMessagePassingModel._pass_messages(), with either aggregation
+    layout = layer.layout(node_states, relations)
+    for _ in range(iterations):
+        node_states = _looped_attention(layer, node_states, relations, layout) if looped else layer(node_states, relations, layout)
+    return node_states
+
+def _latency(function, repeats: int, *args):
+    function(*args)
+    start_time = timer()
+    for _ in range(repeats):
+        function(*args)
+    return (timer() - start_time) / repeats
+
+def _main(args):
+    torch.set_num_threads(args.threads)
+    print(f'{"model":>24s} {"objects":>8s} {"messages":>9s} {"pairs":>9s} {"looped":>9s} {"scatter":>9s} {"speedup":>8s} {"max.diff":>9s}')
+    for checkpoint in _get_checkpoints(args.models):
+        torch.manual_seed(args.seed)
+        network = load_network(checkpoint, 'attention')
+        predicates = torch.load(str(checkpoint), map_location='cpu', weights_only=False)['hyper_parameters']['predicates']
+        model = network.model
+        layer = model.relation_network
+        for num_objects in args.objects:
+            states = _random_states(predicates, [ num_objects ], args.seed)
+            relations = { network.encoding[name]: values for name, values in states[0].items() }
+            with torch.no_grad():
+                node_states = model._initialize_nodes(num_objects)
+                layout = layer.layout(node_states, relations)
+                expected, actual = _looped_attention(layer, node_states, relations, layout), layer(node_states, relations, layout)
+                pairs = layer._attention_indices(layout, num_objects)[1].shape[0]
+                latencies = [ _latency(_pass_messages, args.repeats, layer, model.iterations, node_states, relations, looped) for looped in (True, False) ]
+            name = f'{checkpoint.parent.name}/{checkpoint.stem}'[-24:]
+            print(f'{name:>24s} {num_objects:>8d} {layout.recipients.shape[0]:>9d} {pairs:>9d} {1000 * latencies[0]:>7.2f}ms {1000 * latencies[1]:>7.2f}ms {latencies[0] / max(latencies[1], 1e-9):>7.1f}x {float(torch.max(torch.abs(expected - actual))):>9.2e}')
+
+
+if __name__ == "__main__":
+    args = _parse_arguments()
+    _main(args)
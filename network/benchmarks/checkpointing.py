@@ -0,0 +1,59 @@
+import sys
+import os.path
+from pathlib import Path
+import argparse
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from architecture import load_network, set_checkpoint_iterations
+from export import _get_checkpoints, _random_states
+from max_aggregation import _peak_memory
+from message_passing import _latency
+
+
+def _parse_arguments():
+    default_aggregation = 'max'
+    default_batch_size = 64
+    default_models = Path(__file__).parent.parent.parent / 'data' / 'models'
+    default_objects = 10
+    default_repeats = 3
+    default_segments = [ 0, 1, 3, 5, 10, 15 ]
+    default_threads = 1
+
+    parser = argparse.ArgumentParser(description='Compare training steps that keep the activations of all iterations of message passing against recomputing them in the backward pass for segments of iterations, by peak memory and latency')
+    parser.add_argument('--aggregation', default=default_aggregation, nargs='?', choices=['add', 'max', 'addmax', 'exactmax', 'addexactmax', 'attention'], help=f'aggregation function for readout (default={default_aggregation})')
+    parser.add_argument('--batch_size', type=int, default=default_batch_size, help=f'number of states per batch (default={default_batch_size})')
+    parser.add_argument('--models', type=Path, nargs='+', default=[ default_models ], help=f'checkpoints or folders with checkpoints (default={default_models})')
+    parser.add_argument('--objects', type=int, default=default_objects, help=f'number of objects of each random state (default={default_objects})')
+    parser.add_argument('--readout', action='store_true', help='use global readout')
+    parser.add_argument('--repeats', type=int, default=default_repeats, help=f'number of timed training steps (default={default_repeats})')
+    parser.add_argument('--segments', type=int, nargs='+', default=default_segments, help=f'iterations per recomputed segment, 0 keeps all activations (default={default_segments})')
+    parser.add_argument('--threads', type=int, default=default_threads, help=f'number of threads (default={default_threads})')
+    return parser.parse_args()
+
+def _training_step(network, states):
+    # forward and backward pass, the part of a training step that checkpointing changes
+    network.zero_grad()
+    value, solvable = network(states)[:2]
+    (value.sum() + solvable.sum()).backward()
+
+def _main(args):
+    torch.set_num_threads(args.threads)
+    print(f'{"model":>24s} {"states":>7s} {"segment":>8s} {"MiB":>8s} {"ms":>9s} {"memory":>7s} {"time":>7s}')
+    for checkpoint in _get_checkpoints(args.models):
+        network = load_network(checkpoint, args.aggregation, args.readout).train()
+        predicates = torch.load(str(checkpoint), map_location='cpu', weights_only=False)['hyper_parameters']['predicates']
+        states = _random_states(predicates, [ args.objects ] * args.batch_size)
+        name = f'{checkpoint.parent.name}/{checkpoint.stem}'[-24:]
+        baseline = None
+        for segment in args.segments:
+            set_checkpoint_iterations(network, segment)
+            memory = _peak_memory(_training_step, network, states)
+            latency = _latency(_training_step, args.repeats, network, states)
+            if baseline is None: baseline = (memory, latency)
+            print(f'{name:>24s} {args.batch_size:>7d} {segment:>8d} {memory / 2 ** 20:>8.1f} {1000 * latency:>9.1f} {memory / baseline[0]:>6.2f}x {latency / baseline[1]:>6.2f}x')
+
+
+if __name__ == "__main__":
+    args = _parse_arguments()
+    _main(args)
@@ -0,0 +1,67 @@
+import sys
+import os.path
+from pathlib import Path
+from timeit import default_timer as timer
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from generators.grounder import ground_problem_schemas_with_relaxed_reachability
+from tarski.grounding.lp_grounding import ground_problem_schemas_into_plain_operators
+from tarski.io import PDDLReader
+
+
+def _parse_arguments():
+    default_pddl = Path(__file__).parent.parent.parent / 'data' / 'pddl'
+    default_max_problems = 3
+
+    parser = argparse.ArgumentParser(description='Compare the LP grounder of tarski (gringo) against the native relaxed-reachability grounder')
+    parser.add_argument('--pddl', type=Path, default=default_pddl, help=f'folder with one subfolder per domain (default={default_pddl})')
+    parser.add_argument('--domains', type=str, nargs='*', default=None, help='domains to benchmark (default=all)')
+    parser.add_argument('--split', type=str, default='test', help='subfolder of each domain with problems (default=test)')
+    parser.add_argument('--max_problems', type=int, default=default_max_problems, help=f'number of problems per domain, 0 for all (default={default_max_problems})')
+    return parser.parse_args()
+
+def _parse(domain: Path, problem: Path):
+    parser = PDDLReader(raise_on_error=True)
+    parser.parse_domain(str(domain))
+    return parser.parse_instance(str(problem))
+
+def _operator_keys(operators):
+    return sorted([ (operator.name, str(operator.precondition), str(operator.effects)) for operator in operators ])
+
+def _benchmark_problem(domain: Path, problem: Path):
+    # each grounder gets a freshly parsed problem, as grounding may extend the language
+    pddl_problem = _parse(domain, problem)
+    start_time = timer()
+    reference = ground_problem_schemas_into_plain_operators(pddl_problem)
+    lp_time = timer() - start_time
+
+    pddl_problem = _parse(domain, problem)
+    start_time = timer()
+    operators = ground_problem_schemas_with_relaxed_reachability(pddl_problem)
+    native_time = timer() - start_time
+    assert _operator_keys(reference) == _operator_keys(operators), f'grounders disagree on {problem}'
+    return len(operators), lp_time, native_time
+
+def _main(args):
+    domains = sorted([ path for path in args.pddl.iterdir() if path.is_dir() and (args.domains is None or path.name in args.domains) ])
+    print(f'{"problem":>48s} {"#ops":>7s} {"lp":>8s} {"native":>8s} {"speedup":>8s}')
+    for domain_path in domains:
+        domain = domain_path / args.split / 'domain.pddl'
+        if not domain.exists(): continue
+        problems = sorted([ path for path in domain.parent.glob('*.pddl') if path.name != 'domain.pddl' ])
+        if args.max_problems > 0: problems = problems[:args.max_problems]
+        total_lp, total_native = 0.0, 0.0
+        for problem in problems:
+            num_operators, lp_time, native_time = _benchmark_problem(domain, problem)
+            total_lp += lp_time
+            total_native += native_time
+            name = f'{domain_path.name}/{problem.stem}'
+            print(f'{name:>48s} {num_operators:>7d} {lp_time:>8.3f} {native_time:>8.3f} {lp_time / max(native_time, 1e-9):>7.1f}x')
+        if len(problems) > 0:
+            print(f'{domain_path.name + " (total)":>48s} {"":>7s} {total_lp:>8.3f} {total_native:>8.3f} {total_lp / max(total_native, 1e-9):>7.1f}x')
+
+
+if __name__ == "__main__":
+    args = _parse_arguments()
+    _main(args)
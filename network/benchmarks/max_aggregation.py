@@ -0,0 +1,85 @@
+import sys
+import os.path
+from pathlib import Path
+from timeit import default_timer as timer
+import argparse
+import torch
+from torch.profiler import profile, ProfilerActivity
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from architecture import load_network
+from export import _get_checkpoints, _random_states
+
+# smooth and exact maximum for each aggregation with a maximum
+g_aggregations = { 'max': ('max', 'exactmax'), 'addmax': ('addmax', 'addexactmax') }
+
+
+def _parse_arguments():
+    default_aggregation = 'max'
+    default_batch_size = 64
+    default_models = Path(__file__).parent.parent.parent / 'data' / 'models'
+    default_objects = 10
+    default_steps = 10
+    default_threads = 1
+
+    parser = argparse.ArgumentParser(description='Compare the smooth maximum of the messages against the exact maximum with scatter_reduce, by training and inference throughput and peak memory')
+    parser.add_argument('--aggregation', default=default_aggregation, choices=list(g_aggregations.keys()), help=f'aggregation whose maximum is compared (default={default_aggregation})')
+    parser.add_argument('--batch_size', type=int, default=default_batch_size, help=f'number of states per batch (default={default_batch_size})')
+    parser.add_argument('--models', type=Path, nargs='+', default=[ default_models ], help=f'checkpoints or folders with checkpoints (default={default_models})')
+    parser.add_argument('--objects', type=int, default=default_objects, help=f'number of objects of each random state (default={default_objects})')
+    parser.add_argument('--readout', action='store_true', help='use global readout')
+    parser.add_argument('--steps', type=int, default=default_steps, help=f'number of timed training steps and forward passes (default={default_steps})')
+    parser.add_argument('--threads', type=int, default=default_threads, help=f'number of threads (default={default_threads})')
+    return parser.parse_args()
+
+def _training_step(network, optimizer, states, targets):
+    optimizer.zero_grad()
+    value, _ = network(states)
+    loss = torch.nn.functional.mse_loss(value, targets)
+    loss.backward()
+    optimizer.step()
+
+def _inference(network, states):
+    with torch.no_grad():
+        network(states)
+
+def _peak_memory(function, *args):
+    # max. size of the tensors allocated during the call and alive at the same time, from the memory events of the profiler
+    with profile(activities=[ ProfilerActivity.CPU ], profile_memory=True) as profiler:
+        function(*args)
+    events = sorted([ event for event in profiler.profiler.kineto_results.events() if event.name() == '[memory]' ], key=lambda event: event.start_ns())
+    allocated, peak = 0, 0
+    for event in events:
+        allocated += event.nbytes()
+        peak = max(peak, allocated)
+    return peak
+
+def _throughput(function, steps: int, batch_size: int, *args):
+    function(*args)
+    start_time = timer()
+    for _ in range(steps):
+        function(*args)
+    return steps * batch_size / (timer() - start_time)
+
+def _main(args):
+    torch.set_num_threads(args.threads)
+    print(f'{"model":>24s} {"aggregation":>12s} {"train/s":>9s} {"infer/s":>9s} {"train MiB":>10s} {"infer MiB":>10s}')
+    for checkpoint in _get_checkpoints(args.models):
+        predicates = torch.load(str(checkpoint), map_location='cpu', weights_only=False)['hyper_parameters']['predicates']
+        states = _random_states(predicates, [ args.objects ] * args.batch_size)
+        targets = torch.rand((args.batch_size, 1)) * 20.0
+        name = f'{checkpoint.parent.name}/{checkpoint.stem}'[-24:]
+        for aggregation in g_aggregations[args.aggregation]:
+            # both networks start from the weights of the checkpoint, which has no parameters for the maximum
+            network = load_network(checkpoint, aggregation, args.readout).train()
+            optimizer = torch.optim.Adam(network.parameters(), lr=1e-4)
+            training = _throughput(_training_step, args.steps, args.batch_size, network, optimizer, states, targets)
+            inference = _throughput(_inference, args.steps, args.batch_size, network, states)
+            training_memory = _peak_memory(_training_step, network, optimizer, states, targets)
+            inference_memory = _peak_memory(_inference, network, states)
+            print(f'{name:>24s} {aggregation:>12s} {training:>9.1f} {inference:>9.1f} {training_memory / 2 ** 20:>10.1f} {inference_memory / 2 ** 20:>10.1f}')
+
+
+if __name__ == "__main__":
+    args = _parse_arguments()
+    _main(args)
@@ -0,0 +1,88 @@
+import sys
+import os.path
+from pathlib import Path
+from timeit import default_timer as timer
+import argparse
+import torch
+from torch.profiler import profile, ProfilerActivity
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from architecture import load_network, quantize_network, set_fused_messages
+from export import _get_checkpoints, _random_states
+
+
+def _parse_arguments():
+    default_aggregation = 'max'
+    default_batch_sizes = [ 1, 16, 128 ]
+    default_models = Path(__file__).parent.parent.parent / 'data' / 'models'
+    default_objects = 10
+    default_repeats = 20
+    default_threads = 1
+
+    parser = argparse.ArgumentParser(description='Compare message passing that builds the message layout and aggregation buffers in every iteration against building them once per batch, by allocations and latency without autograd')
+    parser.add_argument('--aggregation', default=default_aggregation, nargs='?', choices=['add', 'max', 'addmax', 'exactmax', 'addexactmax', 'attention'], help=f'aggregation function for readout (default={default_aggregation})')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=default_batch_sizes, help=f'numbers of states per batch (default={default_batch_sizes})')
+    parser.add_argument('--fused_messages', action='store_true', help='run the relation MLPs of the same arity as one batched MLP')
+    parser.add_argument('--models', type=Path, nargs='+', default=[ default_models ], help=f'checkpoints or folders with checkpoints (default={default_models})')
+    parser.add_argument('--objects', type=int, default=default_objects, help=f'number of objects of each random state (default={default_objects})')
+    parser.add_argument('--readout', action='store_true', help='use global readout')
+    parser.add_argument('--repeats', type=int, default=default_repeats, help=f'number of timed runs of each batch (default={default_repeats})')
+    parser.add_argument('--threads', type=int, default=default_threads, help=f'number of threads (default={default_threads})')
+    return parser.parse_args()
+
+def _per_iteration(relation_network, iterations: int, node_states, relations):
+    # the layout and the buffers are built again in every iteration
+    for _ in range(iterations):
+        node_states = relation_network(node_states, relations)
+    return node_states
+
+def _per_batch(relation_network, iterations: int, node_states, relations):
+    # as RelationMessagePassingModel._pass_messages()
+    layout = relation_network.layout(node_states, relations)
+    for _ in range(iterations):
+        node_states = relation_network(node_states, relations, layout)
+    return node_states
+
+def _allocations(function, *args):
+    # number and total size of the allocations of one call, from the memory events of the profiler
+    with profile(activities=[ ProfilerActivity.CPU ], profile_memory=True) as profiler:
+        function(*args)
+    sizes = [ event.nbytes() for event in profiler.profiler.kineto_results.events() if event.name() == '[memory]' and event.nbytes() > 0 ]
+    return len(sizes), sum(sizes)
+
+def _latency(function, repeats: int, *args):
+    function(*args)
+    start_time = timer()
+    for _ in range(repeats):
+        function(*args)
+    return (timer() - start_time) / repeats
+
+def _main(args):
+    torch.set_num_threads(args.threads)
+    print(f'{"model":>24s} {"states":>7s} {"messages":>9s} {"allocs":>7s} {"allocs":>7s} {"MiB":>7s} {"MiB":>7s} {"ms":>8s} {"ms":>8s} {"speedup":>8s}')
+    print(f'{"":>24s} {"":>7s} {"":>9s} {"iter":>7s} {"batch":>7s} {"iter":>7s} {"batch":>7s} {"iter":>8s} {"batch":>8s} {"":>8s}')
+    for checkpoint in _get_checkpoints(args.models):
+        network = load_network(checkpoint, args.aggregation, args.readout)
+        set_fused_messages(network, args.fused_messages)
+        network.set_deterministic()
+        # the layout of the fused relation MLPs is compiled also into the quantized copies, which have no float weights
+        torch.jit.script(quantize_network(network, 'dynamic'))
+        predicates = torch.load(str(checkpoint), map_location='cpu', weights_only=False)['hyper_parameters']['predicates']
+        model = network.model
+        for batch_size in args.batch_sizes:
+            states = _random_states(predicates, [ args.objects ] * batch_size)
+            relations = { network.encoding[name]: values for name, values in states[0].items() }
+            with torch.no_grad():
+                node_states = model._initialize_nodes(sum(states[1]), states[1])
+                expected = _per_iteration(model.relation_network, model.iterations, node_states, relations)
+                assert torch.equal(expected, _per_batch(model.relation_network, model.iterations, node_states, relations)), f'outputs differ on {checkpoint}'
+                messages = model.relation_network.layout(node_states, relations).recipients.shape[0]
+                allocations = [ _allocations(function, model.relation_network, model.iterations, node_states, relations) for function in (_per_iteration, _per_batch) ]
+                latencies = [ _latency(function, args.repeats, model.relation_network, model.iterations, node_states, relations) for function in (_per_iteration, _per_batch) ]
+            name = f'{checkpoint.parent.name}/{checkpoint.stem}'[-24:]
+            print(f'{name:>24s} {batch_size:>7d} {messages:>9d} {allocations[0][0]:>7d} {allocations[1][0]:>7d} {allocations[0][1] / 2 ** 20:>7.1f} {allocations[1][1] / 2 ** 20:>7.1f} {1000 * latencies[0]:>8.2f} {1000 * latencies[1]:>8.2f} {latencies[0] / max(latencies[1], 1e-9):>7.2f}x')
+
+
+if __name__ == "__main__":
+    args = _parse_arguments()
+    _main(args)
@@ -0,0 +1,77 @@
+import sys
+import os.path
+from pathlib import Path
+from timeit import default_timer as timer
+import argparse
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from architecture import g_network_classes, set_sparse_aggregation
+from export import _get_checkpoints, _random_states
+
+
+def _parse_arguments():
+    default_aggregation = 'add'
+    default_batch_sizes = [ 1, 8, 64, 512 ]
+    default_models = Path(__file__).parent.parent.parent / 'data' / 'models'
+    default_objects = 10
+    default_repeats = 10
+    default_threads = 1
+
+    parser = argparse.ArgumentParser(description='Compare the sums of messages with scatter_add against the product by a sparse CSR incidence matrix, by latency of the sums alone and of message passing without autograd, the only case in which the sparse product is used')
+    parser.add_argument('--aggregation', default=default_aggregation, choices=['add', 'addmax', 'addexactmax'], help=f'aggregation with a sum of the messages (default={default_aggregation})')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=default_batch_sizes, help=f'numbers of states per batch (default={default_batch_sizes})')
+    parser.add_argument('--models', type=Path, nargs='+', default=[ default_models ], help=f'checkpoints or folders with checkpoints, for their predicates and sizes (default={default_models})')
+    parser.add_argument('--objects', type=int, default=default_objects, help=f'number of objects of each random state (default={default_objects})')
+    parser.add_argument('--repeats', type=int, default=default_repeats, help=f'number of timed runs of each batch (default={default_repeats})')
+    parser.add_argument('--threads', type=int, default=default_threads, help=f'number of threads (default={default_threads})')
+    return parser.parse_args()
+
+def _sums(model, node_states, relations):
+    # only the sums of the messages of every iteration, on the messages of the first one
+    relation_network = model.relation_network
+    with torch.no_grad():
+        layout = relation_network.layout(node_states, relations)
+        outputs = relation_network.messages(node_states, relations, layout)
+        for _ in range(model.iterations):
+            relation_network.sum_messages(node_states, outputs, layout)
+
+def _inference(model, node_states, relations):
+    with torch.no_grad():
+        model._pass_messages(node_states, relations)
+
+def _latency(function, repeats: int, *args):
+    function(*args)
+    start_time = timer()
+    for _ in range(repeats):
+        function(*args)
+    return (timer() - start_time) / repeats
+
+def _main(args):
+    torch.set_num_threads(args.threads)
+    print(f'{"model":>24s} {"states":>7s} {"messages":>9s} {"sums ms":>9s} {"sums ms":>9s} {"infer ms":>9s} {"infer ms":>9s}')
+    print(f'{"":>24s} {"":>7s} {"":>9s} {"scatter":>9s} {"sparse":>9s} {"scatter":>9s} {"sparse":>9s}')
+    for checkpoint in _get_checkpoints(args.models):
+        # the weights don't change the latency, and the checkpoints don't have the sizes of every aggregation
+        hyper_parameters = torch.load(str(checkpoint), map_location='cpu', weights_only=False)['hyper_parameters']
+        predicates = hyper_parameters['predicates']
+        network = g_network_classes[(args.aggregation, False)](predicates, hyper_parameters['hidden_size'], hyper_parameters['iterations'])
+        network.set_deterministic()
+        model = network.model
+        for batch_size in args.batch_sizes:
+            states = _random_states(predicates, [ args.objects ] * batch_size)
+            relations = { network.encoding[name]: values for name, values in states[0].items() }
+            node_states = model._initialize_nodes(sum(states[1]), states[1])
+            num_messages = sum([ values.shape[0] for key, values in relations.items() if str(key) in model.relation_network.relation_modules ])
+            latencies = []
+            for function in [ _sums, _inference ]:
+                for sparse in [ False, True ]:
+                    set_sparse_aggregation(network, sparse)
+                    latencies.append(_latency(function, args.repeats, model, node_states, relations))
+            name = f'{checkpoint.parent.name}/{checkpoint.stem}'[-24:]
+            print(f'{name:>24s} {batch_size:>7d} {num_messages:>9d} ' + ' '.join([ f'{1000 * latency:>9.2f}' for latency in latencies ]))
+
+
+if __name__ == "__main__":
+    args = _parse_arguments()
+    _main(args)
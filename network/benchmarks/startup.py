@@ -0,0 +1,61 @@
+import sys
+import os.path
+import subprocess
+from pathlib import Path
+from timeit import default_timer as timer
+import argparse
+
+# Code that loads a checkpoint, as (imports, load); both run in a fresh interpreter with 'checkpoint', 'aggregation' and 'readout' defined
+g_loaders = {
+    'lightning': ('from architecture import g_model_classes', "model = g_model_classes[(aggregation, readout, 'base')].load_from_checkpoint(checkpoint_path=checkpoint, strict=False, map_location='cpu')"),
+    'inference': ('from architecture import load_network', "model = load_network(checkpoint, aggregation, readout, 'cpu')")
+}
+
+
+def _parse_arguments():
+    default_models = Path(__file__).parent.parent.parent / 'data' / 'models'
+    default_repetitions = 5
+
+    parser = argparse.ArgumentParser(description='Measure the cold start of loading a model for planning, with pytorch_lightning and with the inference-only loader')
+    parser.add_argument('--model', type=Path, default=None, help=f'checkpoint to load (default=first checkpoint in {default_models})')
+    parser.add_argument('--aggregation', default='max', choices=['add', 'max', 'addmax', 'exactmax', 'addexactmax', 'attention'], help='aggregation function of the model (default=max)')
+    parser.add_argument('--readout', action='store_true', help='model uses global readout')
+    parser.add_argument('--repetitions', type=int, default=default_repetitions, help=f'fresh interpreters per loader (default={default_repetitions})')
+    args = parser.parse_args()
+    if args.model is None: args.model = sorted(default_models.glob('*/*.ckpt'))[0]
+    return args
+
+def _run(args, imports: str, load: str):
+    # wall-clock time of the whole interpreter, and the times of the imports and of the load measured inside it
+    network_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = '\n'.join([ 'import sys',
+                        'from timeit import default_timer as timer',
+                        'start_time = timer()',
+                        f'sys.path.append({network_path!r})',
+                        imports,
+                        'import_time = timer() - start_time',
+                        f'checkpoint, aggregation, readout = {str(args.model)!r}, {args.aggregation!r}, {args.readout!r}',
+                        load,
+                        'print(import_time, timer() - start_time - import_time, "pytorch_lightning" in sys.modules)' ])
+    start_time = timer()
+    output = subprocess.run([ sys.executable, '-c', code ], check=True, capture_output=True, text=True).stdout
+    total_time = timer() - start_time
+    import_time, load_time, lightning = output.split()[-3:]
+    return total_time, float(import_time), float(load_time), lightning == 'True'
+
+def _main(args):
+    print(f"Model '{args.model}', {args.repetitions} fresh interpreter(s) per loader")
+    print(f'{"loader":>10s} {"total":>8s} {"min":>8s} {"imports":>8s} {"load":>8s} {"lightning":>10s}')
+    mean_times = dict()
+    for name, (imports, load) in g_loaders.items():
+        runs = [ _run(args, imports, load) for _ in range(args.repetitions) ]
+        mean_times[name] = sum([ run[0] for run in runs ]) / len(runs)
+        mean_imports = sum([ run[1] for run in runs ]) / len(runs)
+        mean_load = sum([ run[2] for run in runs ]) / len(runs)
+        print(f'{name:>10s} {mean_times[name]:>8.3f} {min([ run[0] for run in runs ]):>8.3f} {mean_imports:>8.3f} {mean_load:>8.3f} {str(runs[0][3]):>10s}')
+    print(f'speedup: {mean_times["lightning"] / mean_times["inference"]:.2f}x')
+
+
+if __name__ == "__main__":
+    args = _parse_arguments()
+    _main(args)
\ No newline at end of file
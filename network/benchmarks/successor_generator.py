@@ -0,0 +1,79 @@
+import sys
+import os.path
+from pathlib import Path
+from random import Random
+from timeit import default_timer as timer
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from generators import load_pddl_problem, AtomTable, SuccessorGenerator
+from generators.plan import _get_applicable_actions, _apply_action
+
+
+def _parse_arguments():
+    default_pddl = Path(__file__).parent.parent.parent / 'data' / 'pddl'
+    default_max_problems = 3
+    default_steps = 50
+    default_seed = 0
+
+    parser = argparse.ArgumentParser(description='Compare successor generation on tarski states (linear scan and deepcopy) against SuccessorGenerator on bitset states')
+    parser.add_argument('--pddl', type=Path, default=default_pddl, help=f'folder with one subfolder per domain (default={default_pddl})')
+    parser.add_argument('--domains', type=str, nargs='*', default=None, help='domains to benchmark (default=all)')
+    parser.add_argument('--split', type=str, default='test', help='subfolder of each domain with problems (default=test)')
+    parser.add_argument('--max_problems', type=int, default=default_max_problems, help=f'number of problems per domain (default={default_max_problems})')
+    parser.add_argument('--steps', type=int, default=default_steps, help=f'length of the random walk that collects states (default={default_steps})')
+    parser.add_argument('--seed', type=int, default=default_seed, help=f'seed of the random walk (default={default_seed})')
+    return parser.parse_args()
+
+def _random_walk(initial, successor_generator, steps: int, rng: Random):
+    states = [ initial ]
+    for _ in range(steps):
+        successors = successor_generator.successors(states[-1])
+        if len(successors) == 0: break
+        states.append(rng.choice(successors)[1])
+    return states
+
+def _benchmark_problem(domain: Path, problem: Path, steps: int, rng: Random):
+    pddl_problem = load_pddl_problem(domain, problem)
+    actions, initial = pddl_problem['actions'], pddl_problem['initial']
+
+    start_time = timer()
+    table = AtomTable(pddl_problem['language'])
+    successor_generator = SuccessorGenerator(actions, table, initial)
+    build_time = timer() - start_time
+    states = _random_walk(table.from_tarski(initial), successor_generator, steps, rng)
+    tarski_states = [ state.to_tarski() for state in states ]
+
+    start_time = timer()
+    reference = [ [ (action, _apply_action(state, action)) for action in _get_applicable_actions(state, actions) ] for state in tarski_states ]
+    linear_time = timer() - start_time
+    start_time = timer()
+    result = [ successor_generator.successors(state) for state in states ]
+    tree_time = timer() - start_time
+    for expected, successors in zip(reference, result):
+        assert [ action for action, _ in expected ] == [ action for action, _ in successors ], f'successor generator disagrees with linear scan on {problem}'
+        assert [ table.from_tarski(state) for _, state in expected ] == [ state for _, state in successors ], f'successor states differ on {problem}'
+    return len(actions), len(states), build_time, linear_time, tree_time
+
+def _main(args):
+    rng = Random(args.seed)
+    domains = sorted([ path for path in args.pddl.iterdir() if path.is_dir() and (args.domains is None or path.name in args.domains) ])
+    print(f'{"problem":>48s} {"#ops":>7s} {"#states":>7s} {"build":>8s} {"linear":>8s} {"tree":>8s} {"speedup":>8s}')
+    for domain_path in domains:
+        domain = domain_path / args.split / 'domain.pddl'
+        if not domain.exists(): continue
+        problems = sorted([ path for path in domain.parent.glob('*.pddl') if path.name != 'domain.pddl' ])[:args.max_problems]
+        total_linear, total_tree = 0.0, 0.0
+        for problem in problems:
+            num_actions, num_states, build_time, linear_time, tree_time = _benchmark_problem(domain, problem, args.steps, rng)
+            total_linear += linear_time
+            total_tree += tree_time
+            name = f'{domain_path.name}/{problem.stem}'
+            print(f'{name:>48s} {num_actions:>7d} {num_states:>7d} {build_time:>8.3f} {linear_time:>8.3f} {tree_time:>8.3f} {linear_time / max(tree_time, 1e-9):>7.1f}x')
+        if len(problems) > 0:
+            print(f'{domain_path.name + " (total)":>48s} {"":>7s} {"":>7s} {"":>8s} {total_linear:>8.3f} {total_tree:>8.3f} {total_linear / max(total_tree, 1e-9):>7.1f}x')
+
+
+if __name__ == "__main__":
+    args = _parse_arguments()
+    _main(args)
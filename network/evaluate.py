@@ -0,0 +1,188 @@
+import sys
+import os.path
+import multiprocessing
+import resource
+from multiprocessing.connection import wait
+from sys import argv, stdout
+from pathlib import Path
+from termcolor import colored
+from timeit import default_timer as timer
+import argparse, logging
+import torch
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from generators import compute_traces_with_augmented_states, load_pddl_problem_with_augmented_states, GroundingCache
+from architecture import load_network
+from plan import _get_logger, _log_result
+
+# result files per mode, named as expected by data/results/get_coverage_table.py
+g_modes = { 'policy': 'avoid', 'markovian': 'detect' }
+
+
+def _parse_arguments():
+    data_path = Path(__file__).parent.parent / 'data'
+    default_aggregation = 'max'
+    default_grounder = 'lp'
+    default_logfile = 'log_evaluate.txt'
+    default_max_length = 500
+    default_max_memory = 8192
+    default_max_time = 1800
+    default_models = data_path / 'models'
+    default_pddl = data_path / 'pddl'
+    default_registry_filename = '../DerivedPredicates/registry_rules.json'
+    default_results = data_path / 'results' / 'evaluation'
+    default_split = 'test'
+    default_threads = 1
+    default_workers = os.cpu_count()
+
+    parser = argparse.ArgumentParser(description='Run plan.py on the problems of every domain with a model, in parallel and resuming from the results of earlier runs')
+    parser.add_argument('--aggregation', default=default_aggregation, nargs='?', choices=['add', 'max', 'addmax', 'exactmax', 'addexactmax', 'attention'], help=f'aggregation function for readout (default={default_aggregation})')
+    parser.add_argument('--augment', action='store_true', help='augment states with derived predicates')
+    parser.add_argument('--cpu', action='store_true', help='use CPU')
+    parser.add_argument('--debug_level', dest='debug_level', type=int, default=0, help='set debug level (default=0)')
+    parser.add_argument('--deterministic', action='store_true', help='use fixed instead of random noise for initial object embeddings')
+    parser.add_argument('--domains', type=str, nargs='*', default=None, help='domains to evaluate (default=all with a model and problems)')
+    parser.add_argument('--grounder', type=str, default=default_grounder, choices=['lp', 'native'], help=f'grounder of the PDDL problems, tarski with gringo or relaxed reachability in Python (default={default_grounder})')
+    parser.add_argument('--grounding_cache', type=Path, default=None, help='directory of the persistent cache of grounded problems (default=no cache)')
+    parser.add_argument('--ignore_unsolvable', action='store_true', help='ignore unsolvable states in policy controller')
+    parser.add_argument('--logfile', type=Path, default=default_logfile, help=f'log file (default={default_logfile})')
+    parser.add_argument('--max_length', type=int, default=default_max_length, help=f'max trace length (default={default_max_length})')
+    parser.add_argument('--max_memory', type=int, default=default_max_memory, help=f'address space limit of each job in MiB, 0 disables it (default={default_max_memory})')
+    parser.add_argument('--max_time', type=float, default=default_max_time, help=f'wall-clock limit of each job in seconds, 0 disables it (default={default_max_time})')
+    parser.add_argument('--modes', type=str, nargs='+', default=list(g_modes.keys()), choices=list(g_modes.keys()), help='policy avoids cycles, markovian detects them (default=both)')
+    parser.add_argument('--models', type=Path, default=default_models, help=f'folder with one subfolder per domain with its checkpoint (default={default_models})')
+    parser.add_argument('--pddl', type=Path, default=default_pddl, help=f'folder with one subfolder per domain (default={default_pddl})')
+    parser.add_argument('--readout', action='store_true', help='use global readout')
+    parser.add_argument('--registry_filename', type=Path, default=default_registry_filename, help=f'registry filename (default={default_registry_filename})')
+    parser.add_argument('--registry_key', type=str, default=None, help=f'key into registry (if missing, calculated from domain path)')
+    parser.add_argument('--results', type=Path, default=default_results, help=f'folder for the results, with one subfolder per domain (default={default_results})')
+    parser.add_argument('--spanner', action='store_true', help='special handling for Spanner problems')
+    parser.add_argument('--split', type=str, default=default_split, help=f'subfolder of each domain with problems (default={default_split})')
+    parser.add_argument('--threads', type=int, default=default_threads, help=f'number of threads of each job (default={default_threads})')
+    parser.add_argument('--workers', type=int, default=default_workers, help=f'number of jobs that run in parallel (default={default_workers})')
+    args = parser.parse_args()
+    args.print_trace = True
+    return args
+
+def _is_solved(result_file: Path):
+    if not result_file.exists(): return False
+    with result_file.open('r') as fd:
+        return any([ line.find('Found valid plan') > 0 for line in fd ])
+
+def _get_jobs(args, domain: str):
+    # (problem, mode, result file) for every job of the domain whose result isn't solved yet
+    problems = sorted([ path for path in (args.pddl / domain / args.split).glob('*.pddl') if path.name != 'domain.pddl' ])
+    jobs, num_solved = [], 0
+    for problem in problems:
+        for mode in args.modes:
+            result_file = args.results / domain / f'{problem.stem}.{mode}'
+            if _is_solved(result_file): num_solved += 1
+            else: jobs.append((problem, mode, result_file))
+    return jobs, num_solved
+
+def _run_job(args, model, domain_file: Path, problem: Path, mode: str, result_file: Path):
+    # runs in a forked process that inherits the model, and writes its log in the format of plan.py
+    if args.max_memory > 0:
+        limit = args.max_memory * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if result_file.exists(): result_file.unlink()
+    logger = _get_logger(f'{Path(argv[0]).stem}.{result_file.name}', result_file, logging.INFO if args.debug_level == 0 else logging.DEBUG, False)
+    try:
+        logger.info(f"Loading PDDL files: domain='{domain_file}', problem='{problem}'")
+        registry_filename = args.registry_filename if args.augment else None
+        grounding_cache = GroundingCache(args.grounding_cache) if args.grounding_cache is not None else None
+        pddl_problem = load_pddl_problem_with_augmented_states(domain_file, problem, registry_filename, args.registry_key, logger, grounding_cache, args.grounder)
+        del pddl_problem['predicates']
+
+        logger.info(f'Executing policy (max_length={args.max_length}, cycles={g_modes[mode]})')
+        start_time = timer()
+        is_spanner = args.spanner and 'spanner' in str(domain_file)
+        unsolvable_weight = 0.0 if args.ignore_unsolvable else 100000.0
+        action_trace, state_trace, value_trace, is_solution, num_evaluations = compute_traces_with_augmented_states(model=model, cycles=g_modes[mode], max_trace_length=args.max_length, unsolvable_weight=unsolvable_weight, logger=logger, is_spanner=is_spanner, **pddl_problem)
+        elapsed_time = timer() - start_time
+        logger.info(f'{len(action_trace)} executed action(s) and {num_evaluations} state evaluations(s) in {elapsed_time:.3f} second(s)')
+        _log_result(logger, args, problem, action_trace, value_trace, is_solution)
+    except MemoryError:
+        logger.error(f'Memory limit of {args.max_memory} MiB exceeded')
+        sys.exit(1)
+
+def _evaluate_domain(args, domain: str, model_file: Path):
+    global logger
+    domain_file = args.pddl / domain / args.split / 'domain.pddl'
+    jobs, num_solved = _get_jobs(args, domain)
+    logger.info(f'{domain}: {len(jobs)} job(s) to run, {num_solved} already solved')
+    if len(jobs) == 0: return
+    (args.results / domain).mkdir(parents=True, exist_ok=True)
+
+    # the model is loaded once and shared with the jobs, which are forked from this process
+    start_time = timer()
+    use_gpu = not args.cpu and torch.cuda.is_available()
+    device = torch.cuda.current_device() if use_gpu else torch.device('cpu')
+    model = load_network(model_file, args.aggregation, args.readout, device)
+    if args.deterministic: model.set_deterministic()
+    logger.info(f"Model '{model_file}' loaded in {timer() - start_time:.3f} second(s)")
+
+    context = multiprocessing.get_context('fork')
+    running = dict()
+    pending = list(reversed(jobs))
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < args.workers:
+            problem, mode, result_file = pending.pop()
+            process = context.Process(target=_run_job, args=(args, model, domain_file, problem, mode, result_file))
+            process.start()
+            running[process.sentinel] = (process, problem, mode, result_file, timer())
+
+        # wake up when a job finishes or when the earliest deadline passes
+        timeout = None
+        if args.max_time > 0:
+            timeout = max(0.0, min([ start + args.max_time for _, _, _, _, start in running.values() ]) - timer())
+        finished = wait(list(running.keys()), timeout)
+        now = timer()
+        for sentinel, (process, problem, mode, result_file, start) in list(running.items()):
+            if sentinel not in finished and (args.max_time <= 0 or now - start < args.max_time): continue
+            if sentinel not in finished:
+                process.kill()
+                with result_file.open('a') as fd:
+                    fd.write(f'Time limit of {args.max_time} second(s) exceeded\n')
+            process.join()
+            del running[sentinel]
+            solved = _is_solved(result_file)
+            status = 'solved' if solved else 'timeout' if sentinel not in finished else f'failed (exit code {process.exitcode})' if process.exitcode != 0 else 'failed'
+            logger.info(colored(f'{domain}/{problem.stem}.{mode}: {status} in {now - start:.3f} second(s)', 'green' if solved else 'red'))
+
+def _main(args):
+    global logger
+    torch.set_num_threads(args.threads)
+    for model_path in sorted([ path for path in args.models.iterdir() if path.is_dir() ]):
+        domain = model_path.name
+        if args.domains is not None and domain not in args.domains: continue
+        model_files = sorted(model_path.glob('*.ckpt'))
+        if len(model_files) == 0 or not (args.pddl / domain / args.split / 'domain.pddl').exists():
+            logger.warning(f'{domain}: skipped, no checkpoint or no problems in {args.pddl / domain / args.split}')
+            continue
+        _evaluate_domain(args, domain, model_files[-1])
+    logger.info(f'Results in {args.results}; coverage table: cd {args.results} && python {Path(__file__).parent.parent.resolve() / "data" / "results" / "get_coverage_table.py"}')
+
+
+if __name__ == "__main__":
+    # setup timer and exec name
+    entry_time = timer()
+    exec_path = Path(argv[0]).parent
+    exec_name = Path(argv[0]).stem
+
+    # parse arguments
+    args = _parse_arguments()
+
+    # setup logger
+    log_path = exec_path
+    logfile = log_path / args.logfile
+    log_level = logging.INFO if args.debug_level == 0 else logging.DEBUG
+    logger = _get_logger(exec_name, logfile, log_level)
+    logger.info(f'Call: {" ".join(argv)}')
+
+    # do jobs
+    _main(args)
+
+    # final stats
+    elapsed_time = timer() - entry_time
+    logger.info(f'All tasks completed in {elapsed_time:.3f} second(s)')
@@ -0,0 +1,213 @@
+import sys
+import os.path
+from sys import argv
+from pathlib import Path
+from timeit import default_timer as timer
+import argparse, io, logging
+import torch
+import torch.nn as nn
+
+# Imports related to type annotations
+from typing import Dict
+from torch.nn.functional import Tensor
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from architecture import g_onnx_suffix, g_torchscript_suffix, load_network, set_fused_messages, MessageLayout, OnnxNetwork
+from architecture import AddNetwork, AttentionNetwork, MaxNetwork, MaxReadoutNetwork
+from plan import _get_logger
+
+g_suffixes = { 'torchscript': g_torchscript_suffix, 'onnx': g_onnx_suffix }
+
+
+def _parse_arguments():
+    default_aggregation = 'max'
+    default_format = 'torchscript'
+    default_logfile = 'log_export.txt'
+    default_models = Path(__file__).parent.parent / 'data' / 'models'
+    default_tolerance = 1e-4
+
+    parser = argparse.ArgumentParser(description='Export checkpoints as self-contained TorchScript or ONNX networks, which plan.py loads without pytorch_lightning')
+    parser.add_argument('--aggregation', default=default_aggregation, nargs='?', choices=['add', 'max', 'addmax', 'exactmax', 'addexactmax', 'attention'], help=f'aggregation function for readout (default={default_aggregation})')
+    parser.add_argument('--debug_level', dest='debug_level', type=int, default=0, help='set debug level (default=0)')
+    parser.add_argument('--format', type=str, default=default_format, choices=list(g_suffixes.keys()), help=f'TorchScript for the torch backend of plan.py or ONNX for its onnxruntime backend (default={default_format})')
+    parser.add_argument('--logfile', type=Path, default=default_logfile, help=f'log file (default={default_logfile})')
+    parser.add_argument('--models', type=Path, nargs='+', default=[ default_models ], help=f'checkpoints or folders with checkpoints (default={default_models})')
+    parser.add_argument('--output', type=Path, default=None, help='folder for the exported networks, with one subfolder per folder of the checkpoints (default=next to each checkpoint)')
+    parser.add_argument('--readout', action='store_true', help='use global readout')
+    parser.add_argument('--tolerance', type=float, default=default_tolerance, help=f'max difference between the outputs of the exported network and the checkpoint, relative to outputs above 1 (default={default_tolerance})')
+    return parser.parse_args()
+
+def _get_checkpoints(paths):
+    checkpoints = []
+    for path in paths:
+        if path.is_dir(): checkpoints.extend(sorted(path.rglob('*.ckpt')))
+        else: checkpoints.append(path)
+    return checkpoints
+
+def _random_states(predicates, batch_num_objects, seed: int = 0):
+    # batch of states with as many random atoms per predicate as objects, over the objects of each state
+    generator = torch.Generator().manual_seed(seed)
+    relations, offset = dict(), 0
+    for num_objects in batch_num_objects:
+        for predicate, arity in predicates:
+            if arity == 0: continue
+            values = torch.randint(offset, offset + num_objects, (num_objects * arity,), generator=generator)
+            relations[predicate] = torch.cat([ relations[predicate], values ]) if predicate in relations else values
+        offset += num_objects
+    return (relations, batch_num_objects)
+
+def _as_tuple(outputs):
+    return outputs if isinstance(outputs, tuple) else (outputs,)
+
+def _readout(readout: nn.Module, sizes: Tensor, node_states: Tensor) -> Tensor:
+    # Readout.forward() with the number of objects of each state as a tensor
+    cumsum_states = readout.pre(node_states).cumsum(0).index_select(0, sizes.cumsum(0) - 1)
+    return readout.post(torch.cat((cumsum_states[0:1], cumsum_states[1:] - cumsum_states[0:-1])))
+
+def _attention(relation_network: nn.Module, node_states: Tensor, relations: Dict[int, Tensor], layout: MessageLayout) -> Tensor:
+    # RelationMessagePassing.forward() of the attention aggregation with the pairs of queries and messages as a dense
+    # (objects x messages) mask instead of the indices of _attention_indices(), since repeat_interleave(), bincount()
+    # and scatter_reduce() without the initial values aren't exported to ONNX correctly
+    outputs = relation_network.messages(node_states, relations, layout)
+    recipients = layout.recipients
+    objects = torch.arange(node_states.shape[0]).view(-1, 1)
+    lengths = (recipients.view(1, -1) == objects).sum(1)
+    starts = torch.cumsum(lengths, 0) - lengths
+    # the query of an object is paired with a message if the object is within the slots of the messages of its recipient
+    slots = starts.index_select(0, recipients).view(1, -1)
+    pairs = (objects >= slots) & (objects < slots + lengths.index_select(0, recipients).view(1, -1))
+    queries = relation_network.query_weight(node_states)
+    keys = relation_network.key_weight(outputs)
+    values = relation_network.value_weight(outputs)
+    scores = torch.matmul(queries, keys.t()) / torch.sqrt(lengths.index_select(0, recipients).to(torch.float)).view(1, -1)
+    # softmax of the scores of each message over its objects, messages without objects have no weights
+    scores = scores.masked_fill(~pairs, float('-inf'))
+    max_scores = torch.max(scores, 0, keepdim=True)[0]
+    exps = torch.exp(scores - max_scores.masked_fill(torch.isinf(max_scores), 0.0))
+    exps_sum = torch.sum(exps, 0, keepdim=True)
+    attentions = torch.matmul(exps / exps_sum.masked_fill(exps_sum == 0.0, 1.0), values)
+    return relation_network.update(relation_network.update_input([ attentions ], node_states, layout))
+
+class _OnnxNetwork(nn.Module):
+    """
+    Forward pass of a network over tensors only, which torch.onnx.export() traces: the number of
+    objects of each state, the noise of the initial object embeddings and the atoms of each
+    predicate with positive arity, in the order of the predicates.
+    """
+
+    def __init__(self, network: nn.Module, predicates):
+        super().__init__()
+        # the fused relation MLPs pad the atoms to sizes that tracing would fix
+        set_fused_messages(network, False)
+        self.network = network
+        self.relations = [ network.encoding[predicate] for predicate, arity in predicates if arity > 0 ]
+
+    def forward(self, sizes: Tensor, noise: Tensor, *atoms: Tensor):
+        network, model = self.network, self.network.model
+        relations = dict(zip(self.relations, atoms))
+        node_states = torch.cat([ torch.zeros((noise.shape[0], (model.hidden_size // 2) + (model.hidden_size % 2))), noise ], dim=1)
+        layout = model.relation_network.layout(node_states, relations)
+        for _ in range(model.iterations):
+            if isinstance(network, AttentionNetwork):
+                node_states = _attention(model.relation_network, node_states, relations, layout)
+            else:
+                node_states = model.relation_network(node_states, relations, layout)
+            if isinstance(network, MaxReadoutNetwork):
+                # state of each object from the cumulative sizes, repeat_interleave() isn't exported correctly
+                states = (torch.arange(noise.shape[0]).view(-1, 1) >= sizes.cumsum(0).view(1, -1)).sum(1)
+                readout = _readout(model.global_readout, sizes, node_states)
+                node_states = model.readout_update(torch.cat((node_states, readout.index_select(0, states)), dim=1))
+
+        if isinstance(network, AddNetwork):
+            # as in AddNetwork, both outputs come from the value readout
+            value = solvable = _readout(model.value_readout, sizes, node_states)
+        elif isinstance(network, AttentionNetwork):
+            # AttentionNetwork only has a value, which is also the second output of the ONNX network
+            value = solvable = torch.abs(_readout(model.readout, sizes, node_states))
+        elif isinstance(network, MaxNetwork):
+            value, solvable = _readout(network.readout, sizes, node_states), _readout(network.solvable_readout, sizes, node_states)
+        else:
+            value, solvable = _readout(network.value_readout, sizes, node_states), _readout(network.solvable_readout, sizes, node_states)
+        if isinstance(network, MaxReadoutNetwork): solvable = torch.sigmoid(solvable)
+        return torch.abs(value), solvable
+
+def _to_onnx(network: nn.Module, predicates, states) -> bytes:
+    # traces the network on states, with dynamic axes for the number of states, objects and atoms
+    names = [ predicate for predicate, arity in predicates if arity > 0 ]
+    inputs = (torch.tensor(states[1]), torch.randn((sum(states[1]), network.model.hidden_size // 2)), *[ states[0][name] for name in names ])
+    dynamic_axes = { 'sizes': { 0: 'states' }, 'noise': { 0: 'objects' }, 'value': { 0: 'states' }, 'solvable': { 0: 'states' } }
+    dynamic_axes.update([ (name, { 0: f'{name}_atoms' }) for name in names ])
+    buffer = io.BytesIO()
+    with torch.no_grad():
+        torch.onnx.export(_OnnxNetwork(network, predicates), inputs, buffer, input_names=[ 'sizes', 'noise' ] + names, output_names=[ 'value', 'solvable' ], dynamic_axes=dynamic_axes, dynamo=False)
+    return buffer.getvalue()
+
+def _export(args, checkpoint: Path, output_file: Path):
+    # exports the network of the checkpoint and returns the max difference between the outputs of both
+    network = load_network(checkpoint, args.aggregation, args.readout)
+    predicates = torch.load(str(checkpoint), map_location='cpu', weights_only=False)['hyper_parameters']['predicates']
+    states = _random_states(predicates, [ 4, 7, 12 ])
+    if args.format == 'onnx':
+        model = _to_onnx(network, predicates, states)
+        exported = OnnxNetwork(model)
+        save = lambda: output_file.write_bytes(model)
+    else:
+        exported = torch.jit.script(network)
+        save = lambda: torch.jit.save(exported, str(output_file))
+
+    # compare on random states with fixed noise for the initial object embeddings, also without
+    # the atoms of a predicate, which are empty inputs of the ONNX network
+    batches = [ states ]
+    if len(states[0]) > 1:
+        relations, batch_num_objects = _random_states(predicates, [ 5, 3 ], 1)
+        batches.append((dict(list(relations.items())[1:]), batch_num_objects))
+    network.set_deterministic()
+    exported.set_deterministic(True)
+    with torch.no_grad():
+        differences = [ float(torch.max(torch.abs(expected - actual) / torch.clamp(torch.abs(expected), min=1.0))) for batch in batches for expected, actual in zip(_as_tuple(network(batch)), _as_tuple(exported(batch))) ]
+    exported.set_deterministic(False)
+
+    if max(differences) <= args.tolerance:
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        save()
+    return max(differences)
+
+def _main(args):
+    global logger
+    checkpoints = _get_checkpoints(args.models)
+    num_exported = 0
+    for checkpoint in checkpoints:
+        suffix = g_suffixes[args.format]
+        output_file = checkpoint.with_suffix(suffix) if args.output is None else args.output / checkpoint.parent.name / f'{checkpoint.stem}{suffix}'
+        start_time = timer()
+        difference = _export(args, checkpoint, output_file)
+        if difference > args.tolerance:
+            logger.error(f"Outputs of '{checkpoint}' differ by {difference:.3g} after the export to {args.format}, not exported")
+            continue
+        logger.info(f"Exported '{checkpoint}' to '{output_file}' in {timer() - start_time:.3f} second(s) (max. difference {difference:.3g})")
+        num_exported += 1
+    logger.info(f'{num_exported} of {len(checkpoints)} checkpoint(s) exported')
+
+
+if __name__ == "__main__":
+    # setup timer and exec name
+    entry_time = timer()
+    exec_path = Path(argv[0]).parent
+    exec_name = Path(argv[0]).stem
+
+    # parse arguments
+    args = _parse_arguments()
+
+    # setup logger
+    log_path = exec_path
+    logfile = log_path / args.logfile
+    log_level = logging.INFO if args.debug_level == 0 else logging.DEBUG
+    logger = _get_logger(exec_name, logfile, log_level)
+    logger.info(f'Call: {" ".join(argv)}')
+
+    # do jobs
+    _main(args)
+
+    # final stats
+    elapsed_time = timer() - entry_time
+    logger.info(f'All tasks completed in {elapsed_time:.3f} second(s)')
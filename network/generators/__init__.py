@@ -2,5 +2,14 @@ from .plan import create_object_encoding
 from .plan import load_pddl_problem, load_pddl_problem_with_augmented_states
 from .plan import policy_search, compute_traces
 from .plan import policy_search_with_augmented_states, compute_traces_with_augmented_states
+from .plan import beam_search_with_augmented_states, compute_traces_with_beam_search
+from .plan import gbfs_with_augmented_states, compute_traces_with_gbfs
+from .plan import compute_traces_for_problems
 from .plan import serve_policy, setup_policy_server, apply_policy_to_state, get_num_vars
 from .plan import apply_policy_to_state_prob_dist
+from .cache import EvaluationCache
+from .grounder import RelaxedGrounder, ground_problem_schemas_with_relaxed_reachability
+from .grounding_cache import GroundingCache
+from .lifted import LiftedSuccessorGenerator
+from .state import AtomTable, State
+from .successor import SuccessorGenerator
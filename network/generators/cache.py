@@ -0,0 +1,94 @@
+import sys
+import torch
+
+from collections import OrderedDict
+from typing import Callable, List, Tuple
+
+from .state import State
+
+
+class EvaluationCache:
+    """
+    Transposition table for model outputs. States are keyed by their bitset (hashed by the
+    Zobrist key), and the raw value and solvable outputs are kept for the most recently used
+    states within a memory bound. Cached outputs are only reproducible if the model doesn't
+    draw fresh noise, see set_deterministic() of the models.
+    """
+
+    # approximate size of an entry besides the bitset: state object, dictionary slot and outputs
+    ENTRY_OVERHEAD = 256
+
+    def __init__(self, max_memory: int = 256 * 1024 * 1024):
+        self.max_memory = max_memory
+        self.memory = 0
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / lookups if lookups > 0 else 0.0
+        return f'{len(self.entries)} entries ({self.memory / 2**20:.1f} MiB), {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), {self.evictions} evictions'
+
+    def _entry_size(self, state: State) -> int:
+        return sys.getsizeof(state.bits) + EvaluationCache.ENTRY_OVERHEAD
+
+    def get(self, state: State):
+        """Cached (value, solvable) pair of state, or None."""
+        entry = self.entries.get(state)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(state)
+        return entry
+
+    def put(self, state: State, value: float, solvable: float):
+        if state in self.entries:
+            self.entries.move_to_end(state)
+        else:
+            self.memory += self._entry_size(state)
+        self.entries[state] = (value, solvable)
+        while self.memory > self.max_memory and len(self.entries) > 0:
+            evicted, _ = self.entries.popitem(last=False)
+            self.memory -= self._entry_size(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.memory = 0
+
+    def evaluate_steps(self, states: List[State], device = None):
+        """
+        Generator version of evaluate(): yields the states that are not in the cache (if any) and
+        expects their outputs (values, solvables) to be sent back; returns the outputs for states.
+        """
+        outputs = [ self.get(state) for state in states ]
+        missing = [ index for index, output in enumerate(outputs) if output is None ]
+        if len(missing) > 0:
+            # a state can occur more than once in a batch, it is evaluated once
+            unique = list(OrderedDict([ (states[index], None) for index in missing ]).keys())
+            values, solvables = yield unique
+            results = dict()
+            for state, value, solvable in zip(unique, values.view(-1).tolist(), solvables.view(-1).tolist()):
+                self.put(state, value, solvable)
+                results[state] = (value, solvable)
+            for index in missing: outputs[index] = results[states[index]]
+        values = torch.tensor([ [ value ] for value, _ in outputs ], dtype=torch.float, device=device)
+        solvables = torch.tensor([ [ solvable ] for _, solvable in outputs ], dtype=torch.float, device=device)
+        return values, solvables
+
+    def evaluate(self, states: List[State], evaluate_fn: Callable, device = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Outputs (values, solvables) for states, each of shape (len(states), 1) like the outputs of the models.
+        States that are not in the cache are evaluated in a single call to evaluate_fn.
+        """
+        steps = self.evaluate_steps(states, device)
+        try:
+            steps.send(evaluate_fn(next(steps)))
+        except StopIteration as stop:
+            return stop.value
@@ -0,0 +1,179 @@
+import numpy as np
+import torch
+
+from typing import Dict, List
+
+from .state import AtomTable, State
+
+
+class StateEncoder:
+    """
+    Encodes batches of bitset states directly into the collated (input, sizes) structure
+    expected by the models. Atom ids are mapped to predicates and object ids through tables
+    that are computed once per atom, so a batch is encoded with a few NumPy gathers instead
+    of per-atom Python loops and per-predicate tensors.
+
+    Atoms of the optional static state must be part of every encoded state. They are encoded
+    once, together with the goal atoms, into a template that is broadcast over the object
+    offsets of a batch, so only the remaining atoms are unpacked for each state.
+    """
+
+    def __init__(self, table: AtomTable, obj_encoding: Dict, goal_denotation: Dict[str, List[int]], static: State = None):
+        self.table = table
+        self.obj_encoding = obj_encoding
+        self.num_objects = len([ key for key in obj_encoding if isinstance(key, int) ])
+        self.static_bits = static.bits if static is not None else 0
+        self.predicate_names: List[str] = []
+        self.predicate_arities: List[int] = []
+        self._predicate_ids: Dict[str, int] = dict()
+        self._atom_predicate = np.zeros(0, dtype=np.int64)
+        self._atom_objects = np.zeros((0, 0), dtype=np.int64)
+        self._parent: State = None
+        self._parent_ids = np.zeros(0, dtype=np.int64)
+
+        # template of static and goal atoms, as object ids of a single state
+        self._update_tables()
+        self.template: Dict[str, np.ndarray] = dict()
+        if static is not None:
+            atom_ids = np.array(static.atom_ids(), dtype=np.int64)
+            for predicate_name, objects in self._group(np.zeros(len(atom_ids), dtype=np.int64), atom_ids).items():
+                self.template[predicate_name] = objects
+        for predicate_name, objects in goal_denotation.items():
+            if len(objects) > 0: self.template[predicate_name] = np.array(objects, dtype=np.int64)
+
+    def _update_tables(self):
+        # extend tables with atoms interned since the last call; nullary atoms get predicate -1 as they carry no objects
+        size = len(self._atom_predicate)
+        if size == len(self.table): return
+        keys = self.table.keys[size:]
+        max_arity = max([ self._atom_objects.shape[1] ] + [ len(objects) for _, objects in keys ])
+        atom_predicate = np.full(len(keys), -1, dtype=np.int64)
+        atom_objects = np.zeros((len(keys), max_arity), dtype=np.int64)
+        for index, (predicate_name, objects) in enumerate(keys):
+            if len(objects) == 0: continue
+            if predicate_name not in self._predicate_ids:
+                self._predicate_ids[predicate_name] = len(self.predicate_names)
+                self.predicate_names.append(predicate_name)
+                self.predicate_arities.append(len(objects))
+            atom_predicate[index] = self._predicate_ids[predicate_name]
+            atom_objects[index, :len(objects)] = [ self.obj_encoding[obj] for obj in objects ]
+        if max_arity > self._atom_objects.shape[1]:
+            self._atom_objects = np.pad(self._atom_objects, ((0, 0), (0, max_arity - self._atom_objects.shape[1])))
+        self._atom_predicate = np.concatenate([ self._atom_predicate, atom_predicate ])
+        self._atom_objects = np.concatenate([ self._atom_objects, atom_objects ])
+
+    def _atom_pairs(self, states: List[State]):
+        # (state index, atom id) for every atom of every state, by unpacking the bitsets in one go
+        num_atoms = len(self.table)
+        num_bytes = (num_atoms + 7) // 8
+        dynamic_mask = ~self.static_bits
+        packed = np.frombuffer(b''.join([ (state.bits & dynamic_mask).to_bytes(num_bytes, 'little') for state in states ]), dtype=np.uint8).reshape(len(states), num_bytes)
+        return np.nonzero(np.unpackbits(packed, axis=1, count=num_atoms, bitorder='little'))
+
+    def _atom_ids(self, state: State):
+        # sorted atom ids of a single state; the last parent is kept as successors are encoded against it
+        if self._parent is None or self._parent != state:
+            self._parent, self._parent_ids = state, self._atom_pairs([ state ])[1].astype(np.int64)
+        return self._parent_ids
+
+    def _successor_pairs(self, parent: State, states: List[State]):
+        # (state index, atom id) for every atom of every successor, obtained from the atoms of the parent
+        # by dropping the deleted ones and appending the added ones; only the effects are visited in Python
+        parent_ids = self._atom_ids(parent)
+        keep = np.ones((len(states), len(parent_ids)), dtype=bool)
+        deleted_rows, deleted_ids, added_rows, added_ids = [], [], [], []
+        for row, state in enumerate(states):
+            changed = state.bits ^ parent.bits
+            while changed:
+                low = changed & -changed
+                if state.bits & low:
+                    added_rows.append(row)
+                    added_ids.append(low.bit_length() - 1)
+                else:
+                    deleted_rows.append(row)
+                    deleted_ids.append(low.bit_length() - 1)
+                changed ^= low
+        if len(deleted_ids) > 0:
+            keep[deleted_rows, np.searchsorted(parent_ids, deleted_ids)] = False
+        state_indices, positions = np.nonzero(keep)
+        state_indices = np.concatenate([ state_indices, np.array(added_rows, dtype=np.int64) ])
+        atom_ids = np.concatenate([ parent_ids[positions], np.array(added_ids, dtype=np.int64) ])
+        return state_indices, atom_ids
+
+    def collate(self, states: List[State], device, derived_atoms: List[Dict[str, set]] = None):
+        """
+        Input: [state], optional [derived atoms of state]
+        Output: (states, sizes)
+        """
+        self._update_tables()
+        state_indices, atom_ids = self._atom_pairs(states)
+        return self._collate_pairs(state_indices, atom_ids, len(states), device, derived_atoms)
+
+    def collate_successors(self, parent: State, states: List[State], device):
+        """
+        Input: parent, [successor of parent]
+        Output: (states, sizes)
+        """
+        self._update_tables()
+        state_indices, atom_ids = self._successor_pairs(parent, states)
+        return self._collate_pairs(state_indices, atom_ids, len(states), device)
+
+    def _group(self, state_indices, atom_ids) -> Dict[str, np.ndarray]:
+        # object ids of the atoms grouped by predicate, in the order (state, atom id) within each predicate,
+        # and shifted by the object offset of their state
+        grouped = {}
+        predicates = self._atom_predicate[atom_ids]
+        encoded = predicates >= 0
+        state_indices, atom_ids, predicates = state_indices[encoded], atom_ids[encoded], predicates[encoded]
+        order = np.lexsort((atom_ids, state_indices, predicates))
+        bounds = np.concatenate([ [ 0 ], np.cumsum(np.bincount(predicates, minlength=len(self.predicate_names))) ])
+        for predicate, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if start == end: continue
+            rows = order[start:end]
+            arity = self.predicate_arities[predicate]
+            objects = self._atom_objects[atom_ids[rows], :arity] + (state_indices[rows] * self.num_objects).reshape(-1, 1)
+            grouped[self.predicate_names[predicate]] = objects.reshape(-1)
+        return grouped
+
+    def _collate_pairs(self, state_indices, atom_ids, num_states: int, device, derived_atoms: List[Dict[str, set]] = None):
+        offsets = np.arange(num_states, dtype=np.int64) * self.num_objects
+        parts: Dict[str, List[np.ndarray]] = dict()
+
+        # static and goal atoms are the same for every state
+        for predicate_name, objects in self.template.items():
+            parts[predicate_name] = [ (objects.reshape(1, -1) + offsets.reshape(-1, 1)).reshape(-1) ]
+
+        for predicate_name, objects in self._group(state_indices, atom_ids).items():
+            parts.setdefault(predicate_name, []).append(objects)
+
+        if derived_atoms is not None:
+            for offset, augmentation in zip(offsets, derived_atoms):
+                for predicate_name, denotation in augmentation.items():
+                    if len(denotation) == 0: continue
+                    objects = np.array([ self.obj_encoding[obj] for point in denotation for obj in point ], dtype=np.int64)
+                    parts.setdefault(predicate_name, []).append(objects + offset)
+
+        input = {}
+        for predicate_name, arrays in parts.items():
+            objects = arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+            input[predicate_name] = torch.from_numpy(objects).to(device=device, non_blocking=True)
+        return (input, [ self.num_objects ] * num_states)
+
+    def encode(self, state: State, derived_atoms: Dict[str, set] = None) -> Dict[str, torch.Tensor]:
+        """Encoding of a single state as a map from predicate names to object ids."""
+        return self.collate([ state ], None, None if derived_atoms is None else [ derived_atoms ])[0]
+
+
+class EncodedStates:
+    """Sequence of state encodings that are only computed on access, as traces keep a single one per step."""
+
+    def __init__(self, encoder: StateEncoder, states: List[State], derived_atoms: List[Dict[str, set]] = None):
+        self.encoder = encoder
+        self.states = states
+        self.derived_atoms = derived_atoms
+
+    def __len__(self):
+        return len(self.states)
+
+    def __getitem__(self, index):
+        return self.encoder.encode(self.states[index], None if self.derived_atoms is None else self.derived_atoms[index])
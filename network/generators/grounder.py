@@ -0,0 +1,225 @@
+from collections import deque
+from typing import Dict, List, Tuple
+
+from tarski.fstrips.action import PlainOperator
+from tarski.fstrips.fstrips import AddEffect, DelEffect
+from tarski.grounding.errors import ReachabilityLPUnsolvable
+from tarski.syntax import BuiltinPredicateSymbol, Constant, Variable
+from tarski.syntax.formulas import Atom, CompoundFormula, Tautology
+from tarski.syntax.sorts import ancestors
+
+from .successor import _precondition_literals
+
+
+class _Schema:
+    """Action schema compiled for the fixpoint: atoms over parameter indices ('v', i) and constants ('c', name)."""
+
+    def __init__(self, action, sort_objects: Dict[str, List[str]]):
+        self.action = action
+        self.parameters = [ variable.symbol for variable in action.parameters ]
+        self.domains = [ set(sort_objects[variable.sort.name]) for variable in action.parameters ]
+        literals = _precondition_literals(action.precondition)
+        if literals is None: raise NotImplementedError(f'precondition of {action.name} is not a conjunction of literals')
+
+        # builtin (in)equalities become constraints; negative preconditions are only kept for exact
+        # applicability, since the delete relaxation drops them
+        self.body: List[Tuple[str, tuple]] = []
+        self.negatives: List[Tuple[str, tuple]] = []
+        self.equalities: List[Tuple[bool, tuple, tuple]] = []
+        for atom, value in literals:
+            args = tuple([ self._term(term) for term in atom.subterms ])
+            if atom.predicate.builtin:
+                if atom.predicate.name not in (BuiltinPredicateSymbol.EQ, BuiltinPredicateSymbol.NE): raise NotImplementedError(f'predicate {atom.predicate} in {action.name}')
+                self.equalities.append(((atom.predicate.name == BuiltinPredicateSymbol.EQ) == value, args[0], args[1]))
+            elif value:
+                self.body.append((atom.predicate.name, args))
+            else:
+                self.negatives.append((atom.predicate.name, args))
+
+        self.adds: List[Tuple[str, tuple]] = []
+        self.deletes: List[Tuple[str, tuple]] = []
+        for effect in action.effects:
+            if not isinstance(effect, (AddEffect, DelEffect)) or not isinstance(effect.condition, Tautology): raise NotImplementedError(f'effect {effect} of {action.name}')
+            atom = (effect.atom.predicate.name, tuple([ self._term(term) for term in effect.atom.subterms ]))
+            if isinstance(effect, AddEffect): self.adds.append(atom)
+            else: self.deletes.append(atom)
+
+    def _term(self, term):
+        if isinstance(term, Constant): return ('c', term.name)
+        return ('v', self.parameters.index(term.symbol))
+
+    def prune_static(self, static: Dict[str, set]) -> bool:
+        """Restricts the parameter domains by the unary static atoms and checks the ground ones; False if the schema is never applicable."""
+        body = []
+        for predicate_name, args in self.body:
+            if predicate_name not in static:
+                body.append((predicate_name, args))
+            elif all([ kind == 'c' for kind, _ in args ]):
+                if tuple([ name for _, name in args ]) not in static[predicate_name]: return False
+            elif len(args) == 1:
+                self.domains[args[0][1]] &= set([ objects[0] for objects in static[predicate_name] ])
+            else:
+                body.append((predicate_name, args))
+        self.body = body
+        return all([ len(domain) > 0 for domain in self.domains ])
+
+    def join_orders(self) -> List[List[int]]:
+        # for every body atom that can trigger the schema, the order in which the others are joined:
+        # greedily the atom that shares most variables with the ones bound so far
+        orders = []
+        for trigger in range(len(self.body)):
+            bound = set([ index for kind, index in self.body[trigger][1] if kind == 'v' ])
+            remaining, order = [ position for position in range(len(self.body)) if position != trigger ], []
+            while remaining:
+                position = max(remaining, key=lambda position: (len([ 1 for kind, index in self.body[position][1] if kind == 'v' and index in bound ]), -position))
+                order.append(position)
+                remaining.remove(position)
+                bound |= set([ index for kind, index in self.body[position][1] if kind == 'v' ])
+            orders.append(order)
+        return orders
+
+
+class RelaxedGrounder:
+    """
+    Grounds the action schemas of a STRIPS problem to the operators that are reachable under the
+    delete relaxation, the same set of operators as tarski's LP grounder computes with gringo.
+    Reachability is a semi-naive fixpoint: every new atom is joined, as the last one, with the
+    atoms found before it through per-predicate argument indexes, so each grounding is derived
+    once. Static atoms are only used to restrict parameter domains and to drop schemas up front.
+    """
+
+    def __init__(self, problem):
+        self.problem = problem
+        language = problem.language
+        sort_objects = dict([ (sort.name, []) for sort in language.sorts ])
+        for constant in language.constants():
+            for sort in [ constant.sort ] + list(ancestors(constant.sort)):
+                sort_objects[sort.name].append(constant.name)
+        self.schemas = [ _Schema(action, sort_objects) for action in problem.actions.values() ]
+
+        literals = _precondition_literals(problem.goal)
+        if literals is None: raise NotImplementedError('goal is not a conjunction of literals')
+        self.goal = [ (atom.predicate.name, tuple([ term.name for term in atom.subterms ])) for atom, value in literals if value and not atom.predicate.builtin ]
+
+        # atoms of predicates that no schema adds keep their initial value
+        self.initial = [ (signature[0], tuple([ wref.expr.name for wref in point ])) for signature, extension in problem.init.predicate_extensions.items() for point in extension ]
+        added = set([ predicate_name for schema in self.schemas for predicate_name, _ in schema.adds ])
+        self.static: Dict[str, set] = dict()
+        for predicate_name, objects in self.initial:
+            if predicate_name not in added: self.static.setdefault(predicate_name, set()).add(objects)
+        for predicate in language.predicates:
+            if not predicate.builtin and predicate.name not in added: self.static.setdefault(predicate.name, set())
+
+    def ground(self) -> Dict[str, List[Tuple[str, ...]]]:
+        """Map from schema names to the reachable groundings, as tuples of object names."""
+        schemas = [ schema for schema in self.schemas if schema.prune_static(self.static) ]
+        triggers: Dict[str, List[Tuple[_Schema, int, List[int]]]] = dict()
+        for schema in schemas:
+            for position, order in enumerate(schema.join_orders()):
+                triggers.setdefault(schema.body[position][0], []).append((schema, position, order))
+
+        facts = set(self.initial)
+        queue = deque(self.initial)
+        processed: Dict[str, list] = dict()
+        index: Dict[Tuple[str, int, str], list] = dict()
+        groundings = dict([ (schema.action.name, dict()) for schema in self.schemas ])
+
+        def fire(schema: _Schema, binding: list):
+            for grounding in _complete(schema, binding):
+                if grounding in groundings[schema.action.name]: continue
+                groundings[schema.action.name][grounding] = None
+                for predicate_name, args in schema.adds:
+                    atom = (predicate_name, _ground_atom(args, grounding))
+                    if atom not in facts:
+                        facts.add(atom)
+                        queue.append(atom)
+
+        # schemas without dynamic preconditions are reachable from the start
+        for schema in schemas:
+            if len(schema.body) == 0: fire(schema, [ None ] * len(schema.parameters))
+
+        while queue:
+            predicate_name, objects = queue.popleft()
+            processed.setdefault(predicate_name, []).append(objects)
+            for position, obj in enumerate(objects): index.setdefault((predicate_name, position, obj), []).append(objects)
+            for schema, position, order in triggers.get(predicate_name, []):
+                binding = _unify(schema, schema.body[position][1], objects, [ None ] * len(schema.parameters))
+                if binding is not None: _join(schema, order, 0, binding, processed, index, fire)
+
+        for predicate_name, objects in self.goal:
+            if (predicate_name, objects) not in facts: raise ReachabilityLPUnsolvable()
+        return dict([ (name, list(schema_groundings.keys())) for name, schema_groundings in groundings.items() ])
+
+
+def _unify(schema: _Schema, args: tuple, objects: tuple, binding: list):
+    # extension of binding under which the atom args of schema matches objects, or None
+    binding = list(binding)
+    for (kind, name), obj in zip(args, objects):
+        if kind == 'c':
+            if name != obj: return None
+        elif binding[name] is None:
+            if obj not in schema.domains[name]: return None
+            binding[name] = obj
+        elif binding[name] != obj:
+            return None
+    return binding
+
+def _join(schema: _Schema, order: List[int], depth: int, binding: list, atoms: Dict[str, list], index: Dict[Tuple[str, int, str], list], fire):
+    # calls fire for every extension of binding that matches the body atoms of schema in order against atoms
+    if depth == len(order):
+        fire(schema, binding)
+        return
+    predicate_name, args = schema.body[order[depth]]
+    # candidates from the index of the most selective bound argument
+    candidates = atoms.get(predicate_name, [])
+    for position, (kind, name) in enumerate(args):
+        value = name if kind == 'c' else binding[name]
+        if value is not None:
+            indexed = index.get((predicate_name, position, value), [])
+            if len(indexed) < len(candidates): candidates = indexed
+    for objects in candidates:
+        extended = _unify(schema, args, objects, binding)
+        if extended is not None: _join(schema, order, depth + 1, extended, atoms, index, fire)
+
+def _complete(schema: _Schema, binding: list):
+    # parameters that occur in no body atom range over their domains; equalities are checked last
+    groundings = [ [] ]
+    for parameter, obj in enumerate(binding):
+        values = [ obj ] if obj is not None else sorted(schema.domains[parameter])
+        groundings = [ grounding + [ value ] for grounding in groundings for value in values ]
+    for grounding in groundings:
+        if all([ (_value(lhs, grounding) == _value(rhs, grounding)) == equal for equal, lhs, rhs in schema.equalities ]):
+            yield tuple(grounding)
+
+def _value(arg, grounding):
+    kind, name = arg
+    return name if kind == 'c' else grounding[name]
+
+def _ground_atom(args: tuple, grounding: tuple) -> tuple:
+    return tuple([ name if kind == 'c' else grounding[name] for kind, name in args ])
+
+def _instantiate(formula, substitution: Dict[str, Constant]):
+    # copy of a quantifier-free schema formula with parameters replaced by constants; tarski's
+    # substitute_expression deep-copies the whole formula for every grounding, which dominates grounding time
+    if isinstance(formula, Atom):
+        return formula.predicate(*[ substitution[term.symbol] if isinstance(term, Variable) else term for term in formula.subterms ])
+    if isinstance(formula, CompoundFormula):
+        return CompoundFormula(formula.connective, [ _instantiate(subformula, substitution) for subformula in formula.subformulas ])
+    if isinstance(formula, Tautology):
+        return formula
+    raise NotImplementedError(f'formula {formula}')
+
+def ground_problem_schemas_with_relaxed_reachability(problem) -> list:
+    """Drop-in replacement for tarski's ground_problem_schemas_into_plain_operators that doesn't need gringo."""
+    groundings = RelaxedGrounder(problem).ground()
+    language = problem.language
+    constants = dict([ (constant.name, constant) for constant in language.constants() ])
+    operators = []
+    for action_name, action_groundings in groundings.items():
+        action = problem.get_action(action_name)
+        parameters = [ variable.symbol for variable in action.parameters ]
+        for grounding in action_groundings:
+            substitution = dict(zip(parameters, [ constants[name] for name in grounding ]))
+            effects = [ type(effect)(_instantiate(effect.atom, substitution)) for effect in action.effects ]
+            operators.append(PlainOperator(language, f"{action.name}({', '.join(grounding)})", _instantiate(action.precondition, substitution), effects))
+    return operators
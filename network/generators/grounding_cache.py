@@ -0,0 +1,134 @@
+import hashlib
+import os
+import pickle
+import zlib
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from tarski.evaluators.simple import evaluate
+from tarski.fstrips import language as make_language
+from tarski.fstrips.action import PlainOperator
+from tarski.fstrips.fstrips import AddEffect, DelEffect
+from tarski.model import create as make_tarski_state
+from tarski.syntax import land, neg, top
+from tarski.syntax.formulas import Tautology
+
+from .successor import _precondition_literals, atom_key, state_keys
+
+
+class GroundingCache:
+    """
+    Persistent cache of grounded problems, stored as one file per problem in a directory. Files
+    are named by a hash of the contents of the domain and problem files, so edited PDDL files
+    are grounded again, and hold the language, the initial state, the goal, the ground operators
+    and the static/dynamic split of the predicates as compressed tuples of names and atom ids.
+    The object encoding follows from the order of the constants, which is kept.
+
+    A hit rebuilds the tarski objects directly, without parsing PDDL or running the grounder.
+    Only problems whose goal and preconditions are conjunctions of literals, and whose effects
+    are unconditional, are stored.
+    """
+
+    VERSION = 1
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, domain: Path, problem: Path) -> Path:
+        digest = hashlib.sha256()
+        for filename in [ domain, problem ]:
+            digest.update(Path(filename).read_bytes())
+            digest.update(b'\0')
+        return self.directory / f'{digest.hexdigest()}.bin'
+
+    def load(self, domain: Path, problem: Path) -> Dict:
+        """Grounded problem as given to store(), or None if it isn't cached."""
+        path = self._path(domain, problem)
+        try:
+            record = pickle.loads(zlib.decompress(path.read_bytes()))
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError):
+            record = None
+        if record is None or record[0] != GroundingCache.VERSION:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return _decode(record)
+
+    def store(self, domain: Path, problem: Path, grounded: Dict) -> bool:
+        """Stores a grounded problem, returns False if it can't be represented."""
+        record = _encode(grounded)
+        if record is None: return False
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(domain, problem)
+
+        # write and rename, so that concurrent runs never read a partial file
+        temporary = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        temporary.write_bytes(zlib.compress(pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)))
+        os.replace(temporary, path)
+        return True
+
+
+def _encode(grounded: Dict):
+    language, initial = grounded['language'], grounded['initial']
+    if len(initial.function_extensions) > 0: return None
+    keys: List[Tuple[str, Tuple[str, ...]]] = []
+    key_ids: Dict[Tuple[str, Tuple[str, ...]], int] = dict()
+
+    def intern(key) -> int:
+        if key not in key_ids:
+            key_ids[key] = len(keys)
+            keys.append(key)
+        return key_ids[key]
+
+    def encode_literals(formula):
+        literals = _precondition_literals(formula)
+        return None if literals is None else [ (intern(atom_key(atom)), value) for atom, value in literals ]
+
+    goal = encode_literals(grounded['goal'])
+    if goal is None: return None
+    actions = []
+    for action in grounded['actions']:
+        precondition = encode_literals(action.precondition)
+        if precondition is None: return None
+        effects = []
+        for effect in action.effects:
+            if not isinstance(effect, (AddEffect, DelEffect)) or not isinstance(effect.condition, Tautology): return None
+            effects.append((isinstance(effect, AddEffect), intern(atom_key(effect.atom))))
+        actions.append((action.name, precondition, effects))
+    initial_atoms = [ intern(key) for key in state_keys(initial) ]
+
+    sorts = [ (sort.name, language.immediate_parent[sort].name if language.immediate_parent.get(sort) is not None else None) for sort in language.sorts ]
+    predicates = [ (predicate.name, [ sort.name for sort in predicate.sort ]) for predicate in language.predicates if not predicate.builtin ]
+    constants = [ (constant.name, constant.sort.name) for constant in language.constants() ]
+    theories = [ theory.value for theory in language.theories ]
+    return (GroundingCache.VERSION, language.name, theories, sorts, predicates, constants, keys, initial_atoms, goal, actions, sorted(grounded['static_predicates']), sorted(grounded['dynamic_predicates']))
+
+def _decode(record) -> Dict:
+    _, name, theories, sorts, predicates, constants, keys, initial_atoms, goal, actions, static_predicates, dynamic_predicates = record
+    language = make_language(name, theories=theories)
+    for sort_name, parent_name in sorts:
+        if not language.has_sort(sort_name): language.sort(sort_name, language.get_sort(parent_name) if parent_name is not None else None)
+    for predicate_name, sort_names in predicates:
+        language.predicate(predicate_name, *[ language.get_sort(sort_name) for sort_name in sort_names ])
+    for constant_name, sort_name in constants:
+        language.constant(constant_name, language.get_sort(sort_name))
+
+    atoms = [ language.get_predicate(predicate_name)(*[ language.get_constant(obj) for obj in objects ]) for predicate_name, objects in keys ]
+    def conjunction(literals):
+        formulas = [ atoms[atom_id] if value else neg(atoms[atom_id]) for atom_id, value in literals ]
+        return top if len(formulas) == 0 else formulas[0] if len(formulas) == 1 else land(*formulas, flat=True)
+
+    initial = make_tarski_state(language, evaluate)
+    for atom_id in initial_atoms:
+        initial.add(atoms[atom_id].predicate, *atoms[atom_id].subterms)
+    operators = [ PlainOperator(language, action_name, conjunction(precondition), [ AddEffect(atoms[atom_id]) if is_add else DelEffect(atoms[atom_id]) for is_add, atom_id in effects ]) for action_name, precondition, effects in actions ]
+    return {
+        'actions': operators,
+        'initial': initial,
+        'goal': conjunction(goal),
+        'language': language,
+        'static_predicates': set(static_predicates),
+        'dynamic_predicates': set(dynamic_predicates)
+    }
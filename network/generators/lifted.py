@@ -0,0 +1,104 @@
+from typing import Dict, List, Tuple
+
+from tarski.fstrips.action import PlainOperator
+from tarski.model import Model as PDDLState
+from tarski.syntax.sorts import ancestors
+
+from .grounder import _Schema, _complete, _ground_atom, _instantiate, _join, _unify
+from .state import AtomTable, State
+from .successor import state_keys
+
+
+class LiftedSuccessorGenerator:
+    """
+    Successor generator on action schemas that doesn't ground the problem. The applicable
+    instances of a schema are found by joining its positive preconditions against the atoms of
+    the state, indexed by predicate and argument, and by checking the negative preconditions on
+    the bitset. Ground operators are only built for instances that are applicable in an expanded
+    state, so memory follows the visited states instead of the number of ground actions.
+    It offers the same successors() and applicable() as SuccessorGenerator.
+    """
+
+    def __init__(self, schemas: list, table: AtomTable, initial: PDDLState):
+        self.table = table
+        self.language = initial.language
+        sort_objects = dict([ (sort.name, []) for sort in self.language.sorts ])
+        for constant in self.language.constants():
+            for sort in [ constant.sort ] + list(ancestors(constant.sort)):
+                sort_objects[sort.name].append(constant.name)
+        self._constants = dict([ (constant.name, constant) for constant in self.language.constants() ])
+        self.schemas = [ _Schema(schema, sort_objects) for schema in schemas ]
+
+        # atoms of predicates that appear in effects can change, all others keep their initial value
+        self.fluent_predicates = set([ predicate_name for schema in self.schemas for predicate_name, _ in schema.adds + schema.deletes ])
+        static = dict([ (predicate.name, set()) for predicate in self.language.predicates if not predicate.builtin and predicate.name not in self.fluent_predicates ])
+        for predicate_name, objects in state_keys(initial):
+            if predicate_name in static: static[predicate_name].add(objects)
+        self.schemas = [ schema for schema in self.schemas if schema.prune_static(static) ]
+        self._join_orders = [ schema.join_orders() for schema in self.schemas ]
+
+        # ground operators of applicable instances, with their (delete mask, add mask, ids of affected atoms)
+        self._operators: Dict[Tuple[int, tuple], Tuple[PlainOperator, int, int, List[int]]] = dict()
+
+    def _instances(self, state: State) -> List[Tuple[int, tuple]]:
+        # (schema index, grounding) of the instances applicable in state
+        atoms: Dict[str, list] = dict()
+        index: Dict[Tuple[str, int, str], list] = dict()
+        for predicate_name, objects in state.atoms():
+            atoms.setdefault(predicate_name, []).append(objects)
+            for position, obj in enumerate(objects): index.setdefault((predicate_name, position, obj), []).append(objects)
+
+        instances = []
+        for schema_index, schema in enumerate(self.schemas):
+            groundings = dict()
+            def fire(schema: _Schema, binding: list):
+                for grounding in _complete(schema, binding):
+                    if all([ not self._holds(state, predicate_name, _ground_atom(args, grounding)) for predicate_name, args in schema.negatives ]):
+                        groundings[grounding] = None
+            if len(schema.body) == 0:
+                fire(schema, [ None ] * len(schema.parameters))
+            else:
+                # start from the body atom with the fewest candidates in state
+                trigger = min(range(len(schema.body)), key=lambda position: len(atoms.get(schema.body[position][0], [])))
+                for objects in atoms.get(schema.body[trigger][0], []):
+                    binding = _unify(schema, schema.body[trigger][1], objects, [ None ] * len(schema.parameters))
+                    if binding is not None: _join(schema, self._join_orders[schema_index][trigger], 0, binding, atoms, index, fire)
+            instances.extend([ (schema_index, grounding) for grounding in sorted(groundings.keys()) ])
+        return instances
+
+    def _holds(self, state: State, predicate_name: str, objects: tuple) -> bool:
+        atom_id = self.table.ids.get((predicate_name, objects))
+        return atom_id is not None and atom_id in state
+
+    def _operator(self, instance: Tuple[int, tuple]):
+        operator = self._operators.get(instance)
+        if operator is None:
+            schema_index, grounding = instance
+            schema = self.schemas[schema_index]
+            action = schema.action
+            substitution = dict(zip(schema.parameters, [ self._constants[name] for name in grounding ]))
+            effects = [ type(effect)(_instantiate(effect.atom, substitution)) for effect in action.effects ]
+            plain_operator = PlainOperator(self.language, f"{action.name}({', '.join(grounding)})", _instantiate(action.precondition, substitution), effects)
+            delete_ids = [ self.table.intern((predicate_name, _ground_atom(args, grounding))) for predicate_name, args in schema.deletes ]
+            add_ids = [ self.table.intern((predicate_name, _ground_atom(args, grounding))) for predicate_name, args in schema.adds ]
+            operator = (plain_operator, self.table.mask(delete_ids), self.table.mask(add_ids), sorted(set(delete_ids) | set(add_ids)))
+            self._operators[instance] = operator
+        return operator
+
+    def _apply(self, state: State, operator) -> State:
+        _, delete_mask, add_mask, effect_ids = operator
+        bits = (state.bits & ~delete_mask) | add_mask
+        changed, zobrist = bits ^ state.bits, state.zobrist
+        if changed:
+            for atom_id in effect_ids:
+                if (changed >> atom_id) & 1: zobrist ^= self.table.zobrist[atom_id]
+        return State(self.table, bits, zobrist)
+
+    def applicable(self, state: State) -> list:
+        """Ground operators applicable in state, ordered by schema and grounding."""
+        return [ self._operator(instance)[0] for instance in self._instances(state) ]
+
+    def successors(self, state: State) -> list:
+        """Pairs (operator, successor state) for the operators applicable in state."""
+        operators = [ self._operator(instance) for instance in self._instances(state) ]
+        return [ (operator[0], self._apply(state, operator)) for operator in operators ]
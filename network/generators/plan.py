@@ -1,17 +1,28 @@
+import heapq
+import resource
 import sys
 from copy import deepcopy as deepcopy
 from pathlib import Path
 from termcolor import colored
-import pytorch_lightning as pl
+from timeit import default_timer as timer
 from torch.functional import Tensor
 from typing import Dict, List, Tuple
 import torch
+import torch.nn as nn
 
 from tarski.fstrips.fstrips import AddEffect, DelEffect
 from tarski.model import Model as PDDLState
-from tarski.syntax.formulas import Atom
+from tarski.syntax.formulas import Atom, CompoundFormula, Connective, Tautology
 from tarski.model import create as make_tarski_state
 
+from .cache import EvaluationCache
+from .encoding import EncodedStates, StateEncoder
+from .grounder import ground_problem_schemas_with_relaxed_reachability
+from .grounding_cache import GroundingCache
+from .lifted import LiftedSuccessorGenerator
+from .state import AtomTable, State
+from .successor import SuccessorGenerator, atom_key
+
 
 def _collate(batch: List[Dict[str, Tensor]], device):
     """
@@ -34,26 +45,57 @@ def _collate(batch: List[Dict[str, Tensor]], device):
         input[predicate] = torch.cat(input[predicate]).view(-1).to(device=device, non_blocking=True)
     return (input, sizes)
 
-def load_pddl_problem_with_augmented_states(domain: Path, problem: Path, registry_filename: Path = None, registry_key: str = None, logger = None):
-    from tarski.grounding.lp_grounding import ground_problem_schemas_into_plain_operators
-    from tarski.errors import UndefinedPredicate
+def _ground_problem(domain: Path, problem: Path, grounding_cache: GroundingCache = None, logger = None, grounder: str = 'lp', lifted: bool = False):
+    # parsed and grounded problem, taken from the grounding cache if possible; grounder is 'lp' (tarski and gringo) or 'native',
+    # and if lifted, the problem isn't grounded and the actions are the action schemas
+    if lifted: grounding_cache = None
+    grounded = grounding_cache.load(domain, problem) if grounding_cache is not None else None
+    if grounded is not None:
+        if logger: logger.info(f'Grounded problem loaded from {grounding_cache.directory}')
+        return grounded
+
     from tarski.io import PDDLReader
 
     parser = PDDLReader(raise_on_error=True)
     parser.parse_domain(str(domain))
-    problem = parser.parse_instance(str(problem))
-    actions = ground_problem_schemas_into_plain_operators(problem)
-    predicates = [ predicate for predicate in problem.language.predicates if '=' not in str(predicate.name) ]
-    language = problem.language
+    pddl_problem = parser.parse_instance(str(problem))
+    if lifted:
+        actions = list(pddl_problem.actions.values())
+    elif grounder == 'native':
+        actions = ground_problem_schemas_with_relaxed_reachability(pddl_problem)
+    else:
+        from tarski.grounding.lp_grounding import ground_problem_schemas_into_plain_operators
+        actions = ground_problem_schemas_into_plain_operators(pddl_problem)
 
     # calculate sets of static and dynamic predicates
-    all_predicates = set([ predicate.name for predicate in predicates ])
+    all_predicates = set([ predicate.name for predicate in pddl_problem.language.predicates if '=' not in str(predicate.name) ])
     dynamic_predicates = set()
-    for action_name in problem.actions:
-        action = problem.actions[action_name]
+    for action_name in pddl_problem.actions:
+        action = pddl_problem.actions[action_name]
         for effect in action.effects:
             dynamic_predicates.add(str(effect.atom.predicate.name))
     static_predicates = all_predicates - dynamic_predicates
+
+    grounded = {
+        'actions': actions,
+        'initial': pddl_problem.init,
+        'goal': pddl_problem.goal,
+        'language': pddl_problem.language,
+        'static_predicates': static_predicates,
+        'dynamic_predicates': dynamic_predicates
+    }
+    if grounding_cache is not None and not grounding_cache.store(domain, problem, grounded):
+        if logger: logger.warning(f'Problem {problem} is not supported by the grounding cache')
+    return grounded
+
+def load_pddl_problem_with_augmented_states(domain: Path, problem: Path, registry_filename: Path = None, registry_key: str = None, logger = None, grounding_cache: GroundingCache = None, grounder: str = 'lp', lifted: bool = False):
+    from tarski.errors import UndefinedPredicate
+
+    grounded = _ground_problem(domain, problem, grounding_cache, logger, grounder, lifted)
+    actions = grounded['actions']
+    language = grounded['language']
+    predicates = [ predicate for predicate in language.predicates if '=' not in str(predicate.name) ]
+    static_predicates, dynamic_predicates = grounded['static_predicates'], grounded['dynamic_predicates']
     if logger: logger.info(f'Predicates: static={static_predicates}, dynamic={dynamic_predicates}')
 
     # set augmentation function if registry file and proper key found
@@ -105,33 +147,29 @@ def load_pddl_problem_with_augmented_states(domain: Path, problem: Path, registr
                     except UndefinedPredicate:
                         predicate = language.predicate(predicate_name, *args)
                         if logger: logger.info(f"Extending domain language with predicate '{predicate}'")
-                    predicates = [ predicate for predicate in problem.language.predicates if '=' not in str(predicate.name) ]
+                    predicates = [ predicate for predicate in language.predicates if '=' not in str(predicate.name) ]
         else:
             if logger: logger.warning(f'Unable to calculate registry key; bypassing registry ...')
 
     return {
         'actions': actions,
-        'initial': problem.init,
-        'goal': problem.goal,
+        'initial': grounded['initial'],
+        'goal': grounded['goal'],
         'predicates': predicates,
         'language': language,
         'augment_fn': augment_fn
     }
 
-def load_pddl_problem(domain: Path, problem: Path, logger = None):
-    from tarski.grounding.lp_grounding import ground_problem_schemas_into_plain_operators
-    from tarski.io import PDDLReader
-    parser = PDDLReader(raise_on_error=True)
-    parser.parse_domain(str(domain))
-    problem = parser.parse_instance(str(problem))
-    actions = ground_problem_schemas_into_plain_operators(problem)
-    predicates = [ predicate for predicate in problem.language.predicates if '=' not in str(predicate.name) ]
-    language = problem.language
+def load_pddl_problem(domain: Path, problem: Path, logger = None, grounding_cache: GroundingCache = None, grounder: str = 'lp', lifted: bool = False):
+    grounded = _ground_problem(domain, problem, grounding_cache, logger, grounder, lifted)
+    actions = grounded['actions']
+    language = grounded['language']
+    predicates = [ predicate for predicate in language.predicates if '=' not in str(predicate.name) ]
 
     return {
         'actions': actions,
-        'initial': problem.init,
-        'goal': problem.goal,
+        'initial': grounded['initial'],
+        'goal': grounded['goal'],
         'predicates': predicates,
         'language': language,
         'augment_fn' : None
@@ -154,19 +192,33 @@ def _get_goal_denotation(goals, obj_encoding: Dict[str, int]) -> Dict[str, List[
         denotation[predicate_name].extend(object_ids)
     return denotation
 
-def _encode_atoms(state: PDDLState, object_ids: Dict[str, int], logger = None) -> dict:
+def _get_goal_mask(goals, table: AtomTable):
+    # bitset of the goal atoms, or None if the goal is not a conjunction of atoms
+    if isinstance(goals, Tautology): return 0
+    atoms = [ goals ] if isinstance(goals, Atom) else goals.subformulas if isinstance(goals, CompoundFormula) and goals.connective == Connective.And else []
+    if len(atoms) == 0 or not all([ isinstance(atom, Atom) for atom in atoms ]): return None
+    return table.mask([ table.intern(atom_key(atom)) for atom in atoms ])
+
+def _is_goal(state: State, goals, goal_mask) -> bool:
+    if goal_mask is None: return bool(state.to_tarski()[goals])
+    return (state.bits & goal_mask) == goal_mask
+
+def _encode_atoms(state: State, object_ids: Dict[str, int], logger = None) -> dict:
     encoded_atoms = {}
-    for atom in state.as_atoms():
-        if hasattr(atom, 'predicate'):
-            predicate_name = atom.predicate.name
-            encoded_objects = [ object_ids[obj.name] for obj in atom.subterms ]
-            if predicate_name not in encoded_atoms: encoded_atoms[predicate_name] = []
-            encoded_atoms[predicate_name].extend(encoded_objects)
+    for predicate_name, objects in state.atoms():
+        encoded_objects = [ object_ids[obj] for obj in objects ]
+        if predicate_name not in encoded_atoms: encoded_atoms[predicate_name] = []
+        encoded_atoms[predicate_name].extend(encoded_objects)
     #if logger: logger.debug(f'encoded_atoms={encoded_atoms}')
     return encoded_atoms
 
-def _encode_state(state: PDDLState, goal_denotation, object_ids: Dict[str, int], logger = None) -> dict:
+def _encode_state(state: State, derived_atoms, goal_denotation, object_ids: Dict[str, int], logger = None) -> dict:
     encoded_state = _encode_atoms(state, object_ids, logger)
+    for predicate_name in derived_atoms:
+        if len(derived_atoms[predicate_name]) == 0: continue
+        if predicate_name not in encoded_state: encoded_state[predicate_name] = []
+        for objects in derived_atoms[predicate_name]:
+            encoded_state[predicate_name].extend([ object_ids[obj] for obj in objects ])
     for predicate_name in goal_denotation:
         encoded_state[predicate_name] = goal_denotation[predicate_name]
     #if logger: logger.debug(f'encoded_state={encoded_state}')
@@ -177,15 +229,63 @@ def _to_tensors(encoded_states: List[Dict[str, List[int]]]):
         for pred_id, obj_ids in encoded_state.items():
             encoded_state[pred_id] = torch.tensor(obj_ids)
 
-def _to_input(states: List[PDDLState], goal_denotation, obj_encoding, augment_fn, language, device, logger = None):
-    encoded_states = [ _encode_state(_apply_derived_predicates(state, goal_denotation, obj_encoding, augment_fn, language), goal_denotation, obj_encoding, logger) for state in states ]
+def _to_input(states: List[State], goal_denotation, obj_encoding, augment_fn, language, device, logger = None, encoder: StateEncoder = None, parent: State = None):
+    # successors of a common parent are encoded from the atoms of the parent and their effects;
+    # derived atoms are computed on plain states, so with augmentation every state is encoded on its own
+    if encoder is not None and augment_fn is None:
+        collated_input = encoder.collate(states, device) if parent is None else encoder.collate_successors(parent, states, device)
+        return collated_input, EncodedStates(encoder, states)
+    elif encoder is not None:
+        derived_atoms = [ _apply_derived_predicates(state, goal_denotation, obj_encoding, augment_fn, language) for state in states ]
+        return encoder.collate(states, device, derived_atoms), EncodedStates(encoder, states, derived_atoms)
+    encoded_states = [ _encode_state(state, _apply_derived_predicates(state, goal_denotation, obj_encoding, augment_fn, language), goal_denotation, obj_encoding, logger) for state in states ]
     _to_tensors(encoded_states)
     return _collate(encoded_states, device), encoded_states
 
-def _get_applicable_actions(state, actions):
+def _evaluate_steps(states: List[State], cache: EvaluationCache, goal_denotation, obj_encoding, augment_fn, language, device, logger = None, encoder: StateEncoder = None, parent: State = None):
+    # yields the model input for the states (only those that are not cached) and receives the model outputs;
+    # returns the outputs (values, solvables) for all states
+    to_input = lambda batch: _to_input(batch, goal_denotation, obj_encoding, augment_fn, language, device, logger, encoder, parent)[0]
+    if cache is None: return (yield to_input(states))
+    steps = cache.evaluate_steps(states, device)
+    try:
+        steps.send((yield to_input(next(steps))))
+    except StopIteration as stop:
+        return stop.value
+
+def _run_with_model(steps, model):
+    # runs a generator that yields model inputs and receives model outputs, and returns its result
+    try:
+        input = next(steps)
+        while True: input = steps.send(model(input))
+    except StopIteration as stop:
+        return stop.value
+
+def _merge_inputs(inputs: list):
+    # merges collated inputs (of different problems) into one input by shifting their object ids
+    merged, sizes, offset = dict(), [], 0
+    for relations, input_sizes in inputs:
+        for predicate, values in relations.items():
+            if predicate not in merged: merged[predicate] = []
+            merged[predicate].append(values + offset)
+        sizes.extend(input_sizes)
+        offset += sum(input_sizes)
+    return (dict([ (predicate, torch.cat(values)) for predicate, values in merged.items() ]), sizes)
+
+def _evaluate(model, states: List[State], cache: EvaluationCache, goal_denotation, obj_encoding, augment_fn, language, device, logger = None, encoder: StateEncoder = None, parent: State = None):
+    # outputs (values, solvables) of the model; with a cache, only the states that are not cached are evaluated
+    return _run_with_model(_evaluate_steps(states, cache, goal_denotation, obj_encoding, augment_fn, language, device, logger, encoder, parent), model)
+
+def _encode_trace_state(state: State, goal_denotation, obj_encoding, augment_fn, language, encoder: StateEncoder):
+    derived_atoms = _apply_derived_predicates(state, goal_denotation, obj_encoding, augment_fn, language) if augment_fn is not None else None
+    return encoder.encode(state, derived_atoms)
+
+def _get_applicable_actions(state: PDDLState, actions):
+    # reference implementation on tarski states, superseded by SuccessorGenerator
     return [ operator for operator in actions if state[operator.precondition] ]
 
-def _apply_action(state, action):
+def _apply_action(state: PDDLState, action):
+    # reference implementation on tarski states, superseded by SuccessorGenerator
     state = deepcopy(state)
     delete_atoms = [ effect.atom for effect in action.effects if isinstance(effect, DelEffect) ]
     add_atoms = [ effect.atom for effect in action.effects if isinstance(effect, AddEffect) ]
@@ -193,32 +293,30 @@ def _apply_action(state, action):
     for add_atom in add_atoms: state.add(add_atom.predicate, *add_atom.subterms)
     return state
 
-def _get_successor_states(state, actions):
-    applicable_actions = _get_applicable_actions(state, actions)
-    return [ (action, _apply_action(state, action)) for action in applicable_actions ]
+def _create_successor_generator(actions, table: AtomTable, initial: PDDLState, lifted: bool = False):
+    # with lifted, actions are action schemas whose applicable instances are computed per state
+    return LiftedSuccessorGenerator(actions, table, initial) if lifted else SuccessorGenerator(actions, table, initial)
+
+def _get_successor_states(state: State, successor_generator: SuccessorGenerator):
+    return successor_generator.successors(state)
+
+def _get_static_state(state: State, successor_generator: SuccessorGenerator) -> State:
+    # atoms of state that no operator can add or delete
+    return state.table.state([ key for key in state.atoms() if key[0] not in successor_generator.fluent_predicates ])
 
-def _map_tarski_state_into_plain_state(tarski_state: PDDLState):
+def _map_state_into_plain_state(state: State, language):
     plain_state = dict(_internal=dict())
-    for key in tarski_state.predicate_extensions:
-        #plain_state[key[0]] = tarski_state.predicate_extensions[key]
-        plain_state[key[0]] = set([ tuple([ str(wref.expr) for wref in d ]) for d in tarski_state.predicate_extensions[key] ])
-        plain_state['_internal'][key[0]] = key
+    for predicate_name, objects in state.extensions().items():
+        plain_state[predicate_name] = set(objects)
+        plain_state['_internal'][predicate_name] = language.get_predicate(predicate_name).signature
     return plain_state
 
-def _augment_tarski_state(tarski_state: PDDLState, augmentation, language):
-    for key in augmentation:
-        predicate = language.get_predicate(key)
-        for d in augmentation[key]:
-            #denotation = tuple([ wref.expr for wref in d ])
-            #tarski_state.add(predicate, *denotation)
-            tarski_state.add(predicate, *d)
-    return tarski_state
-
-def _apply_derived_predicates(tarski_state: PDDLState, goal_denotation, obj_encoding, augment_fn, language):
+def _apply_derived_predicates(state: State, goal_denotation, obj_encoding, augment_fn, language):
+    # returns the denotations of the derived predicates in state (empty if there is no augmentation)
     assert augment_fn is None or language is not None, f'language={language}, augment_fn={augment_fn}'
     if augment_fn is not None:
-        # get plain state from PDDL (tarski) state
-        plain_state = _map_tarski_state_into_plain_state(tarski_state)
+        # get plain state from compact state
+        plain_state = _map_state_into_plain_state(state, language)
 
         # augment plain state with goal predicates of type <pred>@
         added_goal_denotations = []
@@ -241,41 +339,41 @@ def _apply_derived_predicates(tarski_state: PDDLState, goal_denotation, obj_enco
         # calculate augmentation
         keys = [ key for key in augmented_state if key not in plain_state ]
         augmentation = dict([ (key, augmented_state[key]) for key in keys ])
-        return _augment_tarski_state(deepcopy(tarski_state), augmentation, language)
+        return augmentation
     else:
-        return tarski_state
+        return dict()
 
-def _spanner_solved(state, logger=None):
+def _spanner_solved(state: State, logger=None):
     # assuming that unsolvable check was previously done, task is solvable if bob is at gate
 
     # extract information from state
-    extensions = state.list_all_extensions()
-    at = dict([ (obj1.name, obj2.name) for (obj1, obj2) in extensions[('at', 'object', 'object')] ])
+    extensions = state.extensions()
+    at = dict([ (obj1, obj2) for (obj1, obj2) in extensions.get('at', []) ])
 
     # get bob location
-    assert len(extensions[('man', 'object')]) == 1
-    bob = extensions[('man', 'object')][0][0].name
+    assert len(extensions['man']) == 1
+    bob = extensions['man'][0][0]
     bob_loc = at[bob]
     return bob_loc == 'gate'
 
-def _spanner_unsolvable(state, logger=None):
+def _spanner_unsolvable(state: State, logger=None):
     # if bob is at gate, check he has enough useable spanners
 
     # extract information from state
-    extensions = state.list_all_extensions()
-    at = dict([ (obj1.name, obj2.name) for (obj1, obj2) in extensions[('at', 'object', 'object')] ])
+    extensions = state.extensions()
+    at = dict([ (obj1, obj2) for (obj1, obj2) in extensions.get('at', []) ])
 
     # get bob location
-    assert len(extensions[('man', 'object')]) == 1
-    bob = extensions[('man', 'object')][0][0].name
+    assert len(extensions['man']) == 1
+    bob = extensions['man'][0][0]
     bob_loc = at[bob]
     if bob_loc != 'gate': return False
 
     # get spanner and nut subsets
-    carrying = set([ obj2.name for (obj1, obj2) in extensions[('carrying', 'object', 'object')] if obj1.name == bob ])
-    useable = set([ obj.name for (obj,) in extensions[('useable', 'object')] ])
-    spanner = set([ obj.name for (obj,) in extensions[('spanner', 'object')] ])
-    loose_nuts = set([ obj.name for (obj,) in extensions[('loose', 'object')] ])
+    carrying = set([ obj2 for (obj1, obj2) in extensions.get('carrying', []) if obj1 == bob ])
+    useable = set([ obj for (obj,) in extensions.get('useable', []) ])
+    spanner = set([ obj for (obj,) in extensions.get('spanner', []) ])
+    loose_nuts = set([ obj for (obj,) in extensions.get('loose', []) ])
     carrying_and_useable_spanners = carrying & useable & spanner
 
     # at this point, task is solvable iff bob is carrying enough useable spanners
@@ -285,29 +383,32 @@ def _spanner_unsolvable(state, logger=None):
         logger.info(f'carrying_and_useable_spanners={carrying_and_useable_spanners}')
     return len(carrying_and_useable_spanners) < len(loose_nuts)
 
-def policy_search(actions, initial, goals, obj_encoding: Dict[str, int], model: pl.LightningModule, cycles: str = 'avoid', max_state_trace_length: int = 500, unsolvable_weight: float = 100000.0, logger = None):
+def policy_search(actions, initial, goals, obj_encoding: Dict[str, int], model: nn.Module, cycles: str = 'avoid', max_state_trace_length: int = 500, unsolvable_weight: float = 100000.0, logger = None, cache: EvaluationCache = None):
     language = None
     augment_fn = None
 
     device = model.device
     closed_states = set()
     action_trace = []
+    table = AtomTable(initial.language)
+    successor_generator = SuccessorGenerator(actions, table, initial)
+    goal_mask = _get_goal_mask(goals, table)
 
     # calculate denotation of goal atoms that is equal for every state
     if logger: logger.info(f'goals={goals}')
     goal_denotation = _get_goal_denotation(goals, obj_encoding)
 
     # set initial state and value trace
-    current_state = initial
-    collated_input, encoded_states = _to_input([ current_state ], goal_denotation, obj_encoding, augment_fn, language, device, logger)
-    state_trace = [ encoded_states[0] ]
-    initial_values, initial_solvables = model(collated_input)
+    current_state = table.from_tarski(initial)
+    encoder = StateEncoder(table, obj_encoding, goal_denotation, _get_static_state(current_state, successor_generator))
+    state_trace = [ _encode_trace_state(current_state, goal_denotation, obj_encoding, augment_fn, language, encoder) ]
+    initial_values, initial_solvables = _evaluate(model, [ current_state ], cache, goal_denotation, obj_encoding, augment_fn, language, device, logger, encoder)
     value_trace = [ initial_values[0] + (1.0 - torch.round(torch.sigmoid(initial_solvables))[0]) * unsolvable_weight ]  # A large value indicates an unsolvable state
     if logger: logger.debug(f'initial_state={current_state}')
 
     # calculate greedy trace
     step, num_evaluations = 1, 1
-    while (not current_state[goals]) and (len(state_trace) < max_state_trace_length):
+    while (not _is_goal(current_state, goals, goal_mask)) and (len(state_trace) < max_state_trace_length):
         if cycles == 'detect' and current_state in closed_states:
             if logger:
                 logger.info(colored(f"Cycle detected after last action '{action_trace[-1]}'", 'magenta'))
@@ -317,13 +418,13 @@ def policy_search(actions, initial, goals, obj_encoding: Dict[str, int], model:
         step += 1
 
         # explore current state (avoid loops by removing already visited successors)
-        successor_candidates = [ transition for transition in _get_successor_states(current_state, actions) ]
+        successor_candidates = [ transition for transition in _get_successor_states(current_state, successor_generator) ]
         if cycles == 'avoid':
             successor_candidates = [ transition for transition in successor_candidates if transition[1] not in closed_states ]
 
         if len(successor_candidates) == 0:
             logger.info(f'No applicable action that yields unvisited state for current_state={current_state}')
-            logger.info(f'Applicable actions = {_get_applicable_actions(current_state, actions)}')
+            logger.info(f'Applicable actions = {successor_generator.applicable(current_state)}')
             break
 
         successor_actions = [ candidate[0] for candidate in successor_candidates ]
@@ -331,8 +432,7 @@ def policy_search(actions, initial, goals, obj_encoding: Dict[str, int], model:
         if logger: logger.debug(f'#actions={len(successor_actions)}, actions={successor_actions}')
 
         # calculate values for successors and best successor
-        collated_input, encoded_states = _to_input(successor_states, goal_denotation, obj_encoding, augment_fn, language, device, logger)
-        output_values, output_solvables = model(collated_input)
+        output_values, output_solvables = _evaluate(model, successor_states, cache, goal_denotation, obj_encoding, augment_fn, language, device, logger, encoder, current_state)
         output_values += (1.0 - torch.round(torch.sigmoid(output_solvables))) * unsolvable_weight
         best_successor_index = torch.argmin(output_values)
         num_evaluations += len(successor_actions)
@@ -343,18 +443,19 @@ def policy_search(actions, initial, goals, obj_encoding: Dict[str, int], model:
 
         # extend traces and set next current state
         action_trace.append(successor_actions[best_successor_index])
-        state_trace.append(encoded_states[best_successor_index])
+        state_trace.append(_encode_trace_state(successor_states[best_successor_index], goal_denotation, obj_encoding, augment_fn, language, encoder))
         value_trace.append(output_values[best_successor_index])
         current_state = successor_states[best_successor_index]
         if logger:
             logger.debug(f'current_state={current_state}')
             logger.debug('')
 
-    reached_goal = current_state[goals]
+    reached_goal = _is_goal(current_state, goals, goal_mask)
     if logger: logger.debug(f'status={1 if reached_goal else 0}')
+    if logger and cache is not None: logger.info(f'Evaluation cache: {cache}')
     return action_trace, state_trace, value_trace, reached_goal, num_evaluations
 
-def compute_traces(actions, initial, goal, language, model: pl.LightningModule, cycles: str = 'avoid', max_trace_length: int = 500, unsolvable_weight: float = 100000.0, logger = None):
+def compute_traces(actions, initial, goal, language, model: nn.Module, cycles: str = 'avoid', max_trace_length: int = 500, unsolvable_weight: float = 100000.0, logger = None):
     objects = language.constants()
     obj_encoding = create_object_encoding(objects)
     if logger: logger.info(f'{len(objects)} object(s), obj_encoding={obj_encoding}')
@@ -362,26 +463,29 @@ def compute_traces(actions, initial, goal, language, model: pl.LightningModule,
     with torch.no_grad():
         return policy_search(actions, initial, goal, obj_encoding, model, cycles=cycles, max_trace_length=max_trace_length, unsolvable_weight=unsolvable_weight, logger=logger)
 
-def policy_search_with_augmented_states(actions, initial, goals, obj_encoding: Dict[str, int], language, model: pl.LightningModule, augment_fn = None, cycles: str = 'avoid', max_state_trace_length: int = 500, unsolvable_weight: float = 100000.0, logger = None, is_spanner = False):
-    device = model.device
+def _policy_search_steps(actions, initial, goals, obj_encoding: Dict[str, int], language, device, augment_fn = None, cycles: str = 'avoid', max_state_trace_length: int = 500, unsolvable_weight: float = 100000.0, logger = None, is_spanner = False, cache: EvaluationCache = None, lifted: bool = False):
+    # greedy search as a generator that yields model inputs and receives model outputs, see _run_with_model()
     closed_states = set()
     action_trace = []
+    table = AtomTable(initial.language)
+    successor_generator = _create_successor_generator(actions, table, initial, lifted)
+    goal_mask = _get_goal_mask(goals, table)
 
     # calculate denotation of goal atoms that is equal for every state
     if logger: logger.info(f'goals={goals}')
     goal_denotation = _get_goal_denotation(goals, obj_encoding)
 
     # set initial state and value trace
-    current_state = initial
-    collated_input, encoded_states = _to_input([ current_state ], goal_denotation, obj_encoding, augment_fn, language, device, logger)
-    state_trace = [ encoded_states[0] ]
-    initial_values, initial_solvables = model(collated_input)
+    current_state = table.from_tarski(initial)
+    encoder = StateEncoder(table, obj_encoding, goal_denotation, _get_static_state(current_state, successor_generator))
+    state_trace = [ _encode_trace_state(current_state, goal_denotation, obj_encoding, augment_fn, language, encoder) ]
+    initial_values, initial_solvables = yield from _evaluate_steps([ current_state ], cache, goal_denotation, obj_encoding, augment_fn, language, device, logger, encoder)
     value_trace = [ initial_values[0] + (1.0 - torch.round(torch.sigmoid(initial_solvables))[0]) * unsolvable_weight ]  # A large value indicates an unsolvable state
     if logger: logger.debug(f'initial_state={current_state}')
 
     # calculate greedy trace
     step, num_evaluations = 1, 1
-    while (not current_state[goals]) and (len(state_trace) < max_state_trace_length):
+    while (not _is_goal(current_state, goals, goal_mask)) and (len(state_trace) < max_state_trace_length):
         if cycles == 'detect' and current_state in closed_states:
             if logger:
                 logger.info(colored(f"Cycle detected after last action '{action_trace[-1]}'", 'magenta'))
@@ -400,13 +504,13 @@ def policy_search_with_augmented_states(actions, initial, goals, obj_encoding: D
             break
 
         # explore current state (avoid loops by removing already visited successors)
-        successor_candidates = [ transition for transition in _get_successor_states(current_state, actions) ]
+        successor_candidates = [ transition for transition in _get_successor_states(current_state, successor_generator) ]
         if cycles == 'avoid':
             successor_candidates = [ transition for transition in successor_candidates if transition[1] not in closed_states ]
 
         if len(successor_candidates) == 0:
             logger.info(f'No applicable action that yields unvisited state for current_state={current_state}')
-            logger.info(f'Applicable actions = {_get_applicable_actions(current_state, actions)}')
+            logger.info(f'Applicable actions = {successor_generator.applicable(current_state)}')
             break
 
         successor_actions = [ candidate[0] for candidate in successor_candidates ]
@@ -414,8 +518,7 @@ def policy_search_with_augmented_states(actions, initial, goals, obj_encoding: D
         if logger: logger.debug(f'#actions={len(successor_actions)}, actions={successor_actions}')
 
         # calculate values for successors and best successor
-        collated_input, encoded_states = _to_input(successor_states, goal_denotation, obj_encoding, augment_fn, language, device, logger)
-        output_values, output_solvables = model(collated_input)
+        output_values, output_solvables = yield from _evaluate_steps(successor_states, cache, goal_denotation, obj_encoding, augment_fn, language, device, logger, encoder, current_state)
         output_solvables = torch.round(torch.sigmoid(output_solvables))
         #output_values += (1.0 - torch.round(torch.sigmoid(output_solvables))) * unsolvable_weight
         output_values += (1.0 - output_solvables) * unsolvable_weight
@@ -428,7 +531,7 @@ def policy_search_with_augmented_states(actions, initial, goals, obj_encoding: D
 
         # extend traces and set next current state
         value_trace.append(output_values[best_successor_index])
-        state_trace.append(encoded_states[best_successor_index])
+        state_trace.append(_encode_trace_state(successor_states[best_successor_index], goal_denotation, obj_encoding, augment_fn, language, encoder))
         action_trace.append(successor_actions[best_successor_index])
         current_state = successor_states[best_successor_index]
 
@@ -436,17 +539,255 @@ def policy_search_with_augmented_states(actions, initial, goals, obj_encoding: D
             logger.debug(f'current_state={current_state}')
             logger.debug('')
 
-    reached_goal = current_state[goals]
+    reached_goal = _is_goal(current_state, goals, goal_mask)
     if logger: logger.debug(f'status={1 if reached_goal else 0}')
+    if logger and cache is not None: logger.info(f'Evaluation cache: {cache}')
     return action_trace, state_trace, value_trace, reached_goal, num_evaluations
 
-def compute_traces_with_augmented_states(actions, initial, goal, language, model: pl.LightningModule, augment_fn = None, cycles: str = 'avoid', max_trace_length: int = 500, unsolvable_weight: float = 100000.0, logger = None, is_spanner = False):
+def policy_search_with_augmented_states(actions, initial, goals, obj_encoding: Dict[str, int], language, model: nn.Module, augment_fn = None, cycles: str = 'avoid', max_state_trace_length: int = 500, unsolvable_weight: float = 100000.0, logger = None, is_spanner = False, cache: EvaluationCache = None, lifted: bool = False):
+    steps = _policy_search_steps(actions, initial, goals, obj_encoding, language, model.device, augment_fn=augment_fn, cycles=cycles, max_state_trace_length=max_state_trace_length, unsolvable_weight=unsolvable_weight, logger=logger, is_spanner=is_spanner, cache=cache, lifted=lifted)
+    return _run_with_model(steps, model)
+
+def compute_traces_with_augmented_states(actions, initial, goal, language, model: nn.Module, augment_fn = None, cycles: str = 'avoid', max_trace_length: int = 500, unsolvable_weight: float = 100000.0, logger = None, is_spanner = False, cache: EvaluationCache = None, lifted: bool = False):
     objects = language.constants()
     obj_encoding = create_object_encoding(objects)
     if logger: logger.info(f'{len(objects)} object(s), obj_encoding={obj_encoding}')
 
     with torch.no_grad():
-        return policy_search_with_augmented_states(actions, initial, goal, obj_encoding, language, model, augment_fn=augment_fn, cycles=cycles, max_state_trace_length=max_trace_length, unsolvable_weight=unsolvable_weight, logger=logger, is_spanner=is_spanner)
+        return policy_search_with_augmented_states(actions, initial, goal, obj_encoding, language, model, augment_fn=augment_fn, cycles=cycles, max_state_trace_length=max_trace_length, unsolvable_weight=unsolvable_weight, logger=logger, is_spanner=is_spanner, cache=cache, lifted=lifted)
+
+def compute_traces_for_problems(problems: List[dict], model: nn.Module, cycles: str = 'avoid', max_trace_length: int = 500, unsolvable_weight: float = 100000.0, loggers: list = None, is_spanner = False):
+    """
+    Greedy searches for several problems (dicts as returned by load_pddl_problem_with_augmented_states)
+    that are advanced in lockstep: in every step, the inputs of all active searches are merged into a
+    single forward pass of the model. Returns the traces of every problem, as compute_traces_with_augmented_states,
+    and the time in seconds after which the search of every problem finished.
+    """
+    start_time = timer()
+    searches = []
+    for index, problem in enumerate(problems):
+        logger = loggers[index] if loggers is not None else None
+        objects = problem['language'].constants()
+        obj_encoding = create_object_encoding(objects)
+        if logger: logger.info(f'{len(objects)} object(s), obj_encoding={obj_encoding}')
+        searches.append(_policy_search_steps(problem['actions'], problem['initial'], problem['goal'], obj_encoding, problem['language'], model.device, augment_fn=problem.get('augment_fn'), cycles=cycles, max_state_trace_length=max_trace_length, unsolvable_weight=unsolvable_weight, logger=logger, is_spanner=is_spanner))
+
+    # pending model inputs of the active searches
+    results, elapsed_times, pending = [ None ] * len(problems), [ None ] * len(problems), dict()
+    def advance(index, output):
+        try:
+            pending[index] = next(searches[index]) if output is None else searches[index].send(output)
+        except StopIteration as stop:
+            pending.pop(index, None)
+            results[index] = stop.value
+            elapsed_times[index] = timer() - start_time
+
+    with torch.no_grad():
+        for index in range(len(problems)): advance(index, None)
+        while len(pending) > 0:
+            indices = list(pending.keys())
+            inputs = [ pending[index] for index in indices ]
+            output_values, output_solvables = model(_merge_inputs(inputs))
+            offset = 0
+            for index, input in zip(indices, inputs):
+                size = len(input[1])
+                advance(index, (output_values[offset:offset + size], output_solvables[offset:offset + size]))
+                offset += size
+    return results, elapsed_times
+
+def _extract_traces(node, goal_denotation, obj_encoding, augment_fn, language, encoder: StateEncoder):
+    # node is a tuple (state, value, parent node, action); returns the traces of the path to node
+    path = []
+    while node is not None:
+        path.append(node)
+        node = node[2]
+    path.reverse()
+    action_trace = [ action for _, _, _, action in path[1:] ]
+    state_trace = [ _encode_trace_state(state, goal_denotation, obj_encoding, augment_fn, language, encoder) for state, _, _, _ in path ]
+    value_trace = [ value for _, value, _, _ in path ]
+    return action_trace, state_trace, value_trace
+
+def beam_search_with_augmented_states(actions, initial, goals, obj_encoding: Dict[str, int], language, model: nn.Module, augment_fn = None, beam_width: int = 4, max_state_trace_length: int = 500, unsolvable_weight: float = 100000.0, logger = None, is_spanner = False, cache: EvaluationCache = None):
+    device = model.device
+    table = AtomTable(initial.language)
+    successor_generator = SuccessorGenerator(actions, table, initial)
+    goal_mask = _get_goal_mask(goals, table)
+
+    # calculate denotation of goal atoms that is equal for every state
+    if logger: logger.info(f'goals={goals}')
+    goal_denotation = _get_goal_denotation(goals, obj_encoding)
+
+    # set initial state and beam; nodes are tuples (state, value, parent node, action)
+    current_state = table.from_tarski(initial)
+    encoder = StateEncoder(table, obj_encoding, goal_denotation, _get_static_state(current_state, successor_generator))
+    initial_values, initial_solvables = _evaluate(model, [ current_state ], cache, goal_denotation, obj_encoding, augment_fn, language, device, logger, encoder)
+    initial_value = initial_values[0] + (1.0 - torch.round(torch.sigmoid(initial_solvables))[0]) * unsolvable_weight  # A large value indicates an unsolvable state
+    beam = [ (current_state, initial_value, None, None) ]
+    goal_node = beam[0] if _is_goal(current_state, goals, goal_mask) else None
+    seen_states = set([ current_state ])
+    if logger: logger.debug(f'initial_state={current_state}')
+
+    # expand all states in the beam and keep the best successors that were not seen before
+    depth, num_evaluations = 1, 1
+    while goal_node is None and len(beam) > 0 and depth < max_state_trace_length:
+        if logger: logger.debug(f'**** DEPTH {depth+1}, beam size {len(beam)}')
+        depth += 1
+
+        # SPANNER: drop states that are known to be unsolvable
+        if is_spanner: beam = [ node for node in beam if not _spanner_unsolvable(node[0]) ]
+
+        successor_nodes = []
+        for node in beam:
+            for action, successor_state in _get_successor_states(node[0], successor_generator):
+                if successor_state in seen_states: continue
+                seen_states.add(successor_state)
+                successor_nodes.append((successor_state, node, action))
+                if _is_goal(successor_state, goals, goal_mask) and goal_node is None:
+                    goal_node = (successor_state, None, node, action)
+
+        if len(successor_nodes) == 0:
+            if logger: logger.info(f'No unvisited successors for the {len(beam)} state(s) in the beam')
+            break
+
+        # calculate values for all successors in a single batch
+        successor_states = [ state for state, _, _ in successor_nodes ]
+        output_values, output_solvables = _evaluate(model, successor_states, cache, goal_denotation, obj_encoding, augment_fn, language, device, logger, encoder)
+        output_values += (1.0 - torch.round(torch.sigmoid(output_solvables))) * unsolvable_weight
+        num_evaluations += len(successor_states)
+        if logger: logger.debug(f'#successors={len(successor_states)}, best values=[' + ", ".join([ f'{float(x):.3f}' for x in torch.sort(output_values.view(-1))[0][:beam_width] ]) + ']')
+
+        if goal_node is not None:
+            index = successor_states.index(goal_node[0])
+            goal_node = (goal_node[0], output_values[index], goal_node[2], goal_node[3])
+            break
+        best_indices = torch.argsort(output_values.view(-1))[:beam_width].tolist()
+        beam = [ (successor_nodes[index][0], output_values[index], successor_nodes[index][1], successor_nodes[index][2]) for index in best_indices ]
+
+    reached_goal = goal_node is not None
+    final_node = goal_node if reached_goal else min(beam, key=lambda node: float(node[1])) if len(beam) > 0 else None
+    if final_node is None: return [], [], [], False, num_evaluations
+    action_trace, state_trace, value_trace = _extract_traces(final_node, goal_denotation, obj_encoding, augment_fn, language, encoder)
+    if logger: logger.debug(f'status={1 if reached_goal else 0}')
+    if logger and cache is not None: logger.info(f'Evaluation cache: {cache}')
+    return action_trace, state_trace, value_trace, reached_goal, num_evaluations
+
+def compute_traces_with_beam_search(actions, initial, goal, language, model: nn.Module, augment_fn = None, beam_width: int = 4, max_trace_length: int = 500, unsolvable_weight: float = 100000.0, logger = None, is_spanner = False, cache: EvaluationCache = None):
+    objects = language.constants()
+    obj_encoding = create_object_encoding(objects)
+    if logger: logger.info(f'{len(objects)} object(s), obj_encoding={obj_encoding}')
+
+    with torch.no_grad():
+        return beam_search_with_augmented_states(actions, initial, goal, obj_encoding, language, model, augment_fn=augment_fn, beam_width=beam_width, max_state_trace_length=max_trace_length, unsolvable_weight=unsolvable_weight, logger=logger, is_spanner=is_spanner, cache=cache)
+
+def _memory_usage() -> float:
+    # peak resident set size of the process in MiB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def gbfs_with_augmented_states(actions, initial, goals, obj_encoding: Dict[str, int], language, model: nn.Module, augment_fn = None, max_expansions: int = None, max_time: float = None, max_memory: float = None, unsolvable_weight: float = 100000.0, logger = None, is_spanner = False, cache: EvaluationCache = None, deferred: bool = False):
+    """
+    Greedy best-first search with the output of the model as heuristic. By default, the successors
+    of an expansion are evaluated in a single batch and enter the open list with their own value.
+    With deferred evaluation, they enter it with the value of their parent instead, and are only
+    evaluated when the first of them is popped, in a single batch with the siblings that are not
+    closed nor evaluated yet; these go back into the open list with the value of their parent,
+    ordered by their own value. Deferred evaluation saves the evaluations of the successors that
+    are never reached, but it expands the siblings of a node before its successors whenever its
+    value is worse than the one of its parent, which happens often with the learned values, so
+    it is optional. Nodes are closed and tested for the goal when they are expanded, so duplicates
+    are only detected at that point. The search stops when one of the budgets (expansions,
+    seconds, MiB of peak memory) is exceeded.
+    """
+    start_time = timer()
+    device = model.device
+    table = AtomTable(initial.language)
+    successor_generator = SuccessorGenerator(actions, table, initial)
+    goal_mask = _get_goal_mask(goals, table)
+
+    # calculate denotation of goal atoms that is equal for every state
+    if logger: logger.info(f'goals={goals}')
+    goal_denotation = _get_goal_denotation(goals, obj_encoding)
+
+    # open list of (key, value or inf if not evaluated, insertion index, state, parent node, action, value or siblings),
+    # where the key is the value of the node or of its parent, and the siblings are the (action, state) of the successors
+    # of the parent, which are evaluated together; nodes are tuples (state, value, parent node, action)
+    current_state = table.from_tarski(initial)
+    encoder = StateEncoder(table, obj_encoding, goal_denotation, _get_static_state(current_state, successor_generator))
+    initial_values, initial_solvables = _evaluate(model, [ current_state ], cache, goal_denotation, obj_encoding, augment_fn, language, device, logger, encoder)
+    initial_value = initial_values[0] + (1.0 - torch.round(torch.sigmoid(initial_solvables))[0]) * unsolvable_weight  # A large value indicates an unsolvable state
+    open_list = [ (float(initial_value), float(initial_value), 0, current_state, None, None, initial_value) ]
+    closed_states, evaluated_states = set(), set()
+    num_evaluations, num_expansions, num_generated = 1, 0, 1
+    goal_node = None
+    if logger: logger.debug(f'initial_state={current_state}')
+
+    def evaluate(parent, successors):
+        # values of the successors of parent, in a single batch
+        nonlocal num_evaluations
+        output_values, output_solvables = _evaluate(model, [ state for _, state in successors ], cache, goal_denotation, obj_encoding, augment_fn, language, device, logger, encoder, parent[0])
+        output_values += (1.0 - torch.round(torch.sigmoid(output_solvables))) * unsolvable_weight
+        num_evaluations += len(successors)
+        return output_values
+
+    while len(open_list) > 0:
+        if max_expansions is not None and num_expansions >= max_expansions:
+            if logger: logger.info(colored(f'Expansion limit of {max_expansions} reached', 'magenta'))
+            break
+        if max_time is not None and timer() - start_time >= max_time:
+            if logger: logger.info(colored(f'Time limit of {max_time} second(s) reached', 'magenta'))
+            break
+        if max_memory is not None and num_expansions % 100 == 0 and _memory_usage() >= max_memory:
+            if logger: logger.info(colored(f'Memory limit of {max_memory} MiB reached', 'magenta'))
+            break
+
+        key, _, _, state, parent, action, value = heapq.heappop(open_list)
+        if state in closed_states: continue
+        if isinstance(value, list):
+            # deferred evaluation of the pending siblings, which go back into the open list with their values;
+            # a state that was evaluated before already has such an entry
+            if state in evaluated_states: continue
+            pending = [ (sibling_action, sibling) for sibling_action, sibling in value if sibling not in evaluated_states and sibling not in closed_states ]
+            for (sibling_action, sibling), sibling_value in zip(pending, evaluate(parent, pending)):
+                evaluated_states.add(sibling)
+                heapq.heappush(open_list, (key, float(sibling_value), num_generated, sibling, parent, sibling_action, sibling_value))
+                num_generated += 1
+            continue
+        node = (state, value, parent, action)
+        closed_states.add(state)
+        evaluated_states.discard(state)
+        if _is_goal(state, goals, goal_mask):
+            goal_node = node
+            break
+
+        # SPANNER: states that are known to be unsolvable are not expanded
+        if is_spanner and _spanner_unsolvable(state): continue
+
+        num_expansions += 1
+        successors = [ (action, successor_state) for action, successor_state in _get_successor_states(state, successor_generator) if successor_state not in closed_states ]
+        if len(successors) == 0: continue
+        if deferred:
+            for action, successor_state in successors:
+                heapq.heappush(open_list, (float(value), float('inf'), num_generated, successor_state, node, action, successors))
+                num_generated += 1
+        else:
+            for (action, successor_state), successor_value in zip(successors, evaluate(node, successors)):
+                heapq.heappush(open_list, (float(successor_value), float(successor_value), num_generated, successor_state, node, action, successor_value))
+                num_generated += 1
+        if logger: logger.debug(f'expansions={num_expansions}, open={len(open_list)}, closed={len(closed_states)}, value={float(value):.3f}')
+
+    reached_goal = goal_node is not None
+    if logger: logger.info(f'{num_expansions} expansion(s), {num_evaluations} evaluation(s), {len(closed_states)} closed state(s), peak memory {_memory_usage():.1f} MiB')
+    if logger and cache is not None: logger.info(f'Evaluation cache: {cache}')
+    if not reached_goal: return [], [], [], False, num_evaluations, num_expansions
+    action_trace, state_trace, value_trace = _extract_traces(goal_node, goal_denotation, obj_encoding, augment_fn, language, encoder)
+    return action_trace, state_trace, value_trace, reached_goal, num_evaluations, num_expansions
+
+def compute_traces_with_gbfs(actions, initial, goal, language, model: nn.Module, augment_fn = None, max_expansions: int = None, max_time: float = None, max_memory: float = None, unsolvable_weight: float = 100000.0, logger = None, is_spanner = False, cache: EvaluationCache = None, deferred: bool = False):
+    objects = language.constants()
+    obj_encoding = create_object_encoding(objects)
+    if logger: logger.info(f'{len(objects)} object(s), obj_encoding={obj_encoding}')
+
+    with torch.no_grad():
+        return gbfs_with_augmented_states(actions, initial, goal, obj_encoding, language, model, augment_fn=augment_fn, max_expansions=max_expansions, max_time=max_time, max_memory=max_memory, unsolvable_weight=unsolvable_weight, logger=logger, is_spanner=is_spanner, cache=cache, deferred=deferred)
 
 
 def _variableMapping(language):
@@ -521,26 +862,27 @@ def _collectStaticFacts(initial, available_facts, actions, language, logger):
 
 def _serve_policy(actions, initial, goals, obj_encoding, language,
                   static_facts, var_map, action_map, available_actions,
-                  model: pl.LightningModule,
+                  model: nn.Module,
                   augment_fn = None, unsolvable_weight: float = 100000.0,
-                  logger = None, is_spanner = False):
+                  logger = None, is_spanner = False, cache: EvaluationCache = None):
     device = model.device
+    table = AtomTable(language)
+    successor_generator = SuccessorGenerator(actions, table, initial)
+    static_state = table.from_tarski(static_facts)
     # calculate denotation of goal atoms that is equal for every state
     if logger: logger.info(f'goals={goals}')
     goal_denotation = _get_goal_denotation(goals, obj_encoding)
+    encoder = StateEncoder(table, obj_encoding, goal_denotation, static_state)
 
     for line in sys.stdin:
         line = line.strip()
         fdr_state = [int(x) for x in line.split()]
         if logger: logger.info(f'STATE {fdr_state}')
-        current_state = deepcopy(static_facts)
-        for i in range(len(var_map)):
-            atom = var_map[i][fdr_state[i]]
-            current_state.add(atom.predicate, *atom.subterms)
+        current_state = table.extend(static_state, [ atom_key(var_map[i][fdr_state[i]]) for i in range(len(var_map)) ])
         if logger: logger.info(f'Strips state {current_state}')
         if logger: logger.info(f'Init state {initial}')
 
-        successor_candidates = [ transition for transition in _get_successor_states(current_state, actions) ]
+        successor_candidates = [ transition for transition in _get_successor_states(current_state, successor_generator) ]
         successor_candidates = sorted(successor_candidates, key = lambda x: x[0].ident())
         successor_actions = []
         successor_states = []
@@ -552,8 +894,7 @@ def _serve_policy(actions, initial, goals, obj_encoding, language,
                 if logger: logger.info(f'Skipping action {candidate[0]}')
 
         if logger: logger.info(f'#actions={len(successor_actions)}, actions={successor_actions}')
-        collated_input, encoded_states = _to_input(successor_states, goal_denotation, obj_encoding, augment_fn, language, device, logger)
-        output_values, output_solvables = model(collated_input)
+        output_values, output_solvables = _evaluate(model, successor_states, cache, goal_denotation, obj_encoding, augment_fn, language, device, logger, encoder, current_state)
         output_solvables = torch.round(torch.sigmoid(output_solvables))
         #output_values += (1.0 - torch.round(torch.sigmoid(output_solvables))) * unsolvable_weight
         output_values += (1.0 - output_solvables) * unsolvable_weight
@@ -573,9 +914,9 @@ def _serve_policy(actions, initial, goals, obj_encoding, language,
 
     return 0
 
-def serve_policy(actions, initial, goal, language, model: pl.LightningModule,
+def serve_policy(actions, initial, goal, language, model: nn.Module,
                  augment_fn = None, unsolvable_weight: float = 100000.0,
-                 logger = None, is_spanner = False):
+                 logger = None, is_spanner = False, cache: EvaluationCache = None):
     objects = language.constants()
     obj_encoding = create_object_encoding(objects)
     if logger: logger.info(f'{len(objects)} object(s), obj_encoding={obj_encoding}')
@@ -593,7 +934,7 @@ def serve_policy(actions, initial, goal, language, model: pl.LightningModule,
     with torch.no_grad():
         return _serve_policy(actions, initial, goal, obj_encoding, language,
                              static_facts, var_map, action_map, available_actions,
-                             model, augment_fn, unsolvable_weight, logger, is_spanner)
+                             model, augment_fn, unsolvable_weight, logger, is_spanner, cache)
 
 
 ########################################################################################################################
@@ -601,10 +942,13 @@ def serve_policy(actions, initial, goal, language, model: pl.LightningModule,
 class StaticServerData:
     static_facts = None
     actions = None
+    successor_generator: SuccessorGenerator = None
+    table: AtomTable = None
+    static_state: State = None
     initial = None
     goal = None
     language = None
-    model: pl.LightningModule = None
+    model: nn.Module = None
     augment_fn = None
     unsolvable_weight: float = 100000.0
     var_map = None
@@ -614,6 +958,8 @@ class StaticServerData:
     obj_encoding = None
     device = None
     goal_denotation = None
+    encoder: StateEncoder = None
+    cache: EvaluationCache = None
     torch_context_handler = None
     num_vars = None
 
@@ -724,14 +1070,11 @@ def parse_sas_file(sas_file, language, actions):
             raise e
 
 def state_and_successors(fdr_state):
-    current_state = deepcopy(StaticServerData.static_facts)
-    for i in range(len(StaticServerData.var_map)):
-        atom = StaticServerData.var_map[i][fdr_state[i]]
-        # TODO check this
-        if atom:
-            current_state.add(atom.predicate, *atom.subterms)
-
-    successor_candidates = [transition for transition in _get_successor_states(current_state, StaticServerData.actions)]
+    atoms = [ StaticServerData.var_map[i][fdr_state[i]] for i in range(len(StaticServerData.var_map)) ]
+    # TODO check this
+    current_state = StaticServerData.table.extend(StaticServerData.static_state, [ atom_key(atom) for atom in atoms if atom ])
+
+    successor_candidates = [transition for transition in _get_successor_states(current_state, StaticServerData.successor_generator)]
     successor_candidates = sorted(successor_candidates, key=lambda x: x[0].ident())
     successor_actions = []
     successor_states = []
@@ -743,8 +1086,7 @@ def state_and_successors(fdr_state):
 
 def apply_policy_to_state(fdr_state):
     current_state, successor_actions, successor_states = state_and_successors(fdr_state)
-    collated_input, encoded_states = _to_input(successor_states, StaticServerData.goal_denotation, StaticServerData.obj_encoding, StaticServerData.augment_fn, StaticServerData.language, StaticServerData.device, None)
-    output_values, output_solvables = StaticServerData.model(collated_input)
+    output_values, output_solvables = _evaluate(StaticServerData.model, successor_states, StaticServerData.cache, StaticServerData.goal_denotation, StaticServerData.obj_encoding, StaticServerData.augment_fn, StaticServerData.language, StaticServerData.device, None, StaticServerData.encoder, current_state)
     output_solvables = torch.round(torch.sigmoid(output_solvables))
     output_values += (1.0 - output_solvables) * StaticServerData.unsolvable_weight
     # out = ['{0} {1:.4f}'.format(StaticServerData.action_map[successor_actions[idx]], output_values[idx][0])
@@ -757,8 +1099,7 @@ def apply_policy_to_state(fdr_state):
 
 def apply_policy_to_state_prob_dist(fdr_state):
     current_state, successor_actions, successor_states = state_and_successors(fdr_state)
-    collated_input, encoded_states = _to_input(successor_states, StaticServerData.goal_denotation, StaticServerData.obj_encoding, StaticServerData.augment_fn, StaticServerData.language, StaticServerData.device, None)
-    output_values, output_solvables = StaticServerData.model(collated_input)
+    output_values, output_solvables = _evaluate(StaticServerData.model, successor_states, StaticServerData.cache, StaticServerData.goal_denotation, StaticServerData.obj_encoding, StaticServerData.augment_fn, StaticServerData.language, StaticServerData.device, None, StaticServerData.encoder, current_state)
     output_solvables = torch.round(torch.sigmoid(output_solvables))
     output_values += (1.0 - output_solvables) * StaticServerData.unsolvable_weight
 
@@ -775,8 +1116,8 @@ def apply_policy_to_state_prob_dist(fdr_state):
     return out
 
 
-def setup_policy_server(actions, initial, goal, language, model: pl.LightningModule, sas_file,
-                        augment_fn=None, unsolvable_weight: float = 100000.0):
+def setup_policy_server(actions, initial, goal, language, model: nn.Module, sas_file,
+                        augment_fn=None, unsolvable_weight: float = 100000.0, cache: EvaluationCache = None):
     StaticServerData.actions = actions
     StaticServerData.initial = initial
     StaticServerData.goal = goal
@@ -784,18 +1125,23 @@ def setup_policy_server(actions, initial, goal, language, model: pl.LightningMod
     StaticServerData.model = model
     StaticServerData.augment_fn = augment_fn
     StaticServerData.unsolvable_weight = unsolvable_weight
+    StaticServerData.cache = cache
     print("Setting up GNN policy server")
     objects = language.constants()
     StaticServerData.obj_encoding = create_object_encoding(objects)
     parse_sas_file(sas_file, StaticServerData.language, StaticServerData.actions)
     print("Read variable and action mappings")
     StaticServerData.static_facts = _collectStaticFacts(StaticServerData.initial, StaticServerData.available_facts, StaticServerData.actions, StaticServerData.language, None)
+    StaticServerData.table = AtomTable(StaticServerData.language)
+    StaticServerData.successor_generator = SuccessorGenerator(StaticServerData.actions, StaticServerData.table, StaticServerData.initial)
+    StaticServerData.static_state = StaticServerData.table.from_tarski(StaticServerData.static_facts)
     StaticServerData.torch_context_handler = torch.no_grad()
     StaticServerData.torch_context_handler.__enter__()
     # TODO shut this down again
     StaticServerData.device = StaticServerData.model.device
     # calculate denotation of goal atoms that is equal for every state
     StaticServerData.goal_denotation = _get_goal_denotation(StaticServerData.goal, StaticServerData.obj_encoding)
+    StaticServerData.encoder = StateEncoder(StaticServerData.table, StaticServerData.obj_encoding, StaticServerData.goal_denotation, StaticServerData.static_state)
 
 
 def get_num_vars():
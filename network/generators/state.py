@@ -0,0 +1,120 @@
+from random import Random
+from typing import Dict, List, Tuple
+
+from tarski.evaluators.simple import evaluate
+from tarski.model import Model as PDDLState
+from tarski.model import create as make_tarski_state
+
+
+class State:
+    """
+    Immutable set of ground atoms stored as a bitset over the atom ids of an AtomTable.
+    The hash is the XOR of the Zobrist keys of the atoms and is maintained incrementally
+    when successors are generated, so states are cheap to store in closed lists.
+    """
+    __slots__ = ('table', 'bits', 'zobrist')
+
+    def __init__(self, table: 'AtomTable', bits: int, zobrist: int):
+        self.table = table
+        self.bits = bits
+        self.zobrist = zobrist
+
+    def __hash__(self):
+        return self.zobrist
+
+    def __eq__(self, other):
+        return isinstance(other, State) and self.bits == other.bits and self.table is other.table
+
+    def __contains__(self, atom_id: int) -> bool:
+        return (self.bits >> atom_id) & 1 == 1
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+    def __str__(self):
+        return f"State[{', '.join(sorted([ self.table.atom_str(atom_id) for atom_id in self.atom_ids() ]))}]"
+
+    __repr__ = __str__
+
+    def atom_ids(self) -> List[int]:
+        """Ids of the atoms in the state, in increasing order."""
+        atom_ids = []
+        bits = self.bits
+        while bits:
+            low = bits & -bits
+            atom_ids.append(low.bit_length() - 1)
+            bits ^= low
+        return atom_ids
+
+    def atoms(self) -> List[Tuple[str, Tuple[str, ...]]]:
+        """Keys (predicate name, object names) of the atoms in the state."""
+        return [ self.table.keys[atom_id] for atom_id in self.atom_ids() ]
+
+    def extensions(self) -> Dict[str, List[Tuple[str, ...]]]:
+        """Map from predicate names to the tuples of object names in their denotation."""
+        extensions = dict()
+        for predicate_name, objects in self.atoms():
+            if predicate_name not in extensions: extensions[predicate_name] = []
+            extensions[predicate_name].append(objects)
+        return extensions
+
+    def to_tarski(self) -> PDDLState:
+        return self.table.to_tarski(self)
+
+
+class AtomTable:
+    """Interns ground atoms, given as (predicate name, object names) keys, as consecutive integer ids."""
+
+    def __init__(self, language = None, seed: int = 0):
+        self.language = language
+        self.keys: List[Tuple[str, Tuple[str, ...]]] = []
+        self.ids: Dict[Tuple[str, Tuple[str, ...]], int] = dict()
+        self.zobrist: List[int] = []
+        self._random = Random(seed)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def intern(self, key: Tuple[str, Tuple[str, ...]]) -> int:
+        atom_id = self.ids.get(key)
+        if atom_id is None:
+            atom_id = len(self.keys)
+            self.ids[key] = atom_id
+            self.keys.append(key)
+            self.zobrist.append(self._random.getrandbits(64))
+        return atom_id
+
+    def atom_str(self, atom_id: int) -> str:
+        predicate_name, objects = self.keys[atom_id]
+        return f"{predicate_name}({','.join(objects)})" if len(objects) > 0 else predicate_name
+
+    def mask(self, atom_ids) -> int:
+        bits = 0
+        for atom_id in atom_ids: bits |= 1 << atom_id
+        return bits
+
+    def state(self, keys) -> State:
+        bits, zobrist = 0, 0
+        for atom_id in set([ self.intern(key) for key in keys ]):
+            bits |= 1 << atom_id
+            zobrist ^= self.zobrist[atom_id]
+        return State(self, bits, zobrist)
+
+    def extend(self, state: State, keys) -> State:
+        """Union of state and the atoms with the given keys."""
+        bits, zobrist = state.bits, state.zobrist
+        for atom_id in set([ self.intern(key) for key in keys ]):
+            if not (bits >> atom_id) & 1:
+                bits |= 1 << atom_id
+                zobrist ^= self.zobrist[atom_id]
+        return State(self, bits, zobrist)
+
+    def from_tarski(self, tarski_state: PDDLState) -> State:
+        return self.state([ (signature[0], tuple([ wref.expr.name for wref in point ])) for signature, extension in tarski_state.predicate_extensions.items() for point in extension ])
+
+    def to_tarski(self, state: State) -> PDDLState:
+        assert self.language is not None, 'conversion into tarski states requires the language of the problem'
+        tarski_state = make_tarski_state(self.language, evaluate)
+        for predicate_name, objects in state.atoms():
+            tarski_state.add(self.language.get_predicate(predicate_name), *[ self.language.get_constant(obj) for obj in objects ])
+        return tarski_state
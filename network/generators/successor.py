@@ -0,0 +1,149 @@
+from typing import List, Tuple
+
+from tarski.fstrips.fstrips import AddEffect, DelEffect
+from tarski.model import Model as PDDLState
+from tarski.syntax.formulas import Atom, CompoundFormula, Connective, Tautology
+
+from .state import AtomTable, State
+
+
+def atom_key(atom: Atom) -> Tuple[str, Tuple[str, ...]]:
+    """Hashable key of a ground atom: (predicate name, object names)."""
+    return (atom.predicate.name, tuple([ obj.name for obj in atom.subterms ]))
+
+def state_keys(state: PDDLState):
+    """Keys of the atoms that are true in a tarski state."""
+    return [ (signature[0], tuple([ wref.expr.name for wref in point ])) for signature, extension in state.predicate_extensions.items() for point in extension ]
+
+def _precondition_literals(formula):
+    # returns the precondition as a list of (atom, value) pairs, or None if it is not a conjunction of literals
+    if isinstance(formula, Tautology):
+        return []
+    elif isinstance(formula, Atom):
+        return [ (formula, True) ]
+    elif isinstance(formula, CompoundFormula) and formula.connective == Connective.Not and isinstance(formula.subformulas[0], Atom):
+        return [ (formula.subformulas[0], False) ]
+    elif isinstance(formula, CompoundFormula) and formula.connective == Connective.And:
+        literals = []
+        for subformula in formula.subformulas:
+            sub_literals = _precondition_literals(subformula)
+            if sub_literals is None: return None
+            literals.extend(sub_literals)
+        return literals
+    return None
+
+
+class SuccessorGenerator:
+    """
+    Decision tree over precondition atoms in the style of Fast Downward's successor generator.
+    It is built once per problem; a query only visits the branches that are consistent with
+    the state instead of evaluating the precondition of every ground operator. Atoms are
+    interned in the given table, and successors are generated as bitset states.
+    """
+
+    def __init__(self, actions: list, table: AtomTable, initial: PDDLState = None):
+        self.actions = actions
+        self.table = table
+
+        # atoms of predicates that appear in effects can change, all others keep their initial value
+        fluent_predicates = set([ effect.atom.predicate.name for action in actions for effect in action.effects if isinstance(effect, (AddEffect, DelEffect)) ])
+        self.fluent_predicates = fluent_predicates
+        initial_keys = set(state_keys(initial)) if initial is not None else None
+
+        # compile preconditions into sorted lists of (atom id, value), and collect operators that can't be compiled
+        conditions = []
+        self.residual: List[int] = []
+        for index, action in enumerate(actions):
+            literals = _precondition_literals(action.precondition)
+            if literals is None:
+                self.residual.append(index)
+                continue
+            condition, reachable = dict(), True
+            for atom, value in literals:
+                key = atom_key(atom)
+                if initial_keys is not None and atom.predicate.name not in fluent_predicates:
+                    reachable = reachable and ((key in initial_keys) == value)
+                    continue
+                atom_id = table.intern(key)
+                reachable = reachable and condition.get(atom_id, value) == value
+                condition[atom_id] = value
+            if reachable:
+                conditions.append((index, condition))
+
+        # test atoms shared by many operators close to the root to keep the tree small
+        frequency = dict()
+        for _, condition in conditions:
+            for atom_id in condition: frequency[atom_id] = frequency.get(atom_id, 0) + 1
+        order = sorted(frequency.keys(), key=lambda atom_id: (-frequency[atom_id], atom_id))
+        rank = dict([ (atom_id, position) for position, atom_id in enumerate(order) ])
+        self._order = order
+        sorted_conditions = [ (index, sorted([ (rank[atom_id], value) for atom_id, value in condition.items() ]), 0) for index, condition in conditions ]
+        self._root = self._build(sorted_conditions)
+
+        # compile effects into (delete mask, add mask, ids of affected atoms); deletes are applied before adds
+        self._effects = []
+        for action in actions:
+            delete_ids = [ table.intern(atom_key(effect.atom)) for effect in action.effects if isinstance(effect, DelEffect) ]
+            add_ids = [ table.intern(atom_key(effect.atom)) for effect in action.effects if isinstance(effect, AddEffect) ]
+            self._effects.append((table.mask(delete_ids), table.mask(add_ids), sorted(set(delete_ids) | set(add_ids))))
+
+    def _build(self, conditions):
+        # each node is a list [atom mask, immediate operators, true child, false child, don't care child];
+        # the tree can be as deep as there are atoms, so it is built without recursion
+        root = [ None, [], None, None, None ]
+        stack = [ (root, conditions) ]
+        while stack:
+            node, items = stack.pop()
+            node[1] = [ index for index, condition, position in items if position == len(condition) ]
+            remaining = [ item for item in items if item[2] < len(item[1]) ]
+            if len(remaining) == 0: continue
+
+            # conditions are consumed front to back, so the tested atom is the smallest pending one
+            test = min([ condition[position][0] for _, condition, position in remaining ])
+            node[0] = 1 << self._order[test]
+            branches = ([], [], [])
+            for index, condition, position in remaining:
+                rank, value = condition[position]
+                if rank == test: branches[0 if value else 1].append((index, condition, position + 1))
+                else: branches[2].append((index, condition, position))
+            for slot, branch in zip([ 2, 3, 4 ], branches):
+                if len(branch) > 0:
+                    node[slot] = [ None, [], None, None, None ]
+                    stack.append((node[slot], branch))
+        return root
+
+    def applicable_indices(self, state: State) -> List[int]:
+        """Indices (in increasing order) of the operators applicable in state."""
+        bits = state.bits
+        result = []
+        if len(self.residual) > 0:
+            tarski_state = state.to_tarski()
+            result = [ index for index in self.residual if tarski_state[self.actions[index].precondition] ]
+        stack = [ self._root ]
+        while stack:
+            atom_mask, immediate, if_true, if_false, dont_care = stack.pop()
+            result.extend(immediate)
+            if atom_mask is None: continue
+            child = if_true if bits & atom_mask else if_false
+            if child is not None: stack.append(child)
+            if dont_care is not None: stack.append(dont_care)
+        result.sort()
+        return result
+
+    def applicable(self, state: State) -> list:
+        """Operators applicable in state, in the same order as in the list of actions."""
+        return [ self.actions[index] for index in self.applicable_indices(state) ]
+
+    def apply(self, state: State, index: int) -> State:
+        """Successor of state under the operator with the given index."""
+        delete_mask, add_mask, effect_ids = self._effects[index]
+        bits = (state.bits & ~delete_mask) | add_mask
+        changed, zobrist = bits ^ state.bits, state.zobrist
+        if changed:
+            for atom_id in effect_ids:
+                if (changed >> atom_id) & 1: zobrist ^= self.table.zobrist[atom_id]
+        return State(self.table, bits, zobrist)
+
+    def successors(self, state: State) -> list:
+        """Pairs (operator, successor state) for the operators applicable in state."""
+        return [ (self.actions[index], self.apply(state, index)) for index in self.applicable_indices(state) ]
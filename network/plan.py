@@ -8,10 +8,10 @@ import argparse, logging
 import torch
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from generators import (compute_traces_with_augmented_states, load_pddl_problem_with_augmented_states, serve_policy,
+from generators import (compute_traces_for_problems, compute_traces_with_augmented_states, compute_traces_with_beam_search, compute_traces_with_gbfs, load_pddl_problem_with_augmented_states, serve_policy,
                         setup_policy_server, apply_policy_to_state,
-                        apply_policy_to_state_prob_dist, get_num_vars)
-from architecture import g_model_classes
+                        apply_policy_to_state_prob_dist, get_num_vars, EvaluationCache, GroundingCache)
+from architecture import load_network, set_fused_messages, set_sparse_aggregation, AutocastNetwork
 
 def _get_logger(name : str, logfile : Path, level = logging.INFO, console = True):
     logger = logging.getLogger(name)
@@ -38,44 +38,125 @@ def _get_logger(name : str, logfile : Path, level = logging.INFO, console = True
 
 def _parse_arguments(arg_list_override=None):
     default_aggregation = 'max'
+    default_backend = 'torch'
+    default_beam_width = 4
+    default_cache_memory = 0
     default_debug_level = 0
+    default_grounder = 'lp'
     default_cycles = 'avoid'
     default_logfile = 'log_plan.txt'
+    default_log_suffix = '.log'
     default_max_length = 500
     default_registry_filename = '../DerivedPredicates/registry_rules.json'
+    default_search = 'greedy'
 
     # required arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('--domain', required=True, type=Path, help='domain file')
-    parser.add_argument('--model', required=True, type=Path, help='model file')
-    parser.add_argument('--problem', required=True, type=Path, help='problem file')
+    parser.add_argument('--model', required=True, type=Path, help='model file, a checkpoint or a TorchScript or ONNX network written by export.py')
+    parser.add_argument('--problem', type=Path, help='problem file')
+    parser.add_argument('--problems', type=Path, nargs='+', help='problem files or directories with problem files, searched in lockstep with one model call per step')
 
     # optional arguments
-    parser.add_argument('--aggregation', default=default_aggregation, nargs='?', choices=['add', 'max', 'addmax', 'attention'], help=f'aggregation function for readout (default={default_aggregation})')
+    parser.add_argument('--aggregation', default=default_aggregation, nargs='?', choices=['add', 'max', 'addmax', 'exactmax', 'addexactmax', 'attention'], help=f'aggregation function for readout (default={default_aggregation})')
     parser.add_argument('--augment', action='store_true', help='augment states with derived predicates')
+    parser.add_argument('--backend', type=str, default=default_backend, choices=['torch', 'onnxruntime'], help=f'runtime of the model, onnxruntime needs an ONNX network written by export.py --format onnx and runs on the CPU (default={default_backend})')
+    parser.add_argument('--beam-width', dest='beam_width', type=int, default=default_beam_width, help=f'number of states kept in each layer of beam search (default={default_beam_width})')
+    parser.add_argument('--bf16', action='store_true', help='run the network under bfloat16 autocast with float32 heads, faster on CPUs with bfloat16 matmul (checkpoints only)')
+    parser.add_argument('--cache_memory', type=int, default=default_cache_memory, help=f'memory bound in MiB for cached state evaluations, 0 disables the cache (default={default_cache_memory})')
     parser.add_argument('--cpu', action='store_true', help='use CPU')
     parser.add_argument('--cycles', type=str, default=default_cycles, choices=['avoid', 'detect'], help=f'how planner handles cycles (default={default_cycles})')
     parser.add_argument('--debug_level', dest='debug_level', type=int, default=default_debug_level, help=f'set debug level (default={default_debug_level})')
+    parser.add_argument('--deferred_evaluation', action='store_true', help='evaluate the successors of GBFS when the first of them is popped instead of when they are generated, which saves evaluations but often needs more expansions with the learned values')
+    parser.add_argument('--deterministic', action='store_true', help='use fixed instead of random noise for initial object embeddings')
+    parser.add_argument('--fused_messages', action='store_true', help='run the relation MLPs of the same arity as one batched matmul, faster on GPUs and for small batches')
+    parser.add_argument('--grounder', type=str, default=default_grounder, choices=['lp', 'native'], help=f'grounder of the PDDL problem, tarski with gringo or relaxed reachability in Python (default={default_grounder})')
+    parser.add_argument('--grounding_cache', type=Path, default=None, help='directory of the persistent cache of grounded problems (default=no cache)')
     parser.add_argument('--ignore_unsolvable', action='store_true', help='ignore unsolvable states in policy controller')
     parser.add_argument('--logfile', type=Path, default=default_logfile, help=f'log file (default={default_logfile})')
+    parser.add_argument('--logdir', type=Path, default=None, help='directory for the logs of each problem with --problems (default=directory of log file)')
+    parser.add_argument('--log_suffix', type=str, default=default_log_suffix, help=f'suffix of the log of each problem with --problems (default={default_log_suffix})')
+    parser.add_argument('--lifted', action='store_true', help='compute applicable actions per state from the action schemas instead of grounding the problem (greedy search only)')
     parser.add_argument('--log-no-console', action='store_true', help='Disable logging to console')
+    parser.add_argument('--max_expansions', type=int, default=None, help='max number of expansions of GBFS (default=unlimited)')
     parser.add_argument('--max_length', type=int, default=default_max_length, help=f'max trace length (default={default_max_length})')
+    parser.add_argument('--max_memory', type=float, default=None, help='max peak memory of GBFS in MiB (default=unlimited)')
+    parser.add_argument('--max_time', type=float, default=None, help='max time of GBFS in seconds (default=unlimited)')
     parser.add_argument('--print_trace', action='store_true', help='print trace')
     parser.add_argument('--readout', action='store_true', help='use global readout')
     parser.add_argument('--registry_filename', type=Path, default=default_registry_filename, help=f'registry filename (default={default_registry_filename})')
     parser.add_argument('--registry_key', type=str, default=None, help=f'key into registry (if missing, calculated from domain path)')
+    parser.add_argument('--search', type=str, default=default_search, choices=['greedy', 'beam', 'gbfs'], help=f'search algorithm that is guided by the model, GBFS evaluates the successors of each expansion in one batch, see --deferred_evaluation (default={default_search})')
     parser.add_argument('--spanner', action='store_true', help='special handling for Spanner problems')
+    parser.add_argument('--sparse_aggregation', action='store_true', help='sum the messages with a sparse CSR incidence matrix instead of scatter_add, faster for large batches (add and addmax aggregations)')
     parser.add_argument('--serve-policy', action='store_true', help='Run as a server')
     parser.add_argument('--sas', type=Path, help='sas file')
     args = parser.parse_args() if arg_list_override is None else parser.parse_args(arg_list_override)
+    if (args.problem is None) == (args.problems is None):
+        parser.error('exactly one of --problem and --problems is required')
+    if args.problems is not None and (args.search != 'greedy' or args.serve_policy or args.sas):
+        parser.error('--problems only supports greedy search')
+    if args.lifted and (args.search != 'greedy' or args.serve_policy or args.sas or args.problems is not None):
+        parser.error('--lifted only supports greedy search on a single problem')
     return args
 
-def _load_model(args):
-    try:
-        Model = g_model_classes[(args.aggregation, args.readout, 'base')]
-    except KeyError:
-        raise NotImplementedError(f"No model found for {(args.aggregation, args.readout, 'base')} combination")
-    return Model
+def _create_cache(args):
+    return EvaluationCache(args.cache_memory * 1024 * 1024) if args.cache_memory > 0 else None
+
+def _get_problem_files(paths):
+    # directories contribute their problem files, which are all PDDL files except the domain
+    problem_files = []
+    for path in paths:
+        if path.is_dir(): problem_files.extend(sorted([ filename for filename in path.glob('*.pddl') if filename.name != 'domain.pddl' ]))
+        else: problem_files.append(path)
+    return problem_files
+
+def _log_result(logger, args, problem, action_trace, value_trace, is_solution):
+    if is_solution:
+        logger.info(colored(f'Found valid plan with {len(action_trace)} action(s) for {problem}', 'green', attrs=[ 'bold' ]))
+    else:
+        logger.info(colored(f'Failed to find a plan for {problem}', 'red', attrs=[ 'bold' ]))
+
+    if args.print_trace:
+        for index, action in enumerate(action_trace):
+            value_from = value_trace[index]
+            value_to = value_trace[index + 1]
+            logger.info('{}: {} (value change: {:.2f} -> {:.2f} {})'.format(index + 1, action.name, float(value_from), float(value_to), 'D' if float(value_from) > float(value_to) else 'I'))
+
+def _create_grounding_cache(args):
+    return GroundingCache(args.grounding_cache) if args.grounding_cache is not None else None
+
+def _main_problems(args, model):
+    global logger
+    registry_filename = args.registry_filename if args.augment else None
+    is_spanner = args.spanner and 'spanner' in str(args.domain)
+    unsolvable_weight = 0.0 if args.ignore_unsolvable else 100000.0
+    logdir = args.logdir if args.logdir is not None else logfile.parent
+
+    # every problem gets its own log in the format of single runs
+    problem_files, problem_loggers, pddl_problems = _get_problem_files(args.problems), [], []
+    grounding_cache = _create_grounding_cache(args)
+    for problem_file in problem_files:
+        problem_logger = _get_logger(f'{logger.name}.{problem_file.stem}', logdir / f'{problem_file.stem}{args.log_suffix}', logger.level, False)
+        problem_logger.info(f"Loading PDDL files: domain='{args.domain}', problem='{problem_file}'")
+        pddl_problem = load_pddl_problem_with_augmented_states(args.domain, problem_file, registry_filename, args.registry_key, problem_logger, grounding_cache, args.grounder)
+        del pddl_problem['predicates']
+        problem_logger.info(f'Executing policy (max_length={args.max_length})')
+        problem_loggers.append(problem_logger)
+        pddl_problems.append(pddl_problem)
+
+    logger.info(f'Executing policy on {len(problem_files)} problem(s) in lockstep (max_length={args.max_length})')
+    start_time = timer()
+    results, elapsed_times = compute_traces_for_problems(pddl_problems, model, cycles=args.cycles, max_trace_length=args.max_length, unsolvable_weight=unsolvable_weight, loggers=problem_loggers, is_spanner=is_spanner)
+    elapsed_time = timer() - start_time
+
+    num_solved = 0
+    for problem_file, problem_logger, (action_trace, state_trace, value_trace, is_solution, num_evaluations), problem_time in zip(problem_files, problem_loggers, results, elapsed_times):
+        problem_logger.info(f'{len(action_trace)} executed action(s) and {num_evaluations} state evaluations(s) in {problem_time:.3f} second(s)')
+        _log_result(problem_logger, args, problem_file, action_trace, value_trace, is_solution)
+        logger.info(f"{'Solved' if is_solution else 'Failed'} {problem_file} with {len(action_trace)} action(s)")
+        num_solved += int(is_solution)
+    logger.info(f'Solved {num_solved} of {len(problem_files)} problem(s) in {elapsed_time:.3f} second(s)')
 
 def _main(args):
     global logger
@@ -85,14 +166,22 @@ def _main(args):
     use_cpu = args.cpu #hasattr(args, 'cpu') and args.cpu
     use_gpu = not use_cpu and torch.cuda.is_available()
     device = torch.cuda.current_device() if use_gpu else None
-    Model = _load_model(args)
-    model = Model.load_from_checkpoint(checkpoint_path=str(args.model), strict=False).to(device)
+    model = load_network(args.model, args.aggregation, args.readout, device, args.backend)
+    set_fused_messages(model, args.fused_messages)
+    set_sparse_aggregation(model, args.sparse_aggregation)
+    if args.bf16: model = AutocastNetwork(model)
     elapsed_time = timer() - start_time
     logger.info(f"Model '{args.model}' loaded in {elapsed_time:.3f} second(s)")
+    if args.deterministic: model.set_deterministic()
+    cache = _create_cache(args)
+    if cache is not None and not args.deterministic:
+        logger.warning('Cached evaluations are not reproducible without --deterministic')
+    if args.problems is not None:
+        return _main_problems(args, model)
 
     logger.info(f"Loading PDDL files: domain='{args.domain}', problem='{args.problem}'")
     registry_filename = args.registry_filename if args.augment else None
-    pddl_problem = load_pddl_problem_with_augmented_states(args.domain, args.problem, registry_filename, args.registry_key, logger)
+    pddl_problem = load_pddl_problem_with_augmented_states(args.domain, args.problem, registry_filename, args.registry_key, logger, _create_grounding_cache(args), args.grounder, args.lifted)
     del pddl_problem['predicates'] #  Why?
 
     logger.info(f'Executing policy (max_length={args.max_length})')
@@ -101,24 +190,23 @@ def _main(args):
     unsolvable_weight = 0.0 if args.ignore_unsolvable else 100000.0
 
     if args.serve_policy:
-        return serve_policy(model=model, unsolvable_weight=unsolvable_weight, logger=logger, is_spanner=is_spanner, **pddl_problem)
+        return serve_policy(model=model, unsolvable_weight=unsolvable_weight, logger=logger, is_spanner=is_spanner, cache=cache, **pddl_problem)
     if args.sas:
-        return setup_policy_server(sas_file=args.sas, model=model, unsolvable_weight=unsolvable_weight, **pddl_problem)
-
-    action_trace, state_trace, value_trace, is_solution, num_evaluations = compute_traces_with_augmented_states(model=model, cycles=args.cycles, max_trace_length=args.max_length, unsolvable_weight=unsolvable_weight, logger=logger, is_spanner=is_spanner, **pddl_problem)
-    elapsed_time = timer() - start_time
-    logger.info(f'{len(action_trace)} executed action(s) and {num_evaluations} state evaluations(s) in {elapsed_time:.3f} second(s)')
+        return setup_policy_server(sas_file=args.sas, model=model, unsolvable_weight=unsolvable_weight, cache=cache, **pddl_problem)
 
-    if is_solution:
-        logger.info(colored(f'Found valid plan with {len(action_trace)} action(s) for {args.problem}', 'green', attrs=[ 'bold' ]))
+    if args.search == 'gbfs':
+        action_trace, state_trace, value_trace, is_solution, num_evaluations, num_expansions = compute_traces_with_gbfs(model=model, max_expansions=args.max_expansions, max_time=args.max_time, max_memory=args.max_memory, unsolvable_weight=unsolvable_weight, logger=logger, is_spanner=is_spanner, cache=cache, deferred=args.deferred_evaluation, **pddl_problem)
+        elapsed_time = timer() - start_time
+        logger.info(f'{num_expansions} expansion(s) and {num_evaluations} state evaluation(s) in {elapsed_time:.3f} second(s) ({num_expansions / elapsed_time:.1f} expansions/sec, {num_evaluations / elapsed_time:.1f} evaluations/sec)')
     else:
-        logger.info(colored(f'Failed to find a plan for {args.problem}', 'red', attrs=[ 'bold' ]))
+        if args.search == 'beam':
+            action_trace, state_trace, value_trace, is_solution, num_evaluations = compute_traces_with_beam_search(model=model, beam_width=args.beam_width, max_trace_length=args.max_length, unsolvable_weight=unsolvable_weight, logger=logger, is_spanner=is_spanner, cache=cache, **pddl_problem)
+        else:
+            action_trace, state_trace, value_trace, is_solution, num_evaluations = compute_traces_with_augmented_states(model=model, cycles=args.cycles, max_trace_length=args.max_length, unsolvable_weight=unsolvable_weight, logger=logger, is_spanner=is_spanner, cache=cache, lifted=args.lifted, **pddl_problem)
+        elapsed_time = timer() - start_time
+        logger.info(f'{len(action_trace)} executed action(s) and {num_evaluations} state evaluations(s) in {elapsed_time:.3f} second(s)')
 
-    if args.print_trace:
-        for index, action in enumerate(action_trace):
-            value_from = value_trace[index]
-            value_to = value_trace[index + 1]
-            logger.info('{}: {} (value change: {:.2f} -> {:.2f} {})'.format(index + 1, action.name, float(value_from), float(value_to), 'D' if float(value_from) > float(value_to) else 'I'))
+    _log_result(logger, args, args.problem, action_trace, value_trace, is_solution)
 
 
 def setup(args_string):
@@ -130,18 +218,17 @@ def setup(args_string):
     # load model
     use_cpu = args.cpu  # hasattr(args, 'cpu') and args.cpu
     use_gpu = not use_cpu and torch.cuda.is_available()
-    Model = _load_model(args)
-    if use_gpu:
-        device = torch.cuda.current_device()
-        model = Model.load_from_checkpoint(checkpoint_path=str(args.model), strict=False).to(device)
-    else:
-        device = torch.device('cpu')
-        model = Model.load_from_checkpoint(checkpoint_path=str(args.model), strict=False, map_location=device).to(device)
+    device = torch.cuda.current_device() if use_gpu else torch.device('cpu')
+    model = load_network(args.model, args.aggregation, args.readout, device, args.backend)
+    set_fused_messages(model, args.fused_messages)
+    set_sparse_aggregation(model, args.sparse_aggregation)
+    if args.bf16: model = AutocastNetwork(model)
+    if args.deterministic: model.set_deterministic()
     registry_filename = args.registry_filename if args.augment else None
-    pddl_problem = load_pddl_problem_with_augmented_states(args.domain, args.problem, registry_filename, args.registry_key)
+    pddl_problem = load_pddl_problem_with_augmented_states(args.domain, args.problem, registry_filename, args.registry_key, grounding_cache=_create_grounding_cache(args), grounder=args.grounder)
     del pddl_problem['predicates']  # Why?
     unsolvable_weight = 0.0 if args.ignore_unsolvable else 100000.0
-    return setup_policy_server(sas_file=args.sas, model=model, unsolvable_weight=unsolvable_weight, **pddl_problem)
+    return setup_policy_server(sas_file=args.sas, model=model, unsolvable_weight=unsolvable_weight, cache=_create_cache(args), **pddl_problem)
 
 
 def get_state_size():
@@ -0,0 +1,153 @@
+import sys
+import os.path
+import random
+from sys import argv
+from pathlib import Path
+from timeit import default_timer as timer
+import argparse, logging
+import torch
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from generators import compute_traces_with_augmented_states, load_pddl_problem_with_augmented_states, GroundingCache
+from architecture import load_network, quantize_network
+from datasets import load_file, supervised_collate
+from plan import _get_logger
+
+
+def _parse_arguments():
+    data_path = Path(__file__).parent.parent / 'data'
+    default_aggregation = 'max'
+    default_batch_size = 32
+    default_calibration_states = 20
+    default_grounder = 'lp'
+    default_logfile = 'log_quantize.txt'
+    default_max_length = 500
+    default_max_problems = 10
+    default_mode = 'static'
+    default_models = data_path / 'models'
+    default_pddl = data_path / 'pddl'
+    default_split = 'test'
+    default_states = data_path / 'states' / 'train'
+    default_threads = 1
+
+    parser = argparse.ArgumentParser(description='Experimental: quantize checkpoints to int8 and compare coverage, plan length and speed with the float networks on the problems of each domain; the int8 networks are not written, since they are not faster than float on the CPU so far')
+    parser.add_argument('--aggregation', default=default_aggregation, nargs='?', choices=['add', 'max', 'addmax', 'exactmax', 'addexactmax', 'attention'], help=f'aggregation function for readout (default={default_aggregation})')
+    parser.add_argument('--batch_size', type=int, default=default_batch_size, help=f'number of states in each calibration batch (default={default_batch_size})')
+    parser.add_argument('--calibration_states', type=int, default=default_calibration_states, help=f'number of states sampled from each states file of the domain for static quantization (default={default_calibration_states})')
+    parser.add_argument('--debug_level', dest='debug_level', type=int, default=0, help='set debug level (default=0)')
+    parser.add_argument('--engine', type=str, default=None, choices=torch.backends.quantized.supported_engines, help=f'quantized engine (default={torch.backends.quantized.engine})')
+    parser.add_argument('--grounder', type=str, default=default_grounder, choices=['lp', 'native'], help=f'grounder of the PDDL problems, tarski with gringo or relaxed reachability in Python (default={default_grounder})')
+    parser.add_argument('--grounding_cache', type=Path, default=None, help='directory of the persistent cache of grounded problems (default=no cache)')
+    parser.add_argument('--logfile', type=Path, default=default_logfile, help=f'log file (default={default_logfile})')
+    parser.add_argument('--max_length', type=int, default=default_max_length, help=f'max trace length (default={default_max_length})')
+    parser.add_argument('--max_problems', type=int, default=default_max_problems, help=f'number of problems of each domain in the comparison, 0 only checks that the networks quantize and script (default={default_max_problems})')
+    parser.add_argument('--mode', type=str, default=default_mode, choices=['static', 'dynamic'], help=f'static quantization calibrated on the states of the domain, or dynamic quantization (default={default_mode})')
+    parser.add_argument('--models', type=Path, nargs='+', default=[ default_models ], help=f'checkpoints or folders with one subfolder per domain with its checkpoint (default={default_models})')
+    parser.add_argument('--pddl', type=Path, default=default_pddl, help=f'folder with one subfolder per domain (default={default_pddl})')
+    parser.add_argument('--readout', action='store_true', help='use global readout')
+    parser.add_argument('--split', type=str, default=default_split, help=f'subfolder of each domain with problems (default={default_split})')
+    parser.add_argument('--states', type=Path, default=default_states, help=f'folder with the states files of each domain for calibration (default={default_states})')
+    parser.add_argument('--threads', type=int, default=default_threads, help=f'number of threads (default={default_threads})')
+    return parser.parse_args()
+
+def _get_checkpoints(paths):
+    # the domain of a checkpoint is the name of its folder
+    checkpoints = []
+    for path in paths:
+        if path.is_dir(): checkpoints.extend(sorted(path.rglob('*.ckpt')))
+        else: checkpoints.append(path)
+    return checkpoints
+
+def _calibration_batches(args, domain: str):
+    # batches of states sampled from the states files of the domain, as in training
+    random.seed(0)
+    states = []
+    for file in sorted((args.states / domain).rglob('*.states')):
+        _, labeled_states, _ = load_file(file, args.calibration_states)
+        states.extend([ (state, label) for label, state, _ in labeled_states ])
+    return [ supervised_collate(states[index:index + args.batch_size])[0] for index in range(0, len(states), args.batch_size) ]
+
+def _run(args, model, pddl_problem, is_spanner: bool):
+    # (solved, plan length, state evaluations, seconds) of the policy of model
+    start_time = timer()
+    action_trace, _, _, is_solution, num_evaluations = compute_traces_with_augmented_states(model=model, cycles='avoid', max_trace_length=args.max_length, unsolvable_weight=100000.0, logger=logger, is_spanner=is_spanner, **pddl_problem)
+    return is_solution, len(action_trace), num_evaluations, timer() - start_time
+
+def _compare(args, domain: str, network, quantized):
+    # runs both networks with fixed noise on the first problems of the domain and returns the results of each
+    domain_file = args.pddl / domain / args.split / 'domain.pddl'
+    problems = sorted([ path for path in (args.pddl / domain / args.split).glob('*.pddl') if path.name != 'domain.pddl' ])[:args.max_problems]
+    grounding_cache = GroundingCache(args.grounding_cache) if args.grounding_cache is not None else None
+    network.set_deterministic()
+    quantized.set_deterministic()
+    results = []
+    for problem in problems:
+        pddl_problem = load_pddl_problem_with_augmented_states(domain_file, problem, None, None, logger, grounding_cache, args.grounder)
+        del pddl_problem['predicates']
+        is_spanner = 'spanner' in domain
+        result = (_run(args, network, pddl_problem, is_spanner), _run(args, quantized, pddl_problem, is_spanner))
+        logger.info(f'{domain}/{problem.stem}: ' + ', '.join([ f"{name} {'solved' if solved else 'failed'} with {length} action(s) in {elapsed_time:.3f} second(s)" for name, (solved, length, _, elapsed_time) in zip([ 'float', 'int8' ], result) ]))
+        results.append(result)
+    return results
+
+def _summary(domain: str, results):
+    # coverage, mean plan length on the problems that both solve, and evaluations per second of each network
+    solved = [ sum([ int(result[index][0]) for result in results ]) for index in range(2) ]
+    common = [ result for result in results if result[0][0] and result[1][0] ]
+    lengths = [ sum([ result[index][1] for result in common ]) / max(1, len(common)) for index in range(2) ]
+    speeds = [ sum([ result[index][2] for result in results ]) / max(1e-9, sum([ result[index][3] for result in results ])) for index in range(2) ]
+    return f'{domain:<24} {len(results):>8} {solved[0]:>6} {solved[1]:>6} {solved[1] - solved[0]:>+6} {lengths[0]:>8.2f} {lengths[1]:>8.2f} {lengths[1] - lengths[0]:>+7.2f} {speeds[0]:>9.1f} {speeds[1]:>9.1f} {speeds[1] / max(1e-9, speeds[0]):>7.2f}x'
+
+def _main(args):
+    global logger
+    torch.set_num_threads(args.threads)
+    summaries = []
+    for checkpoint in _get_checkpoints(args.models):
+        domain = checkpoint.parent.name
+        start_time = timer()
+        network = load_network(checkpoint, args.aggregation, args.readout, torch.device('cpu'))
+        calibration = _calibration_batches(args, domain) if args.mode == 'static' else None
+        if calibration is not None and len(calibration) == 0:
+            logger.warning(f"{domain}: skipped, no states files in '{args.states / domain}' for calibration")
+            continue
+        quantized = quantize_network(network, args.mode, calibration, args.engine)
+
+        # a quantized network is only usable as TorchScript, so a checkpoint whose network doesn't script is skipped
+        try:
+            torch.jit.script(quantized)
+        except Exception as e:
+            logger.error(f"{domain}: '{checkpoint}' quantized ({args.mode}) but not scriptable, skipped: {str(e).strip().splitlines()[0]}")
+            continue
+        logger.info(f"Quantized '{checkpoint}' ({args.mode}) in {timer() - start_time:.3f} second(s)")
+
+        if args.max_problems > 0 and (args.pddl / domain / args.split / 'domain.pddl').exists():
+            summaries.append(_summary(domain, _compare(args, domain, network, quantized)))
+
+    if len(summaries) > 0:
+        logger.info('Comparison of the float and int8 networks (length on problems solved by both, speed in state evaluations per second):')
+        logger.info(f"{'domain':<24} {'problems':>8} {'float':>6} {'int8':>6} {'delta':>6} {'len.fp':>8} {'len.int8':>8} {'delta':>7} {'eval/s.fp':>9} {'eval/s.i8':>9} {'speedup':>8}")
+        for summary in summaries: logger.info(summary)
+
+
+if __name__ == "__main__":
+    # setup timer and exec name
+    entry_time = timer()
+    exec_path = Path(argv[0]).parent
+    exec_name = Path(argv[0]).stem
+
+    # parse arguments
+    args = _parse_arguments()
+
+    # setup logger
+    log_path = exec_path
+    logfile = log_path / args.logfile
+    log_level = logging.INFO if args.debug_level == 0 else logging.DEBUG
+    logger = _get_logger(exec_name, logfile, log_level)
+    logger.info(f'Call: {" ".join(argv)}')
+
+    # do jobs
+    _main(args)
+
+    # final stats
+    elapsed_time = timer() - entry_time
+    logger.info(f'All tasks completed in {elapsed_time:.3f} second(s)')
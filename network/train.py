@@ -3,7 +3,7 @@ from termcolor import colored
 import pytorch_lightning as pl
 import torch
 
-from architecture import set_suboptimal_factor, set_loss_constants
+from architecture import set_suboptimal_factor, set_loss_constants, set_checkpoint_iterations, set_fused_messages
 from helpers import ValidationLossLogging
 from pathlib import Path
 from pytorch_lightning.callbacks.early_stopping import EarlyStopping
@@ -22,6 +22,7 @@ def _parse_arguments():
     default_aggregation = 'max'
     default_size = 64
     default_iterations = 30
+    default_checkpoint_iterations = 0
     default_batch_size = 64
     default_gpus = 1
     default_num_workers = 0
@@ -46,10 +47,13 @@ def _parse_arguments():
     parser.add_argument('--resume', default=None, type=Path, help='path to model (.ckpt) for resuming training')
 
     # arguments with meaningful default values
-    parser.add_argument('--aggregation', default=default_aggregation, nargs='?', choices=['add', 'max', 'addmax', 'attention'], help=f'readout aggregation function (default={default_aggregation})')
+    parser.add_argument('--aggregation', default=default_aggregation, nargs='?', choices=['add', 'max', 'addmax', 'exactmax', 'addexactmax', 'attention'], help=f'readout aggregation function (default={default_aggregation})')
     parser.add_argument('--size', default=default_size, type=int, help=f'number of features per object (default={default_size})')
     parser.add_argument('--iterations', default=default_iterations, type=int, help=f'number of convolutions (default={default_iterations})')
     parser.add_argument('--readout', action='store_true', help=f'use global readout at each iteration')
+    parser.add_argument('--fused_messages', action='store_true', help='run the relation MLPs of the same arity as one batched matmul, faster on GPUs')
+    parser.add_argument('--bf16', action='store_true', help='train with bfloat16 autocast (Lightning bf16 precision), the readouts and heads stay in float32')
+    parser.add_argument('--checkpoint_iterations', default=default_checkpoint_iterations, type=int, help=f'recompute the activations of every N iterations in the backward pass instead of keeping them, which trades time for memory, 0 keeps all (default={default_checkpoint_iterations})')
     parser.add_argument('--batch_size', default=default_batch_size, type=int, help=f'maximum size of batches (default={default_batch_size})')
     parser.add_argument('--gpus', default=default_gpus, type=int, help=f'number of GPUs to use (default={default_gpus})')
     parser.add_argument('--num_workers', default=default_num_workers, type=int, help=f'number of workers for the data loader (use 0 on Windows) (default={default_num_workers})')
@@ -140,6 +144,8 @@ def _load_model(args, predicates):
 
     if args.resume is None: model = Model(**model_params)
     else: model = Model.load_from_checkpoint(checkpoint_path=str(args.resume), strict=False)
+    set_fused_messages(model, args.fused_messages)
+    set_checkpoint_iterations(model, args.checkpoint_iterations)
     return model
 
 def _load_trainer(args):
@@ -155,6 +161,7 @@ def _load_trainer(args):
         "weights_summary": None,
         "auto_lr_find": True,
         "profiler": args.profiler,
+        "precision": 'bf16' if args.bf16 else 32,
         "accumulate_grad_batches": args.gradient_accumulation,
         "gradient_clip_val": args.gradient_clip,
         "check_val_every_n_epoch": args.validation_frequency,